@@ -2,10 +2,15 @@
 
 import argparse
 import os
-import re
 import shutil
-import subprocess
 import textwrap
+import threading
+import time
+from contextlib import contextmanager
+
+from mp3tagger.fileops import FileOps
+from mp3tagger.ioengine import DEFAULT_ENGINE, IOEngine
+from mp3tagger.names import DEFAULT_NAMES, FileNameParser
 
 
 class MyException(Exception):
@@ -16,6 +21,10 @@ class MyException(Exception):
         self.msg = msg
 
 
+class RecoveryNeeded(MyException):
+    """Raised when a file needs recovering before it can be tagged"""
+
+
 class RawFormatter(argparse.HelpFormatter):
     """Help formatter to split the text on newlines and indent each line"""
 
@@ -29,55 +38,127 @@ class RawFormatter(argparse.HelpFormatter):
         )
 
 
+# pylint: disable-next=protected-access
+class VersionAction(argparse._VersionAction):
+    """--version action taking a distribution name, whose version is only looked up if the
+    option is used, as reading package metadata is slow"""
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        """Print the version of the distribution and exit"""
+        from importlib.metadata import version  # pylint: disable=import-outside-toplevel
+
+        self.version = version(self.version)
+        super().__call__(parser, namespace, values, option_string)
+
+
+class StageTimer:
+    """Accumulate the time and bytes spent in each stage of processing"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seconds = {}
+        self.bytes = {}
+
+    def add(self, stage, seconds, nbytes=0):
+        """Add time and bytes to a stage"""
+        with self.lock:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+            self.bytes[stage] = self.bytes.get(stage, 0) + nbytes
+
+    @contextmanager
+    def stage(self, stage, nbytes=0):
+        """Time the body of a with statement as part of stage"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(stage, time.monotonic() - start, nbytes)
+
+
+class _cached:  # pylint: disable=invalid-name,too-few-public-methods
+    """Property worked out on first use and kept in the slot of the same name with a
+    leading underscore"""
+
+    def __init__(self, func):
+        self.func = func
+        self.slot = "_" + func.__name__
+        self.__doc__ = func.__doc__
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        value = getattr(obj, self.slot)
+        if value is None:
+            value = self.func(obj)
+            setattr(obj, self.slot, value)
+        return value
+
+
 class MyData:
     """Class to hold data"""
 
-    def __init__(self, input_file, dest_dir, backup_dir, reject_dir):
+    __slots__ = (
+        "_input_file",
+        "_job_id",
+        "_stat",
+        "_dest_root",
+        "_backup_root",
+        "_reject_root",
+        "_basedir",
+        "_album_name",
+        "_release_date",
+        "_basename",
+        # Cached by _cached properties
+        "_album_dir",
+        "_reject_dir",
+        "_reject_file",
+        "_output_file",
+        "_backup_dir",
+        "_backup_file",
+        "_full_release_date",
+        "_temp_fn",
+    )
+
+    def __init__(
+        self, input_file, dest_dir, backup_dir, reject_dir, job_id=None, stat=None, names=None
+    ):  # pylint: disable=too-many-arguments
         self._input_file = input_file
-        self._dest_dir = dest_dir
-        self._backup_dir = backup_dir
-        self._reject_dir = reject_dir
-        self._basedir = None
-        self._album_name = None
-        self._release_date = None
-        self._basename = None
-        self._split_filename()
-
-    def _split_filename(self):
+        self._job_id = job_id
+        self._stat = stat
+        self._dest_root = dest_dir
+        self._backup_root = backup_dir
+        self._reject_root = reject_dir
+        self._album_dir = self._reject_dir = self._reject_file = self._output_file = None
+        self._backup_dir = self._backup_file = self._full_release_date = self._temp_fn = None
+        self._split_filename(names or DEFAULT_NAMES)
+
+    def _split_filename(self, names: FileNameParser):
         """Split a file name into constituents"""
-        pattern = re.search(
-            r"^(.*/([^/]*))/pod_[0-9]{2}([0-9]{2})-([0-9]*)-([0-9]*)-(.*)\.mp3",
-            self._input_file,
-        )
-        if not pattern:
-            # Try files in format ../program_name/220502-My_podcast_name.mp3
-            pattern = re.search(
-                r"^(.*/([^/]*))/([0-9]{2})([0-9]{2})([0-9]{2})-(.*)\.mp3", self._input_file
-            )
-            if not pattern:
-                raise MyException(code=1, msg=f"{self._input_file} - invalid file-name format")
-        (self._basedir, self._album_name, year, month, day, self._basename) = pattern.groups()
-        if len(year) == 4:
-            year = year[2:]
-        self._release_date = f"{year}{month}{day}"
-
-    @property
+        self._basedir, _, file_name = self._input_file.rpartition("/")
+        # The file must be in an album directory
+        fields = names.match(file_name) if "/" in self._basedir else None
+        if fields is None:
+            raise MyException(code=1, msg=f"{self._input_file} - invalid file-name format")
+        self._album_name = self._basedir.rpartition("/")[2]
+        self._release_date, self._basename = fields
+
+    @_cached
     def album_dir(self):
         """Return the album directory"""
-        return str(os.path.join(self._dest_dir, self._album_name))
+        return os.path.join(self._dest_root, self._album_name)
 
-    @property
+    @_cached
     def reject_dir(self):
         """Return the reject directory"""
-        return str(os.path.join(self._reject_dir, self._album_name))
+        return os.path.join(self._reject_root, self._album_name)
 
-    @property
+    @_cached
     def reject_file(self):
         """Return the reject file"""
         fn = "pod_" + self.full_release_date + "-" + self._basename + ".mp3"
         return os.path.join(self.reject_dir, fn)
 
-    @property
+    @_cached
     def output_file(self):
         """Return the album file"""
         return os.path.join(self.album_dir, self._release_date + "-" + self._basename + ".mp3")
@@ -87,12 +168,12 @@ class MyData:
         """Return the album name"""
         return self._album_name
 
-    @property
+    @_cached
     def backup_dir(self):
         """Return the backup directory"""
-        return str(os.path.join(self._backup_dir, self._album_name))
+        return os.path.join(self._backup_root, self._album_name)
 
-    @property
+    @_cached
     def backup_file(self):
         """Return the backup file"""
         fn = "pod_" + self.full_release_date + "-" + self._basename + ".mp3"
@@ -102,39 +183,47 @@ class MyData:
     @property
     def dest_dir(self):
         """Return the destination directory"""
-        return self._dest_dir
+        return self._dest_root
 
     @property
     def input_file(self):
         """Return the input file"""
         return self._input_file
 
+    @property
+    def stat(self):
+        """Return the stat of the input file, taken when it was first needed"""
+        if self._stat is None:
+            self._stat = os.stat(self._input_file)
+        return self._stat
+
     @property
     def release_date(self):
         """Return the release date"""
         return self._release_date
 
-    @property
+    @_cached
     def full_release_date(self):
         """Return the full release date"""
-        return (
-            "20"
-            + self._release_date[:2]
-            + "-"
-            + self._release_date[2:4]
-            + "-"
-            + self._release_date[4:]
-        )
+        date = self._release_date
+        return f"20{date[:2]}-{date[2:4]}-{date[4:]}"
 
     @property
     def release_year(self):
         """Return the release year"""
         return "20" + self._release_date[:2]
 
-    @property
+    @_cached
     def temp_fn(self):
-        """Return the temporary file name"""
-        return os.path.join(self._dest_dir, "temp.mp3")
+        """Return the temporary file name - unique per job so workers don't collide"""
+        if self._job_id is None:
+            return os.path.join(self._dest_root, "temp.mp3")
+        return os.path.join(self._dest_root, f"temp-{self._job_id}.mp3")
+
+    @property
+    def recover_fn(self):
+        """Return the file name ffmpeg writes its recovered output to"""
+        return self.temp_fn[:-4] + "-recover.mp3"
 
     @property
     def basename(self):
@@ -160,33 +249,110 @@ class MyData:
         }
 
 
-def copy_to_temp(md: MyData):
+def parse_file_names(
+    file_names, dest_dir, backup_dir, reject_dir, stats=None, names=None
+):  # pylint: disable=too-many-arguments
+    """Return the MyData for each file name, or the MyException raised for it if its name
+    isn't in a known format, in the same order. Paths are only built when first used"""
+    stats = stats or [None] * len(file_names)
+    parsed = []
+    for file_name, stat in zip(file_names, stats):
+        try:
+            parsed.append(
+                MyData(file_name, dest_dir, backup_dir, reject_dir, stat=stat, names=names)
+            )
+        except MyException as inst:
+            parsed.append(inst)
+    return parsed
+
+
+def copy_to_temp(md: MyData, engine: IOEngine = None):
     """Copy the input file to a temporary file"""
     os.makedirs(md.album_dir, exist_ok=True)
-    shutil.copy(md.input_file, md.temp_fn)
+    (engine or DEFAULT_ENGINE).copy_file(md.input_file, md.temp_fn)
     return 0
 
 
-def move_to_final(md: MyData):
+def _visible(entry):
+    """Return True if the directory entry isn't hidden"""
+    return not entry.name.startswith(".")
+
+
+def scan_source(source_dir):
+    """Yield (album name, DirEntry list) for each album directory in source_dir, in the same
+    order as sorted(glob(f"{source_dir}/*/*.mp3")), reading one album directory at a time"""
+    with os.scandir(source_dir) as it:
+        albums = [entry for entry in it if _visible(entry) and entry.is_dir()]
+    # Sort as full paths would sort, with the "/" following the album name
+    albums.sort(key=lambda entry: entry.name + "/")
+    for album in albums:
+        with os.scandir(album.path) as it:
+            episodes = [
+                entry
+                for entry in it
+                if entry.name.endswith(".mp3") and _visible(entry) and entry.is_file()
+            ]
+        if episodes:
+            episodes.sort(key=lambda entry: entry.name)
+            yield album.name, episodes
+
+
+def copy_range(src_fd, dst_fd, offset, count, engine: IOEngine = None):
+    """Append count bytes from offset in src_fd to dst_fd, in the kernel where possible"""
+    (engine or DEFAULT_ENGINE).copy_range(src_fd, dst_fd, offset, count)
+
+
+def write_with_header(
+    md: MyData,
+    header,
+    body_start: int,
+    body_end: int,
+    trailer=b"",
+    engine: IOEngine = None,
+    digest=None,
+):  # pylint: disable=too-many-arguments
+    """Write header + input_file[body_start:body_end] + trailer to the temporary file
+    in one pass, instead of copying the file and rewriting it. header is bytes, or a list
+    of bytes and (offset, length) ranges of the input file. The whole input file is added
+    to digest (a hashlib object) if one is given, as the audio goes past"""
+    engine = engine or DEFAULT_ENGINE
+    with open(md.input_file, "rb") as src, open(md.temp_fn, "wb", buffering=0) as dst:
+        for part in [header] if isinstance(header, bytes) else header:
+            if isinstance(part, tuple):
+                engine.copy_range(src.fileno(), dst.fileno(), *part)
+            else:
+                dst.write(part)
+        if digest is not None:
+            digest.update(os.pread(src.fileno(), body_start, 0))
+        engine.copy_range(src.fileno(), dst.fileno(), body_start, body_end - body_start, digest)
+        if digest is not None:
+            digest.update(os.pread(src.fileno(), md.stat.st_size - body_end, body_end))
+        dst.write(trailer)
+        engine.finish(dst.fileno())
+    return 0
+
+
+def move_to_final(md: MyData, ops: FileOps = None):
     """Move the temporary file to the final file"""
-    shutil.move(md.temp_fn, md.output_file)
+    ops = ops or FileOps()
+    ops.move(md.temp_fn, md.output_file)
     shutil.copystat(src=md.input_file, dst=md.output_file)
     return 0
 
 
-def move_to_reject(md: MyData):
+def move_to_reject(md: MyData, ops: FileOps = None):
     """Move the input file to the reject folder"""
-    os.makedirs(md.reject_dir, exist_ok=True)
-    shutil.move(md.input_file, md.reject_file)
+    ops = ops or FileOps()
+    ops.move(md.input_file, md.reject_file)
     if os.path.isfile(md.temp_fn):
         os.remove(md.temp_fn)
     return 0
 
 
-def save_original_file(md: MyData):
+def save_original_file(md: MyData, ops: FileOps = None):
     """Save the original file"""
-    os.makedirs(md.backup_dir, exist_ok=True)
-    shutil.move(md.input_file, md.backup_file)
+    ops = ops or FileOps()
+    ops.move(md.input_file, md.backup_file)
     return 0
 
 
@@ -194,29 +360,3 @@ def remove_temp_file(md: MyData):
     """Remove the temporary file"""
     os.remove(md.temp_fn)
     return 0
-
-
-def ffmpeg_recover(md: MyData):
-    """Try to make mp3 readable using ffmpeg"""
-    temp_file = "/tmp/mp3tagger_ffmpeg_recover.mp3"
-    result = None
-    try:
-        try:
-            print(f"\n **** Trying to recover\n{md.input_file}\nusing ffmpeg ****")
-            result = subprocess.run(
-                ["ffmpeg", "-y", "-i", md.temp_fn, temp_file], check=False, capture_output=True
-            )
-        except FileNotFoundError as e:
-            if e.errno == 2 and e.filename == "ffmpeg":
-                raise MyException(code=1, msg="ffmpeg not found") from None
-        if result.returncode == 0:
-            shutil.move(temp_file, md.temp_fn)
-            return 0
-    except MyException as e:
-        print(f"\n **** {e.msg} ****\n")
-    # except subprocess.CalledProcessError as e:
-    #     print(e)
-
-    if os.path.isfile(temp_file):
-        os.remove(temp_file)
-    return 1
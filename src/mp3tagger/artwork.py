@@ -0,0 +1,78 @@
+"""Shrink embedded cover art, transcoding each image once"""
+
+import hashlib
+import io
+import os
+import threading
+
+JPEG_MIME = "image/jpeg"
+JPEG_QUALITY = 85
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def image_digest(data):
+    """Return the sha256 of image data (bytes or a memoryview of an mmap)"""
+    digest = hashlib.sha256()
+    for offset in range(0, len(data), HASH_CHUNK_SIZE):
+        digest.update(data[offset : offset + HASH_CHUNK_SIZE])
+    return digest.hexdigest()
+
+
+def transcode(data, max_size, quality=JPEG_QUALITY):
+    """Return the image scaled to fit max_size x max_size as JPEG, or None if it's a JPEG
+    which already fits, is smaller than the JPEG would be, or can't be read"""
+    # Pillow is optional, and only needed when artwork_max_size is set
+    from PIL import Image, UnidentifiedImageError  # pylint: disable=import-outside-toplevel
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            fits = max(image.size) <= max_size
+            if fits and image.format == "JPEG":
+                return None
+            image.thumbnail((max_size, max_size))
+            output = io.BytesIO()
+            image.convert("RGB").save(output, "JPEG", quality=quality, optimize=True)
+    except (OSError, UnidentifiedImageError, ValueError):
+        return None
+    if fits and output.tell() >= len(data):
+        return None
+    return output.getvalue()
+
+
+class ArtworkCache:
+    """Content addressed store of transcoded artwork under cache_dir. Every episode of an
+    album usually has the same image, so it is only transcoded for the first one. An empty
+    entry means the image is kept as it is"""
+
+    def __init__(self, cache_dir, max_size, transcoder=transcode):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.transcoder = transcoder
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def entry(self, digest):
+        """Return the cache file for an image"""
+        return os.path.join(self.cache_dir, digest[:2], f"{digest}-{self.max_size}.jpg")
+
+    def normalised(self, data):
+        """Return the replacement for image data, or None to keep it"""
+        entry = self.entry(image_digest(data))
+        try:
+            with open(entry, "rb") as f:
+                replacement = f.read()
+            with self.lock:
+                self.hits += 1
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+            replacement = self.transcoder(bytes(data), self.max_size) or b""
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+            # Written under a unique name and renamed, as other workers may want it too
+            temp_file = f"{entry}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_file, "wb") as f:
+                f.write(replacement)
+            os.replace(temp_file, entry)
+        return replacement or None
@@ -0,0 +1,153 @@
+""" Benchmark the tagging pipeline on a synthetic source tree"""
+
+import argparse
+import contextlib
+import os
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+
+from mutagen.id3 import ID3, TALB, TIT2, TYER
+
+from mp3tagger._util import RawFormatter
+from mp3tagger.tagger import Mp3Tagger
+
+# An MPEG-1 layer III frame at 128 kbit/s, 44.1 kHz - silent, but enough for mutagen
+FRAME_HEADER = b"\xff\xfb\x90\x64"
+FRAME_SIZE = 417
+FRAME = FRAME_HEADER + bytes(FRAME_SIZE - len(FRAME_HEADER))
+
+# Pushes the first frame beyond where mutagen looks for it, so the file needs recovering
+CORRUPT_PREFIX = b"<html>" * (200 * 1024)
+
+# Kinds of episode generated, in rotation
+EPISODE_KINDS = ("id3v2.3", "id3v2.4", "untagged", "corrupt")
+
+MB = 1024 * 1024
+
+
+def write_episode(file_name, kind, size, title):
+    """Write a synthetic episode of roughly size bytes"""
+    with open(file_name, "wb") as f:
+        if kind == "corrupt":
+            f.write(CORRUPT_PREFIX)
+        f.write(FRAME * max(4, size // FRAME_SIZE))
+    if kind in ("id3v2.3", "id3v2.4"):
+        tags = ID3()
+        tags.add(TIT2(encoding=3, text=title))
+        tags.add(TALB(encoding=3, text="Some other album"))
+        if kind == "id3v2.3":
+            tags.add(TYER(encoding=3, text="2024"))
+        tags.save(file_name, v2_version=int(kind[-1]))
+
+
+def make_source_tree(source_dir, albums, episodes, min_size, max_size, seed=0):
+    """Create albums x episodes synthetic episodes of between min_size and max_size bytes,
+    returning the total number of bytes written"""
+    rng = random.Random(seed)
+    first_day = date(2024, 1, 1)
+    total = 0
+    for album in range(albums):
+        album_dir = os.path.join(source_dir, f"Album_{album:04d}")
+        os.makedirs(album_dir, exist_ok=True)
+        for episode in range(episodes):
+            day = first_day + timedelta(days=episode)
+            name = f"Episode_{episode:04d}"
+            if episode % 2:
+                file_name = f"pod_{day:%Y-%m-%d}-{name}.mp3"
+            else:
+                file_name = f"{day:%y%m%d}-{name}.mp3"
+            kind = EPISODE_KINDS[(album + episode) % len(EPISODE_KINDS)]
+            file_name = os.path.join(album_dir, file_name)
+            write_episode(file_name, kind, rng.randint(min_size, max_size), f"123 - {name}")
+            total += os.path.getsize(file_name)
+    return total
+
+
+def run_benchmark(work_dir, args):
+    """Build the source tree under work_dir, process it and return
+    (files, bytes, seconds, stage timer)"""
+    tagger = Mp3Tagger()
+    tagger.source_dir = os.path.join(work_dir, "download")
+    tagger.dest_dir = os.path.join(work_dir, "mp3")
+    tagger.backup_dir = os.path.join(work_dir, "backup")
+    tagger.reject_dir = os.path.join(work_dir, "rejects")
+    for directory in (tagger.source_dir, tagger.dest_dir, tagger.backup_dir, tagger.reject_dir):
+        os.makedirs(directory, exist_ok=True)
+    total_bytes = make_source_tree(
+        tagger.source_dir,
+        args.albums,
+        args.episodes,
+        int(args.min_size * MB),
+        int(args.max_size * MB),
+        args.seed,
+    )
+    tagger.jobs = args.jobs
+    tagger.pipeline = args.pipeline
+    tagger.remove_source_file = args.remove_source_file
+    tagger.journal_file = os.path.join(work_dir, "journal.jsonl")
+    start = time.monotonic()
+    with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+        tagger.process()
+    return args.albums * args.episodes, total_bytes, time.monotonic() - start, tagger.timer
+
+
+def print_report(files, total_bytes, seconds, timer):
+    """Print throughput and the split of time between stages"""
+    print(f"Files:      {files}")
+    print(f"Data:       {total_bytes / MB:.1f} MB")
+    print(f"Elapsed:    {seconds:.3f} s")
+    print(f"Throughput: {files / seconds:.1f} files/s, {total_bytes / MB / seconds:.1f} MB/s")
+    stage_total = sum(timer.seconds.values()) or 1.0
+    print(f"{'Stage':<10} {'Seconds':>9} {'Share':>7} {'MB':>9}")
+    for stage, stage_seconds in sorted(timer.seconds.items(), key=lambda item: -item[1]):
+        print(
+            f"{stage:<10} {stage_seconds:>9.3f} {stage_seconds / stage_total:>7.1%}"
+            f" {timer.bytes[stage] / MB:>9.1f}"
+        )
+
+
+def main():
+    """Main entry point"""
+    parser = argparse.ArgumentParser(
+        formatter_class=RawFormatter,
+        description="Benchmark mp3tagger on a synthetic tree of albums x episodes",
+    )
+    parser.add_argument("-a", "--albums", type=int, default=10, help="Number of albums")
+    parser.add_argument("-e", "--episodes", type=int, default=20, help="Episodes per album")
+    parser.add_argument("--min-size", type=float, default=0.5, help="Smallest episode in MB")
+    parser.add_argument("--max-size", type=float, default=2.0, help="Largest episode in MB")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Files to process in parallel")
+    parser.add_argument(
+        "-P",
+        "--pipeline",
+        action="store_true",
+        default=False,
+        help="Read, tag and write consecutive files at the same time",
+    )
+    parser.add_argument(
+        "-r",
+        "--remove-source_file",
+        action="store_true",
+        default=False,
+        help="Move the source files to the backup folder",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the episode sizes")
+    parser.add_argument(
+        "-d",
+        "--dir",
+        default=None,
+        help="Directory to build the tree in (default: a temporary directory)",
+    )
+    args = parser.parse_args()
+    if args.dir is not None:
+        os.makedirs(args.dir, exist_ok=True)
+        print_report(*run_benchmark(args.dir, args))
+        return
+    with tempfile.TemporaryDirectory(prefix="mp3tagger-bench-") as work_dir:
+        print_report(*run_benchmark(work_dir, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,8 @@ from pathlib import Path
 
 import appdirs
 
+from mp3tagger._util import MyException
+
 PROJECT_ROOT = Path(__file__).parent.parent.parent
 
 # Config file provided as part of the package
@@ -59,3 +61,11 @@ def read_config(section, ini_path=None):
     # The 2nd file overrides the 1st one
     config.read(configs_to_read)
     return dict(config[section])
+
+
+def config_bool(value):
+    """Convert a config value such as yes/no, on/off or 1/0 to a bool"""
+    try:
+        return ConfigParser.BOOLEAN_STATES[str(value).lower()]
+    except KeyError:
+        raise MyException(msg=f"Invalid boolean value: {value}", code=1) from None
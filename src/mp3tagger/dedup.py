@@ -0,0 +1,88 @@
+"""Find episodes which were downloaded more than once"""
+
+import hashlib
+import mmap
+import threading
+
+from mp3tagger.id3handler import ID3V1_SIZE
+from mp3tagger.index import HASH_CHUNK_SIZE
+from mp3tagger.recover import id3v2_size
+
+
+def audio_hash(file_name):
+    """Return the sha256 of the audio in the file, leaving out the ID3v2 header and ID3v1
+    trailer so copies with different tags match"""
+    digest = hashlib.sha256()
+    with open(file_name, "rb") as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file
+            return digest.hexdigest()
+    with data:
+        start = id3v2_size(data)
+        end = len(data)
+        if end - start >= ID3V1_SIZE and data[end - ID3V1_SIZE : end - ID3V1_SIZE + 3] == b"TAG":
+            end -= ID3V1_SIZE
+        with memoryview(data) as view:
+            for offset in range(start, end, HASH_CHUNK_SIZE):
+                digest.update(view[offset : min(offset + HASH_CHUNK_SIZE, end)])
+    return digest.hexdigest()
+
+
+class DuplicateFinder:
+    """Spot episodes whose audio is the same as an episode in the same album, either earlier
+    in this run or (with an index) in a previous run"""
+
+    def __init__(self, index=None):
+        self.lock = threading.Lock()
+        self.index = index
+        # Audio key -> the first file in this run with that audio
+        self.claimed = {}
+        # Input file -> its audio key
+        self.keys = {}
+        # Input file -> Event set once it has been recorded or released, for claims still
+        # being processed
+        self.in_flight = {}
+
+    def claim(self, input_file, album_name):
+        """Return the earlier file with the same audio as input_file, or None if input_file
+        is the first, in which case it is remembered for the files which follow. If the
+        earlier file is still being processed, wait to see whether it is rejected"""
+        key = album_name + "/" + audio_hash(input_file)
+        while True:
+            with self.lock:
+                earlier = self.claimed.get(key)
+                if earlier is None and self.index is not None:
+                    earlier = self.index.find_audio(key)
+                if earlier is None:
+                    self.claimed[key] = input_file
+                    self.keys[input_file] = key
+                    self.in_flight[input_file] = threading.Event()
+                    return None
+                settled = self.in_flight.get(earlier)
+            if settled is None:
+                return earlier
+            settled.wait()
+
+    def _settle(self, input_file):
+        """Wake the files waiting for input_file's outcome - called holding the lock"""
+        settled = self.in_flight.pop(input_file, None)
+        if settled is not None:
+            settled.set()
+
+    def release(self, input_file):
+        """Forget a claim, as the file couldn't be processed (yet)"""
+        with self.lock:
+            key = self.keys.pop(input_file, None)
+            if key is not None:
+                del self.claimed[key]
+            self._settle(input_file)
+
+    def record(self, input_file, output_file):
+        """Remember the output made from input_file for later runs"""
+        with self.lock:
+            key = self.keys.get(input_file)
+            self._settle(input_file)
+        if key is not None and self.index is not None:
+            self.index.record_audio(key, output_file)
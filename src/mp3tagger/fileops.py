@@ -0,0 +1,93 @@
+"""Move files into place with as few system calls and copies as possible"""
+
+import errno
+import os
+import threading
+
+from mp3tagger.ioengine import DEFAULT_ENGINE
+
+
+class FileOps:
+    """File moves for a run. Remembers the directories it has created, renames when both
+    paths are on the same device (checked once per root directory), records moves which
+    had to fall back to a copy, and fsyncs the directories it touched in one batch"""
+
+    def __init__(self, roots=(), engine=None):
+        self.lock = threading.Lock()
+        # IOEngine used when a move has to copy
+        self.engine = engine or DEFAULT_ENGINE
+        self.made_dirs = set()
+        self.touched_dirs = set()
+        self.fallbacks = []
+        # Longest first so nested roots match before their parents
+        self.root_devices = sorted(
+            ((os.path.join(root, ""), os.stat(root).st_dev) for root in roots),
+            key=lambda item: -len(item[0]),
+        )
+
+    def device(self, path):
+        """Return the device of the root directory containing path, or None if path isn't
+        under one of the roots"""
+        for root, device in self.root_devices:
+            if path.startswith(root):
+                return device
+        return None
+
+    def makedirs(self, path):
+        """Create a directory (and its parents) unless this run has already done so"""
+        if path in self.made_dirs:
+            return
+        os.makedirs(path, exist_ok=True)
+        with self.lock:
+            self.made_dirs.add(path)
+
+    def move(self, src, dst):
+        """Move src to dst, creating the destination directory if needed"""
+        dst_dir = os.path.dirname(dst)
+        self.makedirs(dst_dir)
+        src_device = self.device(src)
+        if src_device is None or src_device == self.device(dst):
+            try:
+                self._rename(src, dst)
+                self._touch(os.path.dirname(src), dst_dir)
+                return
+            except OSError as e:
+                # A mount point below one of the roots
+                if e.errno != errno.EXDEV:
+                    raise
+        self.engine.move(src, dst)
+        self._touch(os.path.dirname(src), dst_dir)
+        with self.lock:
+            self.fallbacks.append((src, dst))
+
+    def _rename(self, src, dst):
+        """Rename, recreating the destination directory if it was removed since we made it"""
+        try:
+            os.rename(src, dst)
+        except FileNotFoundError:
+            if not os.path.exists(src):
+                raise
+            dst_dir = os.path.dirname(dst)
+            with self.lock:
+                self.made_dirs.discard(dst_dir)
+            self.makedirs(dst_dir)
+            os.rename(src, dst)
+
+    def _touch(self, *dirs):
+        """Note directories which need to be synced"""
+        with self.lock:
+            self.touched_dirs.update(dirs)
+
+    def sync(self):
+        """fsync every directory touched since the last sync, so the moves are durable"""
+        with self.lock:
+            touched, self.touched_dirs = self.touched_dirs, set()
+        for directory in sorted(touched):
+            try:
+                fd = os.open(directory, os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
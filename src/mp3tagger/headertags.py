@@ -0,0 +1,222 @@
+"""Read and write ID3v2.4 tags without parsing frames we don't change"""
+
+import mmap
+import re
+
+from mutagen import PaddingInfo
+from mutagen.id3 import Frames, TimeStampTextFrame
+
+ID3V2_HEADER_SIZE = 10
+FRAME_HEADER_SIZE = 10
+ID3V1_SIZE = 128
+
+# Frames we read (or ID3v1 is made from) - everything else is copied as it is
+TEXT_FRAMES = frozenset(("TIT2", "TPE1", "TALB", "TCON", "TDRC", "TDRL", "TRCK"))
+
+# Header flags we can't pass frames through with: unsynchronisation, extended header,
+# experimental and footer
+UNSUPPORTED_TAG_FLAGS = 0xF0
+
+FRAME_ID_RE = re.compile(rb"[A-Z0-9]{4}")
+
+TEXT_ENCODINGS = ("latin-1", "utf-16", "utf-16-be", "utf-8")
+
+UTF8 = 3
+
+PICTURE_MIME = b"image/jpeg"
+
+
+def syncsafe(data):
+    """Decode a 4 byte syncsafe integer, or return None if it isn't one"""
+    value = 0
+    for byte in data:
+        if byte & 0x80:
+            return None
+        value = (value << 7) | byte
+    return value
+
+
+def to_syncsafe(value):
+    """Encode a 4 byte syncsafe integer"""
+    return bytes((value >> shift) & 0x7F for shift in (21, 14, 7, 0))
+
+
+def decode_text_frame(frame_id, data):
+    """Return the mutagen frame for the body of a text frame"""
+    text = data[1:].decode(TEXT_ENCODINGS[data[0]]).rstrip("\x00")
+    return Frames[frame_id](encoding=data[0], text=[v.lstrip("\ufeff") for v in text.split("\x00")])
+
+
+def frame_header(frame_id, size):
+    """Return an ID3v2.4 frame header without flags"""
+    return frame_id + to_syncsafe(size) + b"\x00\x00"
+
+
+def picture_parts(body):
+    """Split the body of an APIC frame into (text encoding, picture type, description with
+    its terminator, offset of the image data)"""
+    encoding = body[0]
+    mime_end = bytes(body[1:256]).index(b"\x00") + 1
+    desc_start = mime_end + 2
+    if encoding in (1, 2):
+        # UTF-16 descriptions end with a 2 byte null on a 2 byte boundary
+        desc_end = desc_start
+        while bytes(body[desc_end : desc_end + 2]) != b"\x00\x00":
+            if desc_end >= len(body):
+                raise ValueError("Unterminated description")
+            desc_end += 2
+        desc_end += 2
+    else:
+        desc_end = bytes(body[desc_start : desc_start + 4096]).index(b"\x00") + desc_start + 1
+    return encoding, body[mime_end + 1], bytes(body[desc_start:desc_end]), desc_end
+
+
+def normalise_picture(body, normalised):
+    """Return the body of an APIC frame with its image replaced by normalised(image), or None
+    if normalised returns None or the frame can't be read"""
+    try:
+        encoding, picture_type, description, image_start = picture_parts(body)
+    except (IndexError, ValueError):
+        return None
+    with body[image_start:] as image:
+        replacement = normalised(image)
+    if replacement is None:
+        return None
+    return bytes((encoding, *PICTURE_MIME, 0, picture_type)) + description + replacement
+
+
+def encode_text_frame(frame):
+    """Return a text frame rendered as ID3v2.4 in UTF-8"""
+    if isinstance(frame, TimeStampTextFrame):
+        values = [stamp.text.replace(" ", "T") for stamp in frame.text]
+    else:
+        values = [str(value) for value in frame.text]
+    data = bytes((UTF8,)) + "\x00".join(values).encode("utf-8")
+    return frame_header(frame.FrameID.encode("ascii"), len(data)) + data
+
+
+class HeaderOnlyTags:
+    """ID3v2.4 tags holding mutagen frames for the text frames we use, and the position in
+    the file of every other frame, so artwork and chapters are copied rather than loaded.
+    Supports what ID3Handler and MakeID3v1 need from mutagen's ID3"""
+
+    version = (2, 4, 0)
+
+    def __init__(self, size, frames, other_frames, pictures=()):
+        self.size = size
+        self.frames = frames
+        # (offset, length) of each frame which is copied unchanged, or the bytes replacing it
+        self.other_frames = other_frames
+        # Positions of the APIC frames in other_frames
+        self.pictures = list(pictures)
+
+    def keys(self):
+        """Return the ids of the text frames"""
+        return self.frames.keys()
+
+    def __contains__(self, frame_id):
+        return frame_id in self.frames
+
+    def __getitem__(self, frame_id):
+        return self.frames[frame_id]
+
+    def __setitem__(self, frame_id, frame):
+        self.frames[frame_id] = frame
+
+    def get(self, frame_id, default=None):
+        """Return a text frame, or default"""
+        return self.frames.get(frame_id, default)
+
+    def render(self, body_size, padding=None):
+        """Return the tag as a list of bytes and (offset, length) ranges of the input file,
+        with padding chosen by the mutagen padding function (or the way mutagen would)"""
+        frames = [encode_text_frame(frame) for frame in self.frames.values()]
+        frames_size = sum(map(len, frames)) + sum(
+            len(part) if isinstance(part, bytes) else part[1] for part in self.other_frames
+        )
+        old_padding = self.size - ID3V2_HEADER_SIZE - frames_size
+        info = PaddingInfo(old_padding, body_size)
+        padding = info.get_default_padding() if padding is None else padding(info)
+        header = b"ID3\x04\x00\x00" + to_syncsafe(frames_size + padding)
+        return [header, *frames, *self.other_frames, bytes(padding)]
+
+    def normalise_pictures(self, file_name, normalised):
+        """Replace the image in each APIC frame with normalised(image data) unless that is
+        None, returning True if any were replaced. Images are read from the file through an
+        mmap so they aren't copied unless they are replaced"""
+        changed = False
+        with (
+            open(file_name, "rb") as f,
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data,
+            memoryview(data) as view,
+        ):
+            for position in self.pictures:
+                offset, length = self.other_frames[position]
+                if view[offset + 8 : offset + 10] != b"\x00\x00":
+                    # Compressed, encrypted or unsynchronised
+                    continue
+                with view[offset + FRAME_HEADER_SIZE : offset + length] as body:
+                    replacement = normalise_picture(body, normalised)
+                if replacement is not None:
+                    self.other_frames[position] = (
+                        frame_header(b"APIC", len(replacement)) + replacement
+                    )
+                    changed = True
+        return changed
+
+
+def read_header_only(f):
+    """Return the HeaderOnlyTags of the open file, or None if it doesn't have ID3v2.4 tags
+    this can read - mutagen has to be used instead"""
+    try:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        # Empty file
+        return None
+    with data:
+        return _parse(data)
+
+
+def _parse(data):
+    """Parse the tag at the start of data, touching only the frame headers and text frames"""
+    header = data[:ID3V2_HEADER_SIZE]
+    if len(header) < ID3V2_HEADER_SIZE or header[:4] != b"ID3\x04":
+        return None
+    size = syncsafe(header[6:10])
+    if header[5] & UNSUPPORTED_TAG_FLAGS or size is None:
+        return None
+    end = ID3V2_HEADER_SIZE + size
+    if end > len(data):
+        return None
+    if data[-ID3V1_SIZE : -ID3V1_SIZE + 3] == b"TAG":
+        # mutagen fills in missing frames from ID3v1
+        return None
+    frames = {}
+    other_frames = []
+    pictures = []
+    offset = ID3V2_HEADER_SIZE
+    while offset + FRAME_HEADER_SIZE <= end and data[offset] != 0:
+        frame_id = data[offset : offset + 4]
+        frame_size = syncsafe(data[offset + 4 : offset + 8])
+        if not FRAME_ID_RE.fullmatch(frame_id) or frame_size is None:
+            return None
+        frame_end = offset + FRAME_HEADER_SIZE + frame_size
+        if frame_end > end:
+            return None
+        name = frame_id.decode("ascii")
+        if name in TEXT_FRAMES:
+            flags = data[offset + 8 : offset + 10]
+            # Compressed, encrypted or unsynchronised frames and repeats are left to mutagen
+            if flags != b"\x00\x00" or name in frames or frame_size < 1:
+                return None
+            try:
+                body = data[offset + FRAME_HEADER_SIZE : frame_end]
+                frames[name] = decode_text_frame(name, body)
+            except (IndexError, UnicodeDecodeError, ValueError):
+                return None
+        else:
+            if name == "APIC":
+                pictures.append(len(other_frames))
+            other_frames.append((offset, frame_end - offset))
+        offset = frame_end
+    return HeaderOnlyTags(end, frames, other_frames, pictures)
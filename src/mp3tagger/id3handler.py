@@ -1,13 +1,20 @@
 """Handle interactions with id3 tags using mutagen"""
 
-import re
+import hashlib
+import io
+import os
 from datetime import datetime
 
 import mutagen
-from mutagen.id3 import ID3
-from mutagen.mp3 import MP3
+from mutagen.id3 import ID3, ID3NoHeaderError, MakeID3v1
+from mutagen.mp3 import HeaderNotFoundError, MPEGInfo
 
-from mp3tagger._util import MyData, MyException, copy_to_temp, ffmpeg_recover
+from mp3tagger._util import MyData, MyException, RecoveryNeeded, StageTimer, write_with_header
+from mp3tagger.artwork import JPEG_MIME
+from mp3tagger.headertags import ID3V2_HEADER_SIZE, HeaderOnlyTags, read_header_only, to_syncsafe
+from mp3tagger.ioengine import DEFAULT_ENGINE
+from mp3tagger.recover import recover_mp3
+from mp3tagger.titles import TitleNormaliser
 
 # noinspection SpellCheckingInspection
 ORIGINAL_ARTIST = ("TOPE", mutagen.id3.TOPE)
@@ -24,83 +31,307 @@ ALBUM = ("TALB", mutagen.id3.TALB)
 
 REQUIRED_VERSION = (2, 4, 0)
 
+ID3V1_SIZE = 128
 
-# Series of patterns to strip out of titles
-TITLE_RE = [
-    re.compile(r"^[0-9]*[ \-]*"),
-    re.compile(r"\d{2}\.\d{2}.\d{2,4}"),
-    re.compile(r"\d{2,4}-\d{2}-\d{2}"),
-    re.compile(r"comedy: *"),
-    re.compile(r"TED: *"),
-    re.compile(r"- *"),
-    re.compile(r" +$"),
-]
+# Padding reserved when a file's tags are written, so later retags can be made in place
+DEFAULT_TAG_PADDING = 4096
+
+DEFAULT_TITLES = TitleNormaliser()
+
+
+def probe_mp3(file_name, header_only=False):
+    """Parse the ID3 tags and sync to the first MPEG frame using a single open file,
+    returning (is valid MPEG audio, tags or None). With header_only, ID3v2.4 tags are read
+    as HeaderOnlyTags where possible"""
+    with open(file_name, "rb") as f:
+        tags = _read_tags(f, header_only)
+        try:
+            MPEGInfo(f, getattr(tags, "size", None))
+        except HeaderNotFoundError:
+            return False, tags
+    return True, tags
+
+
+def _read_tags(f, header_only):
+    """Return the ID3 tags of an open file, or None"""
+    tags = read_header_only(f) if header_only else None
+    if tags is None:
+        try:
+            tags = ID3(f)
+        except ID3NoHeaderError:
+            tags = None
+    return tags
+
+
+def read_tags(file_name, header_only=False):
+    """Return the ID3 tags of a file or None, without looking at the audio"""
+    with open(file_name, "rb") as f:
+        return _read_tags(f, header_only)
+
+
+def is_valid_mp3(file_name):
+    """Return True if the file contains MPEG audio mutagen can read"""
+    return probe_mp3(file_name)[0]
+
+
+def id3v1_present(file_name):
+    """Return True if the file ends with an ID3v1 tag"""
+    with open(file_name, "rb") as f:
+        if f.seek(0, os.SEEK_END) < ID3V1_SIZE:
+            return False
+        f.seek(-ID3V1_SIZE, os.SEEK_END)
+        return f.read(3) == b"TAG"
+
+
+def render_id3v2(audio, padding=None):
+    """Return the tags rendered as an ID3v2.4 header, with padding chosen by the mutagen
+    padding function"""
+    buffer = io.BytesIO()
+    audio.save(buffer, v1=0, v2_version=4, padding=padding)
+    return buffer.getvalue()
+
+
+def reserve_padding(min_padding):
+    """Return a mutagen padding function leaving at least min_padding bytes of padding"""
+
+    def padding(info):
+        return max(min_padding, info.get_default_padding())
+
+    return padding
+
+
+def no_padding(_info):
+    """Mutagen padding function for tags without padding"""
+    return 0
+
+
+def tag_changes(audio, desired):
+    """Return (tag, value) for each of the desired (tag, value, any_value) which the tags
+    don't already have. Existing frames are compared by their text, so no frames are made"""
+    changes = []
+    for tag, value, any_value in desired:
+        frame = audio.get(tag[0])
+        if frame is not None and (any_value or str(frame) == value):
+            continue
+        changes.append((tag, value))
+    return changes
+
+
+def apply_tag_changes(audio, changes):
+    """Set the tags returned by tag_changes"""
+    for tag, value in changes:
+        audio[tag[0]] = tag[1](encoding=3, text=value)
 
 
 def derive_title(title):
     """Tidy up the title"""
-    for reg_exp in TITLE_RE:
-        title = re.sub(reg_exp, "", title)
-    title = re.sub(r" +", " ", title)
-    return title
+    return DEFAULT_TITLES.normalise(title)
 
 
 class ID3Handler:
     """Handle interactions with id3 tags"""
 
     dirty = False
+    # How the tags were saved - "in_place" or "rewrite" - or None if they weren't
+    saved = None
     audio = None
+    changes = ()
+    body_start = 0
+    formatted_date = None
+    work_file = None
+    # sha256 of the input file, taken as it was written out when hash_input is set
+    content_hash = None
 
-    def __init__(self):
-        pass
+    def __init__(
+        self,
+        timer=None,
+        titles=None,
+        header_only=True,
+        artwork=None,
+        engine=None,
+        tag_padding=DEFAULT_TAG_PADDING,
+        hash_input=False,
+    ):  # pylint: disable=too-many-arguments
+        self.timer = timer or StageTimer()
+        self.titles = titles or DEFAULT_TITLES
+        # Read only the frames we change, copying the rest (e.g. artwork) as it is
+        self.header_only = header_only
+        # ArtworkCache used to shrink cover art, if set
+        self.artwork = artwork
+        # IOEngine used to copy the audio
+        self.engine = engine or DEFAULT_ENGINE
+        self.padding = reserve_padding(tag_padding)
+        self.hash_input = hash_input
 
     def set_tag(self, tag, value, any_value=False):
         """Set id3 tag if not already set to correct value or any_value is True"""
-        if tag[0] in self.audio.keys():
-            if any_value or self.audio[tag[0]] == tag[1](encoding=3, text=value):
-                return
-        self.audio[tag[0]] = tag[1](encoding=3, text=value)
-        self.dirty = True
+        changes = tag_changes(self.audio, [(tag, value, any_value)])
+        apply_tag_changes(self.audio, changes)
+        self.dirty = self.dirty or bool(changes)
 
-    def process_podcast(self, md: MyData):
+    def process_podcast(self, md: MyData, defer_recovery=False, recovered=False):
         """Update the tags and convert them to version 2.4
         release_date must be in the format YYYYMMDD
+        If the file isn't valid, RecoveryNeeded is raised when defer_recovery is set,
+        otherwise it is recovered here. Once recovered, call again with recovered set.
         """
+        self.read(md, defer_recovery, recovered)
+        self.retag(md)
+        self.write(md)
+        return 0
 
+    def check_release_date(self, md: MyData):
+        """Check the release date in the file name"""
         try:
             release_date = datetime.strptime(md.release_date, "%y%m%d")
 
         except ValueError:
             raise MyException(msg=f"Invalid release date: {md.release_date}", code=1) from None
 
-        formatted_date = release_date.strftime("%Y-%m-%dT%H:%M:%S")
-        # Copy the mp3 to a temporary file to work on
-        copy_to_temp(md)
-        try:
-            self.audio = MP3(md.temp_fn)
-        except mutagen.mp3.HeaderNotFoundError as e:
-            result = ffmpeg_recover(md)
-            if result != 0:
-                raise MyException(msg=f"{md.input_file} is not a valid MP3", code=2) from e
-            self.dirty = True
+        # The form mutagen gives timestamps, so they can be compared as strings
+        self.formatted_date = release_date.strftime("%Y-%m-%d %H:%M:%S")
+
+    def plan(self, md: MyData):
+        """Return the tag changes the file needs, working from the tags alone"""
+        self.check_release_date(md)
+        self.work_file = md.input_file
         try:
-            self.audio = ID3(md.temp_fn)
-        except mutagen.id3.ID3NoHeaderError:
+            self.audio = read_tags(md.input_file, self.header_only) or ID3()
+        except mutagen.MutagenError as e:
+            raise MyException(msg=f"Unreadable tags in {md.input_file}: {e}", code=2) from None
+        self.retag(md)
+        return self.changes
+
+    def read(self, md: MyData, defer_recovery=False, recovered=False):
+        """Check the release date and read the tags, recovering the file if necessary"""
+        self.check_release_date(md)
+        self.work_file = md.input_file
+        if not recovered:
+            with self.timer.stage("parse"):
+                valid, self.audio = probe_mp3(md.input_file, self.header_only)
+            if not valid:
+                if defer_recovery:
+                    raise RecoveryNeeded(msg=f"{md.input_file} needs recovering", code=3)
+                # Recover into the temporary file and work on that instead
+                with self.timer.stage("recover", md.stat.st_size):
+                    if recover_mp3(md, is_valid=is_valid_mp3, engine=self.engine) != 0:
+                        raise MyException(msg=f"{md.input_file} is not a valid MP3", code=2)
+                recovered = True
+        if recovered:
+            self.work_file = md.temp_fn
+            with self.timer.stage("parse"):
+                try:
+                    self.audio = ID3(self.work_file)
+                except ID3NoHeaderError:
+                    self.audio = None
+        if self.audio is None:
             self.audio = ID3()
-            self.dirty = True
-        self.dirty = self.dirty or (self.audio.version < REQUIRED_VERSION)
-        if TITLE[0] in self.audio.keys():
-            title = derive_title(self.audio[TITLE[0]].text[0])
+        # Tags read from an ID3v1 trailer alone have no size
+        self.body_start = getattr(self.audio, "size", 0)
+
+    def retag(self, md: MyData):
+        """Work out the new tags for the file read by read"""
+        with self.timer.stage("tag"):
+            if TITLE[0] in self.audio.keys():
+                title = self.titles.normalise(self.audio[TITLE[0]].text[0])
+            else:
+                title = md.basename
+            self.changes = tag_changes(self.audio, self.desired_tags(md, title))
+            apply_tag_changes(self.audio, self.changes)
+            # Older tags are rewritten as 2.4 even if the values are right
+            self.dirty = self.dirty or bool(self.changes)
+            self.dirty = self.dirty or (self.audio.version < REQUIRED_VERSION)
+        if self.artwork is not None:
+            with self.timer.stage("artwork"):
+                self.dirty = self.normalise_artwork() or self.dirty
+
+    def normalise_artwork(self):
+        """Shrink the cover art, returning True if any was changed"""
+        if isinstance(self.audio, HeaderOnlyTags):
+            return self.audio.normalise_pictures(self.work_file, self.artwork.normalised)
+        changed = False
+        for frame in self.audio.getall("APIC"):
+            replacement = self.artwork.normalised(frame.data)
+            if replacement is not None:
+                frame.data = replacement
+                frame.mime = JPEG_MIME
+                changed = True
+        return changed
+
+    def desired_tags(self, md: MyData, title):
+        """Return (tag, value, any_value) for each tag the file should have, where any_value
+        means an existing value is kept"""
+        return [
+            # (ORIGINAL_ARTIST, md.artist, False),
+            (GENRE, "Podcast", False),
+            (TITLE, md.release_date + "-" + title, False),
+            (RELEASE_YEAR, md.release_year, True),
+            (RELEASE_DATE, self.formatted_date, False),
+            (ALBUM, md.album_name, False),
+        ]
+
+    def write(self, md: MyData):
+        """Write the file with its new tags to the temporary file"""
+        with self.timer.stage("write", md.stat.st_size):
+            if self.work_file == md.temp_fn:
+                if self.dirty:
+                    self.audio.save(md.temp_fn, padding=self.padding)
+                    self.engine.release(md.temp_fn)
+                    self.saved = "rewrite"
+            else:
+                self.write_output(md, self.body_start)
+
+    def write_output(self, md: MyData, body_start):
+        """Write the new tags followed by the audio from the input file to the temporary
+        file, reading and writing the audio just once"""
+        body_end = md.stat.st_size
+        digest = hashlib.sha256() if self.hash_input else None
+        if not self.dirty:
+            write_with_header(md, b"", 0, body_end, engine=self.engine, digest=digest)
+            return self._set_content_hash(digest)
+        trailer = b""
+        if id3v1_present(md.input_file):
+            # Keep the ID3v1 tag in step with the new tags like ID3.save would
+            body_end -= ID3V1_SIZE
+            trailer = MakeID3v1(self.audio)
+        if isinstance(self.audio, HeaderOnlyTags):
+            header = self.audio.render(body_end - body_start, self.padding)
         else:
-            title = md.basename
-        title = md.release_date + "-" + title
-        # self.set_tag(ORIGINAL_ARTIST, md.artist)
-        self.set_tag(GENRE, "Podcast")
-        self.set_tag(TITLE, title)
-        self.set_tag(RELEASE_YEAR, md.release_year, any_value=True)
-        self.set_tag(RELEASE_DATE, formatted_date)
-        self.set_tag(ALBUM, md.album_name)
-        if self.dirty:
-            self.audio.save(md.temp_fn)
+            header = render_id3v2(self.audio, self.padding)
+        self.saved = "rewrite"
+        write_with_header(md, header, body_start, body_end, trailer, self.engine, digest)
+        return self._set_content_hash(digest)
 
+    def _set_content_hash(self, digest):
+        """Keep the hash of the input file, if it was taken"""
+        if digest is not None:
+            self.content_hash = digest.hexdigest()
         return 0
+
+    def save_in_place(self, file_name):
+        """Write the new tags over the old ones in the file they were read from, if they fit
+        in the space the old ones take up, padding the rest. Returns False, leaving the
+        file alone, if they don't fit"""
+        old_size = self.body_start
+        if isinstance(self.audio, HeaderOnlyTags):
+            parts = self.audio.render(0, no_padding)
+        else:
+            parts = [render_id3v2(self.audio, no_padding)]
+        size = sum(len(part) if isinstance(part, bytes) else part[1] for part in parts)
+        if old_size == 0 or size > old_size:
+            return False
+        trailer = MakeID3v1(self.audio) if id3v1_present(file_name) else None
+        with self.timer.stage("write", old_size):
+            with open(file_name, "r+b", buffering=0) as f:
+                fd = f.fileno()
+                # Frames copied from the file are read before any of it is overwritten
+                data = b"".join(
+                    part if isinstance(part, bytes) else os.pread(fd, part[1], part[0])
+                    for part in parts
+                )
+                header = data[:6] + to_syncsafe(old_size - ID3V2_HEADER_SIZE) + data[10:]
+                os.pwrite(fd, header + bytes(old_size - size), 0)
+                if trailer is not None:
+                    os.pwrite(fd, trailer, os.fstat(fd).st_size - ID3V1_SIZE)
+        self.saved = "in_place"
+        return True
@@ -0,0 +1,96 @@
+"""Index of processed files so reruns can skip unchanged episodes"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_hash(file_name):
+    """Return the sha256 of the file contents"""
+    digest = hashlib.sha256()
+    with open(file_name, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ProcessedIndex:
+    """SQLite record of processed input files keyed on path, size, mtime and content hash"""
+
+    def __init__(self, db_file):
+        os.makedirs(os.path.dirname(db_file), exist_ok=True)
+        # Shared between worker threads, so access is serialised with a lock
+        self.db = sqlite3.connect(db_file, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS processed ("
+                " input_file TEXT PRIMARY KEY,"
+                " size INTEGER NOT NULL,"
+                " mtime_ns INTEGER NOT NULL,"
+                " content_hash TEXT NOT NULL,"
+                " output_file TEXT NOT NULL)"
+            )
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS audio ("
+                " audio_key TEXT PRIMARY KEY,"
+                " output_file TEXT NOT NULL)"
+            )
+
+    def is_processed(self, input_file, stat=None):
+        """Return True if input_file was processed before and hasn't changed since"""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT size, mtime_ns, content_hash, output_file FROM processed"
+                " WHERE input_file = ?",
+                (input_file,),
+            ).fetchone()
+        if row is None:
+            return False
+        size, mtime_ns, content_hash, output_file = row
+        stat = stat or os.stat(input_file)
+        if size != stat.st_size or not os.path.isfile(output_file):
+            return False
+        if mtime_ns == stat.st_mtime_ns:
+            return True
+        # Touched since - only hash the file when the cheap checks are inconclusive
+        if file_hash(input_file) != content_hash:
+            return False
+        with self.lock, self.db:
+            self.db.execute(
+                "UPDATE processed SET mtime_ns = ? WHERE input_file = ?",
+                (stat.st_mtime_ns, input_file),
+            )
+        return True
+
+    def record(self, input_file, output_file, stat=None, content_hash=None):
+        """Record that input_file has been processed into output_file. content_hash is the
+        file_hash of input_file if it was taken while the file was copied, otherwise the
+        file is read again to hash it"""
+        stat = stat or os.stat(input_file)
+        content_hash = content_hash or file_hash(input_file)
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO processed VALUES (?, ?, ?, ?, ?)",
+                (input_file, stat.st_size, stat.st_mtime_ns, content_hash, output_file),
+            )
+
+    def find_audio(self, audio_key):
+        """Return the output file recorded for audio_key, or None"""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT output_file FROM audio WHERE audio_key = ?", (audio_key,)
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def record_audio(self, audio_key, output_file):
+        """Record the output file made from the audio identified by audio_key"""
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO audio VALUES (?, ?)", (audio_key, output_file))
+
+    def close(self):
+        """Close the database"""
+        self.db.close()
@@ -0,0 +1,127 @@
+"""Copy file data a fixed size chunk at a time, optionally keeping it out of the page cache"""
+
+import os
+import shutil
+import threading
+
+# Size of the chunks copied, and of each worker's buffer when the kernel can't copy for us
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+MIN_BUFFER_SIZE = 64 * 1024
+
+
+def _copy_file_range(src_fd, dst_fd, offset, count):
+    """Copy using copy_file_range (Linux)"""
+    return os.copy_file_range(src_fd, dst_fd, count, offset)
+
+
+def _sendfile(src_fd, dst_fd, offset, count):
+    """Copy using sendfile (only works between files on Linux)"""
+    return os.sendfile(dst_fd, src_fd, offset, count)
+
+
+# In-kernel copy functions available on this platform, best first
+KERNEL_COPIES = [
+    copy
+    for name, copy in (("copy_file_range", _copy_file_range), ("sendfile", _sendfile))
+    if hasattr(os, name)
+]
+
+
+def drop_pages(fd, offset=0, length=0):
+    """Tell the kernel a range of the file (all of it by default) won't be read again, so
+    its pages can be dropped from the cache. Does nothing where that isn't supported"""
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fd, offset, length, os.POSIX_FADV_DONTNEED)
+        except OSError:
+            pass
+
+
+class IOEngine:
+    """Copies between files in chunks of at most buffer_size, in the kernel where possible
+    and otherwise through a buffer which each worker thread allocates once and reuses, so a
+    worker never holds more than buffer_size of file data. With drop_cache set, input is
+    dropped from the page cache as it is copied, and output once it has been written, so
+    long episodes don't push everything else out of the cache"""
+
+    def __init__(self, buffer_size=DEFAULT_BUFFER_SIZE, drop_cache=False):
+        self.buffer_size = max(MIN_BUFFER_SIZE, buffer_size)
+        self.drop_cache = drop_cache
+        self.local = threading.local()
+
+    def buffer(self):
+        """Return this thread's buffer"""
+        view = getattr(self.local, "buffer", None)
+        if view is None:
+            view = self.local.buffer = memoryview(bytearray(self.buffer_size))
+        return view
+
+    def copy_range(self, src_fd, dst_fd, offset, count, digest=None):
+        """Append count bytes from offset in src_fd to dst_fd, adding them to digest (a
+        hashlib object) if one is given - which means copying through the buffer"""
+        end = offset + count
+        kernel_copies = list(KERNEL_COPIES) if digest is None else []
+        while offset < end:
+            size = min(self.buffer_size, end - offset)
+            copied = None
+            while kernel_copies and copied is None:
+                try:
+                    copied = kernel_copies[0](src_fd, dst_fd, offset, size)
+                except OSError:
+                    # Not supported between these files (e.g. sendfile to a file on macOS)
+                    kernel_copies.pop(0)
+            if copied is None:
+                copied = self._copy_buffered(src_fd, dst_fd, offset, size, digest)
+            if copied == 0:
+                return
+            if self.drop_cache:
+                drop_pages(src_fd, offset, copied)
+            offset += copied
+
+    def _copy_buffered(
+        self, src_fd, dst_fd, offset, size, digest=None
+    ):  # pylint: disable=too-many-arguments
+        """Copy up to size bytes through this thread's buffer, returning the number copied"""
+        view = self.buffer()[:size]
+        if hasattr(os, "preadv"):
+            length = os.preadv(src_fd, [view], offset)
+        else:
+            data = os.pread(src_fd, size, offset)
+            length = len(data)
+            view[:length] = data
+        if digest is not None:
+            digest.update(view[:length])
+        written = 0
+        while written < length:
+            written += os.write(dst_fd, view[written:length])
+        return length
+
+    def finish(self, dst_fd):
+        """Drop a file which has been written from the page cache. It has to be on disk
+        first, as pages which haven't been written back can't be dropped"""
+        if self.drop_cache:
+            getattr(os, "fdatasync", os.fsync)(dst_fd)
+            drop_pages(dst_fd)
+
+    def release(self, file_name):
+        """Drop a whole file which was read or written outside the engine (e.g. by ffmpeg)
+        from the page cache"""
+        if self.drop_cache:
+            with open(file_name, "rb") as f:
+                self.finish(f.fileno())
+
+    def copy_file(self, src, dst):
+        """Copy a file's data and permissions, like shutil.copy"""
+        with open(src, "rb") as fsrc, open(dst, "wb", buffering=0) as fdst:
+            self.copy_range(fsrc.fileno(), fdst.fileno(), 0, os.fstat(fsrc.fileno()).st_size)
+            self.finish(fdst.fileno())
+        shutil.copymode(src, dst)
+
+    def move(self, src, dst):
+        """Move a file to another device, like shutil.move"""
+        self.copy_file(src, dst)
+        shutil.copystat(src, dst)
+        os.unlink(src)
+
+
+DEFAULT_ENGINE = IOEngine()
@@ -0,0 +1,112 @@
+"""Write-ahead journal of the state of each file, so a run which was killed can be finished
+or rolled back by the next one"""
+
+import fcntl
+import json
+import os
+import threading
+
+from mp3tagger._util import MyData, MyException
+
+# States of a file, in the order they are reached. started is recorded before anything is
+# written, rejected before the file is moved to the reject folder
+STARTED = "started"
+TAGGED = "tagged"
+FINALIZED = "finalized"
+BACKED_UP = "backed_up"
+REJECTED = "rejected"
+
+
+def _remove(*file_names):
+    """Remove files which may not exist"""
+    for file_name in file_names:
+        if file_name and os.path.isfile(file_name):
+            os.remove(file_name)
+
+
+class Journal:
+    """Append only journal of file states, one JSON object per line. Entries are flushed as
+    they are made, so they survive the process being killed, and fsynced by sync along with
+    the directories the moves touched. The journal is locked, so only one run can use it"""
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(file_name) or ".", exist_ok=True)
+        # pylint: disable-next=consider-using-with
+        self.file = open(file_name, "a+", encoding="utf-8")
+        try:
+            fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.file.close()
+            raise MyException(msg=f"{file_name} is in use by another run", code=1) from None
+
+    def record(self, md: MyData, state, remove_source_file=False):
+        """Note a file reaching a state. Entries which start a file's changes carry every
+        path needed to finish or undo them"""
+        entry = {"file": md.input_file, "state": state}
+        if state in (STARTED, REJECTED):
+            entry.update(
+                temp=md.temp_fn,
+                recover=md.recover_fn,
+                output=md.output_file,
+                backup=md.backup_file if remove_source_file else None,
+                reject=md.reject_file,
+            )
+        line = json.dumps(entry) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def entries(self):
+        """Return the latest entry for each file in the journal, merged with its paths"""
+        files = {}
+        with self.lock:
+            self.file.seek(0)
+            for line in self.file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short when the run was killed
+                    continue
+                files.setdefault(entry["file"], {}).update(entry)
+        return files
+
+    def replay(self, ops):
+        """Finish or roll back the files left part way through by an earlier run, then
+        empty the journal. Returns (files finished, files rolled back)"""
+        finished = rolled_back = 0
+        for file_name, entry in self.entries().items():
+            state = entry["state"]
+            if state == REJECTED:
+                if os.path.exists(file_name):
+                    ops.move(file_name, entry["reject"])
+                _remove(entry.get("temp"), entry.get("recover"))
+                finished += 1
+            elif state == FINALIZED and entry.get("backup"):
+                if os.path.exists(file_name) and os.path.exists(entry["output"]):
+                    ops.move(file_name, entry["backup"])
+                finished += 1
+            elif state in (STARTED, TAGGED):
+                # The input hasn't been touched, so it is processed again
+                _remove(entry.get("temp"), entry.get("recover"))
+                rolled_back += 1
+        ops.sync()
+        self.clear()
+        return finished, rolled_back
+
+    def sync(self):
+        """Make the entries so far durable"""
+        with self.lock:
+            os.fsync(self.file.fileno())
+
+    def clear(self):
+        """Empty the journal once every file in it has been dealt with"""
+        with self.lock:
+            self.file.truncate(0)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        """Close (and unlock) the journal"""
+        self.file.close()
@@ -0,0 +1,151 @@
+"""Per-file and per-run metrics for the stages of processing"""
+
+import json
+import math
+import os
+import threading
+import time
+
+from mp3tagger._util import StageTimer
+
+METRICS_FORMATS = ("jsonl", "prometheus")
+
+QUANTILES = (0.5, 0.95)
+
+
+def percentile(values, quantile):
+    """Return the nearest-rank percentile of a sorted list of values"""
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(quantile * len(values)) - 1)]
+
+
+class RunMetrics:
+    """Collect a record for each file and add its stage times to the run totals"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = StageTimer()
+        self.records = []
+        self.started = time.time()
+
+    def record(
+        self, file_name, status, timer: StageTimer, tags_written=None, save=None
+    ):  # pylint: disable=too-many-arguments
+        """Record the outcome and stage times of a file, and for processed files whether
+        the tags needed writing and whether they were saved in place or the file rewritten"""
+        stages = {
+            stage: {"seconds": round(seconds, 6), "bytes": timer.bytes[stage]}
+            for stage, seconds in timer.seconds.items()
+        }
+        record = {
+            "type": "file",
+            "file": file_name,
+            "status": status,
+            "seconds": round(sum(timer.seconds.values()), 6),
+            "stages": stages,
+        }
+        if tags_written is not None:
+            record["tags_written"] = tags_written
+        if save is not None:
+            record["save"] = save
+        with self.lock:
+            self.records.append(record)
+        for stage, seconds in timer.seconds.items():
+            self.totals.add(stage, seconds, timer.bytes[stage])
+
+    def summary(self):
+        """Return the run totals, including latency percentiles of the processed files"""
+        with self.lock:
+            records = list(self.records)
+        statuses = {}
+        for record in records:
+            statuses[record["status"]] = statuses.get(record["status"], 0) + 1
+        latencies = sorted(r["seconds"] for r in records if r["status"] == "processed")
+        return {
+            "type": "run",
+            "started": round(self.started, 3),
+            "seconds": round(time.time() - self.started, 6),
+            "files": statuses,
+            "unchanged_files": sum(1 for r in records if r.get("tags_written") is False),
+            "saves": {
+                kind: sum(1 for r in records if r.get("save") == kind)
+                for kind in ("in_place", "rewrite")
+            },
+            "latency": {f"p{int(q * 100)}": percentile(latencies, q) for q in QUANTILES},
+            "stages": {
+                stage: {"seconds": round(seconds, 6), "bytes": self.totals.bytes[stage]}
+                for stage, seconds in self.totals.seconds.items()
+            },
+        }
+
+    def write_jsonl(self, file_name):
+        """Append a JSON line per file followed by one for the run, so each --watch batch
+        (and each run) adds to those before it"""
+        with self.lock:
+            records = list(self.records)
+        with open(file_name, "a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+            f.write(json.dumps(self.summary()) + "\n")
+
+    def prometheus_lines(self):
+        """Return the run totals in the Prometheus text exposition format"""
+        summary = self.summary()
+        lines = [
+            "# HELP mp3tagger_files Files handled in the last run by outcome",
+            "# TYPE mp3tagger_files gauge",
+        ]
+        for status, count in sorted(summary["files"].items()):
+            lines.append(f'mp3tagger_files{{status="{status}"}} {count}')
+        lines += [
+            "# HELP mp3tagger_unchanged_files Processed files whose tags were already right",
+            "# TYPE mp3tagger_unchanged_files gauge",
+            f"mp3tagger_unchanged_files {summary['unchanged_files']}",
+            "# HELP mp3tagger_saves Files whose tags were saved in place or rewritten",
+            "# TYPE mp3tagger_saves gauge",
+        ]
+        for kind, count in summary["saves"].items():
+            lines.append(f'mp3tagger_saves{{kind="{kind}"}} {count}')
+        lines += [
+            "# HELP mp3tagger_file_seconds Time taken to process a file",
+            "# TYPE mp3tagger_file_seconds summary",
+        ]
+        for quantile, latency in zip(QUANTILES, summary["latency"].values()):
+            lines.append(f'mp3tagger_file_seconds{{quantile="{quantile}"}} {latency}')
+        lines += [
+            "# HELP mp3tagger_stage_seconds Time spent in each stage in the last run",
+            "# TYPE mp3tagger_stage_seconds gauge",
+        ]
+        for stage, totals in sorted(summary["stages"].items()):
+            lines.append(f'mp3tagger_stage_seconds{{stage="{stage}"}} {totals["seconds"]}')
+        lines += [
+            "# HELP mp3tagger_stage_bytes Bytes handled by each stage in the last run",
+            "# TYPE mp3tagger_stage_bytes gauge",
+        ]
+        for stage, totals in sorted(summary["stages"].items()):
+            lines.append(f'mp3tagger_stage_bytes{{stage="{stage}"}} {totals["bytes"]}')
+        lines += [
+            "# HELP mp3tagger_run_seconds Duration of the last run",
+            "# TYPE mp3tagger_run_seconds gauge",
+            f"mp3tagger_run_seconds {summary['seconds']}",
+            "# HELP mp3tagger_run_timestamp_seconds Start of the last run",
+            "# TYPE mp3tagger_run_timestamp_seconds gauge",
+            f"mp3tagger_run_timestamp_seconds {summary['started']}",
+        ]
+        return lines
+
+    def write_prometheus(self, file_name):
+        """Write the run totals for the node_exporter textfile collector, replacing the
+        file atomically so a half-written file is never scraped"""
+        temp_file = file_name + ".tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            f.write("\n".join(self.prometheus_lines()) + "\n")
+        os.replace(temp_file, file_name)
+
+    def write(self, file_name, metrics_format):
+        """Write the metrics in the given format"""
+        if metrics_format == "prometheus":
+            self.write_prometheus(file_name)
+        else:
+            self.write_jsonl(file_name)
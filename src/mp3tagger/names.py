@@ -0,0 +1,104 @@
+"""Recognise the file-name formats episodes are downloaded with"""
+
+import re
+from datetime import datetime
+
+# (pattern, date format) for each format. Patterns match the file name from the start, with
+# the episode in a group called name and the release date in groups called year (2 or 4
+# digits), month and day, or in a group called date read with the date format.
+# Formats from file_name_formats in the ini file are added to these
+DEFAULT_NAME_FORMATS = (
+    (r"pod_[0-9]{2}(?P<year>[0-9]{2})-(?P<month>[0-9]*)-(?P<day>[0-9]*)-(?P<name>.*)\.mp3", None),
+    (r"(?P<year>[0-9]{2})(?P<month>[0-9]{2})(?P<day>[0-9]{2})-(?P<name>.*)\.mp3", None),
+)
+
+GROUP_RE = re.compile(r"\(\?P([<=])(\w+)")
+REGEX_SPECIAL = frozenset(".^$*+?{}[]\\|()")
+QUANTIFIERS = frozenset("*+?{")
+
+
+def parse_name_formats(value):
+    """Return the (pattern, date format) in a file_name_formats config value, one format per
+    line, with the date format (if any) after the pattern, starting with %"""
+    formats = []
+    for line in value.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        pattern, _, last = line.rpartition(" ")
+        if pattern.strip() and last.startswith("%"):
+            formats.append((pattern.strip(), last))
+        else:
+            formats.append((line, None))
+    return formats
+
+
+def literal_prefix(pattern):
+    """Return the text every match of pattern starts with"""
+    if "|" in pattern:
+        return ""
+    prefix = ""
+    for char in pattern:
+        if char in REGEX_SPECIAL:
+            if char in QUANTIFIERS:
+                # The last character is optional or repeated
+                prefix = prefix[:-1]
+            break
+        prefix += char
+    return prefix
+
+
+class FileNameParser:
+    """Match file names against every format in one dispatch. Formats are grouped by the
+    literal text they start with and each group is compiled into a single pattern, so a
+    name is only tried against the groups whose prefix it starts with, longest first"""
+
+    def __init__(self, formats=DEFAULT_NAME_FORMATS):
+        groups = {}
+        self.formats = {}
+        for number, (pattern, date_format) in enumerate(formats):
+            tag = f"f{number}"
+            try:
+                names = re.compile(pattern).groupindex
+            except re.error as e:
+                raise ValueError(f"{pattern}: {e}") from None
+            if "name" not in names or not (
+                ("date" in names and date_format) or {"year", "month", "day"} <= names.keys()
+            ):
+                raise ValueError(f"{pattern}: needs name, and date or year, month and day")
+            # Group names are made unique so the formats can share a pattern
+            renamed = GROUP_RE.sub(lambda m, tag=tag: f"(?P{m[1]}{tag}_{m[2]}", pattern)
+            groups.setdefault(literal_prefix(pattern), []).append(f"(?P<{tag}>{renamed})")
+            self.formats[tag] = date_format
+        self.patterns = {prefix: re.compile("|".join(group)) for prefix, group in groups.items()}
+        self.prefix_lengths = sorted({len(prefix) for prefix in groups}, reverse=True)
+
+    def match(self, file_name):
+        """Return (release date as YYMMDD, episode name) for a file name (without its
+        directory), or None if it isn't in a known format"""
+        for length in self.prefix_lengths:
+            pattern = self.patterns.get(file_name[:length])
+            if pattern is None:
+                continue
+            found = pattern.match(file_name)
+            if found is not None:
+                return self._fields(found)
+        return None
+
+    def _fields(self, found):
+        """Return (release date, name) from a match"""
+        tag = found.lastgroup
+        date_format = self.formats[tag]
+        if date_format is not None:
+            try:
+                date = datetime.strptime(found[f"{tag}_date"], date_format)
+            except ValueError:
+                return None
+            return date.strftime("%y%m%d"), found[f"{tag}_name"]
+        year = found[f"{tag}_year"]
+        if len(year) == 4:
+            year = year[2:]
+        return f"{year}{found[f'{tag}_month']}{found[f'{tag}_day']}", found[f"{tag}_name"]
+
+
+DEFAULT_NAMES = FileNameParser()
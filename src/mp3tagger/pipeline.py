@@ -0,0 +1,81 @@
+"""Run jobs through a series of stages, each in its own thread, so consecutive files overlap"""
+
+import queue
+import threading
+
+# Marks the end of the jobs on a queue
+STOP = object()
+
+
+class Job:
+    """A unit of work passed from stage to stage. A stage sets finished when the later
+    stages have nothing to do, and an exception raised by a stage is kept in error"""
+
+    def __init__(self):
+        self.finished = False
+        self.error = None
+
+
+class StagedPipeline:
+    """Pass jobs through stages (callables taking a job) with a bounded queue between each
+    pair, so while one file is being written the next is tagged and the one after is read.
+    A slow stage fills the queue in front of it, which holds back the earlier stages"""
+
+    def __init__(self, stages, queue_size=2):
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+        self.cancelled = threading.Event()
+
+    def run(self, jobs):
+        """Yield each job once it has been through every stage, in the order given"""
+        queues = [queue.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        feed_error = []
+        threads = [threading.Thread(target=self._feed, args=(jobs, queues[0], feed_error))]
+        for number, stage in enumerate(self.stages):
+            threads.append(
+                threading.Thread(
+                    target=self._run_stage,
+                    args=(stage, queues[number], queues[number + 1]),
+                    name=f"pipeline-{getattr(stage, '__name__', number)}",
+                )
+            )
+        for thread in threads:
+            thread.start()
+        job = None
+        try:
+            while (job := queues[-1].get()) is not STOP:
+                yield job
+        finally:
+            if job is not STOP:
+                # The caller stopped early - let the remaining jobs pass straight through
+                self.cancelled.set()
+                while queues[-1].get() is not STOP:
+                    pass
+            for thread in threads:
+                thread.join()
+        if feed_error:
+            raise feed_error[0]
+
+    def _feed(self, jobs, outbox, feed_error):
+        """Put the jobs on the first queue"""
+        try:
+            for job in jobs:
+                if self.cancelled.is_set():
+                    break
+                outbox.put(job)
+        except Exception as inst:  # pylint: disable=broad-exception-caught
+            # Raised in the caller's thread once the jobs already queued are done
+            feed_error.append(inst)
+        finally:
+            outbox.put(STOP)
+
+    def _run_stage(self, stage, inbox, outbox):
+        """Run a stage on each job which hasn't finished or failed"""
+        while (job := inbox.get()) is not STOP:
+            if not (job.finished or job.error or self.cancelled.is_set()):
+                try:
+                    stage(job)
+                except Exception as inst:  # pylint: disable=broad-exception-caught
+                    job.error = inst
+            outbox.put(job)
+        outbox.put(STOP)
@@ -0,0 +1,165 @@
+"""Work out what a run would do from the file names and ID3 headers alone, and save it as a
+JSON plan which can be checked and applied later"""
+
+import json
+import os
+import sys
+from datetime import datetime
+
+from mp3tagger._util import MyException, parse_file_names
+
+PLAN_VERSION = 1
+
+# Plan entries which --apply passes on to be processed
+APPLIED_ACTIONS = ("process", "reject", "invalid")
+
+
+class Planner:
+    """Build a plan for the files in a run. Only the ID3 tag at the start of each file is
+    read, so a plan is made at the speed of a metadata scan"""
+
+    def __init__(
+        self, dest_dir, backup_dir, reject_dir, remove_source_file, titles, names=None, index=None
+    ):  # pylint: disable=too-many-arguments
+        self.dest_dir = dest_dir
+        self.backup_dir = backup_dir
+        self.reject_dir = reject_dir
+        self.remove_source_file = remove_source_file
+        self.titles = titles
+        self.names = names
+        self.index = index
+
+    def entry(self, file_name, stat, md, temp_file=False):
+        """Return the plan entry for a file, given its MyData (or the MyException raised
+        for its name)"""
+        # pylint: disable-next=import-outside-toplevel
+        from mp3tagger.id3handler import ID3Handler
+
+        entry = {"input": file_name, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        if temp_file:
+            entry["action"] = "ignore"
+            return entry
+        if self.index is not None and self.index.is_processed(file_name, stat):
+            entry["action"] = "skip"
+            return entry
+        if isinstance(md, MyException):
+            entry.update(action="invalid", reason=md.msg)
+            return entry
+        id3 = ID3Handler(titles=self.titles, header_only=True)
+        try:
+            changes = id3.plan(md)
+        except MyException as inst:
+            entry.update(action="reject", reason=inst.msg, target=md.reject_file)
+            return entry
+        entry.update(
+            action="process",
+            target=md.output_file,
+            rewrite=id3.dirty,
+            changes=[{"frame": tag[0], "value": value} for tag, value in changes],
+        )
+        if self.remove_source_file:
+            entry["backup"] = md.backup_file
+        return entry
+
+    def plan(self, files, is_temp_file):
+        """Return the plan for (file_name, stat) pairs"""
+        files = list(files)
+        file_names = [file_name for file_name, _ in files]
+        stats = [stat for _, stat in files]
+        parsed = parse_file_names(
+            file_names, self.dest_dir, self.backup_dir, self.reject_dir, stats, self.names
+        )
+        entries = [
+            self.entry(file_name, stat, md, is_temp_file(file_name))
+            for file_name, stat, md in zip(file_names, stats, parsed)
+        ]
+        return {
+            "version": PLAN_VERSION,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "dest_dir": self.dest_dir,
+            "backup_dir": self.backup_dir,
+            "reject_dir": self.reject_dir,
+            "remove_source_file": self.remove_source_file,
+            "files": entries,
+            "collisions": find_collisions(entries),
+        }
+
+
+def find_collisions(entries):
+    """Return the targets written by more than one entry, or which already exist, marking
+    the entries involved"""
+    by_target = {}
+    for entry in entries:
+        for key in ("target", "backup"):
+            if key in entry:
+                by_target.setdefault(entry[key], []).append(entry)
+    collisions = []
+    for target, writers in by_target.items():
+        exists = os.path.exists(target)
+        if len(writers) > 1 or exists:
+            collisions.append(
+                {"target": target, "inputs": [w["input"] for w in writers], "exists": exists}
+            )
+            for writer in writers:
+                writer["collision"] = True
+    return collisions
+
+
+def summary(plan):
+    """Return a one line summary of a plan"""
+    counts = {}
+    for entry in plan["files"]:
+        counts[entry["action"]] = counts.get(entry["action"], 0) + 1
+    parts = [f"{count} {action}" for action, count in sorted(counts.items())]
+    parts.append(f"{len(plan['collisions'])} collisions")
+    return f"Planned {len(plan['files'])} files: " + ", ".join(parts)
+
+
+def write_plan(plan, file_name):
+    """Write a plan as JSON to file_name, or stdout if it is -"""
+    if file_name == "-":
+        json.dump(plan, sys.stdout, indent=1)
+        print()
+        return
+    temp_file = file_name + ".tmp"
+    with open(temp_file, "w", encoding="utf-8") as f:
+        json.dump(plan, f, indent=1)
+        f.write("\n")
+    os.replace(temp_file, file_name)
+
+
+def read_plan(file_name, dest_dir, backup_dir, reject_dir):
+    """Read a plan, checking it was made with the same folders"""
+    with open(file_name, encoding="utf-8") as f:
+        plan = json.load(f)
+    if plan.get("version") != PLAN_VERSION:
+        raise MyException(msg=f"{file_name} is not a version {PLAN_VERSION} plan", code=1)
+    if (plan["dest_dir"], plan["backup_dir"], plan["reject_dir"]) != (
+        dest_dir,
+        backup_dir,
+        reject_dir,
+    ):
+        raise MyException(msg=f"{file_name} was made with different folders", code=1)
+    return plan
+
+
+def planned_files(plan, out=None):
+    """Yield (file_name, stat) for each file the plan processes, leaving out collisions and
+    files which have changed since it was made"""
+    out = out or sys.stdout
+    for entry in plan["files"]:
+        if entry["action"] not in APPLIED_ACTIONS:
+            continue
+        file_name = entry["input"]
+        if entry.get("collision"):
+            print(f"Not applying {file_name} - its target collides with another file", file=out)
+            continue
+        try:
+            stat = os.stat(file_name)
+        except FileNotFoundError:
+            print(f"Not applying {file_name} - it has gone", file=out)
+            continue
+        if (stat.st_size, stat.st_mtime_ns) != (entry["size"], entry["mtime_ns"]):
+            print(f"Not applying {file_name} - it has changed since the plan was made", file=out)
+            continue
+        yield file_name, stat
@@ -0,0 +1,216 @@
+"""Try to make unreadable mp3 files readable, cheapest method first"""
+
+import io
+import mmap
+import os
+import subprocess
+import sys
+import threading
+
+from mp3tagger._util import MyData, MyException, StageTimer, copy_range
+from mp3tagger.ioengine import DEFAULT_ENGINE
+
+# Only look this far into the file for the first MPEG frame
+MAX_JUNK_SIZE = 4 * 1024 * 1024
+# Number of consecutive frames needed to trust a frame sync
+FRAMES_TO_CONFIRM = 3
+
+ID3V2_HEADER_SIZE = 10
+
+# Bitrates in kbit/s indexed by [MPEG-1?][layer][bitrate index]
+BITRATES = {
+    True: {
+        1: (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+        2: (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+        3: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    },
+    False: {
+        1: (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+        2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+        3: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    },
+}
+# Sample rates indexed by version bits, then sample rate index
+SAMPLE_RATES = {0: (11025, 12000, 8000), 2: (22050, 24000, 16000), 3: (44100, 48000, 32000)}
+
+
+def mpeg_frame(data, pos):
+    """Return ((version, layer, sample rate), frame length) for an MPEG audio frame header
+    at pos, or None if there isn't a valid one"""
+    if pos + 4 > len(data) or data[pos] != 0xFF or data[pos + 1] & 0xE0 != 0xE0:
+        return None
+    version = (data[pos + 1] >> 3) & 3
+    layer = 4 - ((data[pos + 1] >> 1) & 3)
+    bitrate_index = data[pos + 2] >> 4
+    sample_rate_index = (data[pos + 2] >> 2) & 3
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+    mpeg1 = version == 3
+    bitrate = BITRATES[mpeg1][layer][bitrate_index] * 1000
+    sample_rate = SAMPLE_RATES[version][sample_rate_index]
+    padding = (data[pos + 2] >> 1) & 1
+    if layer == 1:
+        length = (12 * bitrate // sample_rate + padding) * 4
+    elif layer == 3 and not mpeg1:
+        length = 72 * bitrate // sample_rate + padding
+    else:
+        length = 144 * bitrate // sample_rate + padding
+    return (version, layer, sample_rate), length
+
+
+def find_frame_sync(data, start):
+    """Return the offset of the first run of FRAMES_TO_CONFIRM consistent MPEG frames at or
+    after start, or None"""
+    end = min(len(data), start + MAX_JUNK_SIZE)
+    pos = data.find(b"\xff", start, end)
+    while pos != -1:
+        frame = mpeg_frame(data, pos)
+        if frame is not None:
+            kind, next_pos = frame[0], pos + frame[1]
+            for _ in range(FRAMES_TO_CONFIRM - 1):
+                frame = mpeg_frame(data, next_pos)
+                if frame is None or frame[0] != kind:
+                    break
+                next_pos += frame[1]
+            else:
+                return pos
+        pos = data.find(b"\xff", pos + 1, end)
+    return None
+
+
+def id3v2_size(data):
+    """Return the size of an ID3v2 tag at the start of data, or 0"""
+    if len(data) < ID3V2_HEADER_SIZE or data[:3] != b"ID3":
+        return 0
+    size = 0
+    for byte in data[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    footer = ID3V2_HEADER_SIZE if data[5] & 0x10 else 0
+    return ID3V2_HEADER_SIZE + size + footer
+
+
+def strip_junk(md: MyData, _timeout=None):
+    """Write the input to recover_fn without any junk between the ID3 tag and the first
+    MPEG frame"""
+    with open(md.input_file, "rb") as src:
+        if os.fstat(src.fileno()).st_size == 0:
+            return 1
+        with mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            tag_size = id3v2_size(data)
+            sync = find_frame_sync(data, tag_size)
+            if sync is None or sync == tag_size:
+                # Nothing to strip, so nothing this method can fix
+                return 1
+            with open(md.recover_fn, "wb", buffering=0) as dst:
+                dst.write(data[:tag_size])
+                copy_range(src.fileno(), dst.fileno(), sync, len(data) - sync)
+    return 0
+
+
+def run_ffmpeg(md: MyData, timeout, *options):
+    """Convert the input to recover_fn using ffmpeg with the given output options, killing
+    it if it takes longer than timeout seconds"""
+    try:
+        result = subprocess.run(
+            ["ffmpeg", "-y", "-v", "error", "-i", md.input_file, *options, md.recover_fn],
+            check=False,
+            capture_output=True,
+            timeout=timeout,
+        )
+    except FileNotFoundError as e:
+        if e.errno == 2 and e.filename == "ffmpeg":
+            raise MyException(code=1, msg="ffmpeg not found") from None
+        raise
+    except subprocess.TimeoutExpired:
+        return 1
+    return result.returncode
+
+
+def ffmpeg_remux(md: MyData, timeout=None):
+    """Copy the audio frames into a new container without re-encoding"""
+    return run_ffmpeg(md, timeout, "-c:a", "copy", "-f", "mp3")
+
+
+def ffmpeg_reencode(md: MyData, timeout=None):
+    """Decode and re-encode the audio - slow and lossy so only used as a last resort"""
+    return run_ffmpeg(md, timeout, "-f", "mp3")
+
+
+# Recovery methods, cheapest first
+RECOVERY_METHODS = [
+    ("stripping junk", strip_junk),
+    ("ffmpeg remux", ffmpeg_remux),
+    ("ffmpeg re-encode", ffmpeg_reencode),
+]
+
+
+def recover_mp3(md: MyData, is_valid, timeout=None, out=None, engine=None):
+    """Try each recovery method in turn until is_valid(file name) accepts the result, which
+    then becomes the temporary file. Returns 0 if the file was recovered"""
+    out = out or sys.stdout
+    engine = engine or DEFAULT_ENGINE
+    print(f"\n **** Trying to recover\n{md.input_file} ****", file=out)
+    for name, method in RECOVERY_METHODS:
+        try:
+            if method(md, timeout) == 0 and is_valid(md.recover_fn):
+                os.replace(md.recover_fn, md.temp_fn)
+                print(f" **** Recovered by {name} ****", file=out)
+                engine.release(md.temp_fn)
+                return 0
+        except MyException as e:
+            # Only ffmpeg raises this, and later methods need ffmpeg too
+            print(f"\n **** {e.msg} ****\n", file=out)
+            break
+        finally:
+            if os.path.isfile(md.recover_fn):
+                os.remove(md.recover_fn)
+            # ffmpeg reads the input with its own buffering
+            engine.release(md.input_file)
+    return 1
+
+
+class RecoveryScheduler:
+    """Recover files on a bounded pool of workers, so at most jobs ffmpeg processes run at
+    once and healthy files can be tagged in the meantime"""
+
+    def __init__(self, jobs, timeout, engine=None):
+        self.jobs = jobs
+        self.engine = engine
+        # Started by the first submit, as most runs have nothing to recover
+        self.pool = None
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.pending = []
+
+    def _recover(self, md: MyData, is_valid, timer: StageTimer):
+        """Recover a file in a worker, returning its output so it can be printed in one piece"""
+        out = io.StringIO()
+        with timer.stage("recover", md.stat.st_size):
+            result = recover_mp3(md, is_valid, timeout=self.timeout, out=out, engine=self.engine)
+        return result, out.getvalue()
+
+    def submit(self, md: MyData, is_valid, timer=None):
+        """Queue a file for recovery, adding the time taken to timer"""
+        timer = timer or StageTimer()
+        with self.lock:
+            if self.pool is None:
+                # pylint: disable-next=import-outside-toplevel
+                from concurrent.futures import ThreadPoolExecutor
+
+                self.pool = ThreadPoolExecutor(max_workers=self.jobs)
+            future = self.pool.submit(self._recover, md, is_valid, timer)
+            self.pending.append((md, future, timer))
+
+    def results(self):
+        """Yield (md, result, output, timer) for each queued file in the order they were
+        queued, waiting for each one to finish"""
+        with self.lock:
+            pending, self.pending = self.pending, []
+        for md, future, timer in pending:
+            result, output = future.result()
+            yield md, result, output, timer
+
+    def close(self):
+        """Wait for the workers to finish"""
+        if self.pool is not None:
+            self.pool.shutdown()
@@ -0,0 +1,51 @@
+"""Prune backups which are older than the retention period"""
+
+import os
+import re
+import threading
+from datetime import date, timedelta
+
+# Backups are saved as <backup_dir>/<album>/pod_YYYY-MM-DD-<name>.mp3
+BACKUP_RE = re.compile(r"^pod_[0-9]{4}-[0-9]{2}-[0-9]{2}-.*\.mp3$")
+DATE_PREFIX_LENGTH = len("pod_YYYY-MM-DD")
+
+
+def prune_backups(backup_dir, retention_days, today=None, keep=()):
+    """Delete backups released more than retention_days before today, judging age by the
+    release date in the file name so no file is stat'ed. Files in keep are left alone.
+    Returns the list of files deleted"""
+    cutoff = (today or date.today()) - timedelta(days=retention_days)
+    # Names are zero padded, so comparing the date prefix as a string compares the dates
+    cutoff_prefix = f"pod_{cutoff:%Y-%m-%d}"
+    keep = set(keep)
+    deleted = []
+    with os.scandir(backup_dir) as albums:
+        album_dirs = [entry.path for entry in albums if entry.is_dir()]
+    for album_dir in album_dirs:
+        with os.scandir(album_dir) as backups:
+            expired = [
+                entry.path
+                for entry in backups
+                if entry.name[:DATE_PREFIX_LENGTH] < cutoff_prefix
+                and BACKUP_RE.match(entry.name)
+                and entry.path not in keep
+            ]
+        for file_name in expired:
+            os.remove(file_name)
+            deleted.append(file_name)
+        if expired and not os.listdir(album_dir):
+            os.rmdir(album_dir)
+    return deleted
+
+
+class BackgroundPruner(threading.Thread):
+    """Run prune_backups in a background thread"""
+
+    def __init__(self, backup_dir, retention_days, today=None, keep=()):
+        super().__init__(name="backup-pruner")
+        self.args = (backup_dir, retention_days, today, keep)
+        self.deleted = []
+
+    def run(self):
+        """Prune the backups"""
+        self.deleted = prune_backups(*self.args)
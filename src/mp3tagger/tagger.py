@@ -1,38 +1,134 @@
 """ Change mp3 tags to what I need"""
 
 import argparse
-import glob
+import importlib.util
+import io
 import os.path
+import re
 import shutil
 import sys
-from importlib.metadata import version
+from collections import deque
+from itertools import chain
 
 from mp3tagger._util import (
     MyData,
     MyException,
     RawFormatter,
+    RecoveryNeeded,
+    StageTimer,
+    VersionAction,
     move_to_final,
     move_to_reject,
+    remove_temp_file,
     save_original_file,
+    scan_source,
 )
-from mp3tagger.config import read_config
-from mp3tagger.id3handler import ID3Handler
+from mp3tagger.config import CONFIG_DIR, config_bool, read_config
+from mp3tagger.fileops import FileOps
+from mp3tagger.ioengine import DEFAULT_BUFFER_SIZE, IOEngine
+from mp3tagger.metrics import METRICS_FORMATS, RunMetrics
+from mp3tagger.names import DEFAULT_NAME_FORMATS, FileNameParser, parse_name_formats
+from mp3tagger.pipeline import Job, StagedPipeline
+from mp3tagger.retention import BackgroundPruner, prune_backups
+from mp3tagger.titles import TitleNormaliser, parse_title_rules
+
+# mutagen, sqlite3, ctypes, concurrent.futures and package metadata are only imported once
+# they are needed, as most runs from cron find nothing to do.
+# See tests/test_startup.py for the import time budget.
 
 LINE_LENGTH = 90
 
+# Temporary files are temp.mp3, or temp-<job>.mp3 for each file in a run
+TEMP_FILE_RE = re.compile(r"/temp(-[0-9]+)?\.mp3$")
+
+# Results of process_file
+PROCESSED = 0
+IGNORED = 1
+SKIPPED = 2
+DEFERRED = 3
+DUPLICATE = 4
+# Processed, but the tags were already right so they weren't rewritten
+UNCHANGED = 5
+
+
+class EpisodeJob(Job):
+    """A file passing through the stages of a StagedPipeline"""
+
+    def __init__(self, file_name, job_id, stat):
+        super().__init__()
+        self.file_name = file_name
+        self.job_id = job_id
+        self.stat = stat
+        self.out = io.StringIO()
+        self.timer = StageTimer()
+        self.md = None
+        self.id3 = None
+        self.result = None
+
+
+def short_file_name(full_file_name):
+    """Return album/file name, truncated to fit on a line"""
+    parts = full_file_name.split("/")
+    short_name = parts[-2] + "/" + parts[-1]
+    if len(short_name) > LINE_LENGTH:
+        short_name = short_name[: LINE_LENGTH - 4] + "...."
+    return short_name
+
 
 class Mp3Tagger:
     """Change mp3 tags to what I need"""
 
+    apply_file = None
+    artwork = None
+    artwork_cache_dir = None
+    artwork_max_size = 0
     backup_dir = None
     config_file = None
+    dedup = None
     dest_dir = None
+    header_only_tags = True
+    index = None
+    index_file = None
+    io_buffer_size = DEFAULT_BUFFER_SIZE
+    io_drop_cache = False
+    jobs = 1
+    journal = None
+    journal_file = None
     log_retention_days = 7
+    metrics_file = None
+    metrics_format = "jsonl"
     parser = None
+    pipeline = False
+    pipeline_queue_size = 2
+    plan_file = None
+    prune = False
+    prune_after_run = False
+    recovery = None
+    recovery_jobs = 2
+    recovery_timeout = 600.0
     reject_dir = None
     remove_source_file = False
+    retag = False
     source_dir = None
+    # DEFAULT_TAG_PADDING in id3handler, which is only imported when needed
+    tag_padding = 4096
+    use_dedup = False
+    use_index = False
     verbose = False
+    watch = False
+    watch_poll_seconds = 60.0
+    watch_settle_seconds = 30.0
+
+    def __init__(self):
+        self.metrics = RunMetrics()
+        # Totals for the run, updated as each file is recorded
+        self.timer = self.metrics.totals
+        # Backups made in this run, which mustn't be pruned at the end of it
+        self.new_backups = set()
+        self.ops = FileOps()
+        self.engine = IOEngine()
+        self.titles = TitleNormaliser()
+        self.names = FileNameParser()
 
     def make_cmd_line_parser(self):
         """Set up the command line parser"""
@@ -43,8 +139,8 @@ class Mp3Tagger:
         self.parser.add_argument(
             "-V",
             "--version",
-            action="version",
-            version=version("dml-mp3tagger"),
+            action=VersionAction,
+            version="dml-mp3tagger",
             help="Print the version number",
         )
         self.parser.add_argument(
@@ -67,6 +163,80 @@ class Mp3Tagger:
             default=None,
             help="Configuration file to use",
         )
+        self.parser.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            default=1,
+            help="Number of files to process in parallel",
+        )
+        self.parser.add_argument(
+            "-P",
+            "--pipeline",
+            action="store_true",
+            default=False,
+            help="Read, tag and write consecutive files at the same time (instead of --jobs)",
+        )
+        self.parser.add_argument(
+            "-i",
+            "--index",
+            action="store_true",
+            default=False,
+            help="Skip files which were processed before and haven't changed since",
+        )
+        self.parser.add_argument(
+            "-D",
+            "--dedup",
+            action="store_true",
+            default=False,
+            help="Skip episodes with the same audio as one already processed in the album",
+        )
+        self.parser.add_argument(
+            "-w",
+            "--watch",
+            action="store_true",
+            default=False,
+            help="Keep running, processing new files once they have finished downloading",
+        )
+        self.parser.add_argument(
+            "-m",
+            "--metrics",
+            default=None,
+            help="Write per-file and run metrics to this file (JSON lines are appended)",
+        )
+        self.parser.add_argument(
+            "--metrics-format",
+            choices=METRICS_FORMATS,
+            default="jsonl",
+            help="Format of the metrics file - JSON lines, or Prometheus textfile collector",
+        )
+        self.parser.add_argument(
+            "--plan",
+            nargs="?",
+            const="-",
+            default=None,
+            metavar="PLAN_FILE",
+            help="Write what a run would do as JSON (to stdout if no file is given) and exit",
+        )
+        self.parser.add_argument(
+            "--apply",
+            default=None,
+            metavar="PLAN_FILE",
+            help="Process the files in a plan made with --plan",
+        )
+        self.parser.add_argument(
+            "--retag",
+            action="store_true",
+            default=False,
+            help="Re-tag the files already in dest_dir (e.g. after changing title_strip) and exit",
+        )
+        self.parser.add_argument(
+            "-p",
+            "--prune",
+            action="store_true",
+            default=False,
+            help="Delete backups older than log_retention_days and exit",
+        )
 
     def parse_args(self):
         """Parse the command line arguments"""
@@ -75,6 +245,17 @@ class Mp3Tagger:
         self.verbose = args.verbose
         self.remove_source_file = args.remove_source_file
         self.config_file = args.config_file
+        self.jobs = max(1, args.jobs)
+        self.pipeline = args.pipeline
+        self.use_index = args.index
+        self.use_dedup = args.dedup
+        self.watch = args.watch
+        self.metrics_file = args.metrics
+        self.metrics_format = args.metrics_format
+        self.prune = args.prune
+        self.retag = args.retag
+        self.plan_file = args.plan
+        self.apply_file = args.apply
 
     def read_config(self):
         """Read the config file"""
@@ -85,6 +266,35 @@ class Mp3Tagger:
         self.dest_dir = config["dest_dir"]
         self.backup_dir = config["backup_dir"]
         self.reject_dir = config["reject_dir"]
+        self.prune_after_run = config_bool(config.get("prune_after_run", self.prune_after_run))
+        self.artwork_max_size = int(config.get("artwork_max_size", self.artwork_max_size))
+        self.artwork_cache_dir = config.get("artwork_cache_dir") or os.path.join(
+            CONFIG_DIR, "artwork"
+        )
+        self.header_only_tags = config_bool(config.get("header_only_tags", self.header_only_tags))
+        self.pipeline_queue_size = int(config.get("pipeline_queue_size", self.pipeline_queue_size))
+        self.io_buffer_size = int(config.get("io_buffer_kb", self.io_buffer_size // 1024)) * 1024
+        self.io_drop_cache = config_bool(config.get("io_drop_cache", self.io_drop_cache))
+        self.tag_padding = int(config.get("tag_padding", self.tag_padding))
+        self.recovery_jobs = int(config.get("recovery_jobs", self.recovery_jobs))
+        self.recovery_timeout = float(config.get("recovery_timeout", self.recovery_timeout))
+        self.watch_poll_seconds = float(config.get("watch_poll_seconds", self.watch_poll_seconds))
+        self.watch_settle_seconds = float(
+            config.get("watch_settle_seconds", self.watch_settle_seconds)
+        )
+        if "title_strip" in config:
+            self.titles = TitleNormaliser(parse_title_rules(config["title_strip"]))
+        if "file_name_formats" in config:
+            formats = parse_name_formats(config["file_name_formats"])
+            try:
+                self.names = FileNameParser(DEFAULT_NAME_FORMATS + tuple(formats))
+            except ValueError as e:
+                raise MyException(msg=f"Invalid file_name_formats: {e}", code=1) from None
+        self.index_file = config.get("index_file") or os.path.join(CONFIG_DIR, "processed.sqlite")
+        if config_bool(config.get("journal", "yes")):
+            self.journal_file = config.get("journal_file") or os.path.join(
+                CONFIG_DIR, "journal.jsonl"
+            )
 
     def validate_config(self):
         """Validate the config file"""
@@ -97,68 +307,398 @@ class Mp3Tagger:
         if not os.path.isdir(self.reject_dir):
             raise FileNotFoundError(self.reject_dir)
 
-    def process_file(self, full_file_name):
-        """Process current file"""
-        parts = full_file_name.split("/")
-        short_name = parts[-2] + "/" + parts[-1]
-        if len(short_name) > LINE_LENGTH:
-            short_name = short_name[: LINE_LENGTH - 4] + "...."
-        if "/temp.mp3" in full_file_name:
-            # Ignore temporary files
-            print(
-                f"Ignoring temporary file {short_name}",
-            )
-            return 1
-        print(f"Processing file {short_name}", end="")
-        md = MyData(
-            input_file=full_file_name,
-            dest_dir=self.dest_dir,
-            backup_dir=self.backup_dir,
-            reject_dir=self.reject_dir,
+    def process_file(self, full_file_name, job_id=None, out=None, stat=None):
+        """Process current file - progress is written to out (default stdout)"""
+        out = out or sys.stdout
+        timer = StageTimer()
+        result = self.check_file(full_file_name, out, stat, timer)
+        if result is not None:
+            return result
+        md = self.start_file(full_file_name, job_id, out, stat, timer)
+        try:
+            if self.is_duplicate(md, out, timer):
+                return DUPLICATE
+            id3 = self.make_id3_handler(timer)
+            try:
+                id3.read(md, defer_recovery=self.recovery is not None)
+            except RecoveryNeeded:
+                self.defer_file(md, out, timer)
+                return DEFERRED
+            id3.retag(md)
+            self.write_file(md, id3)
+            self.finish_file(md, timer, id3.content_hash)
+        except Exception as inst:
+            self.reject_file(md, out, timer)
+            raise inst
+        print(" - OK", file=out)
+        return self.record_processed(md, id3, timer)
+
+    def journal_state(self, md: MyData, state):
+        """Record a file reaching a state in the journal, if there is one"""
+        if self.journal is not None:
+            self.journal.record(md, state, self.remove_source_file)
+
+    def write_file(self, md: MyData, id3):
+        """Write the tagged file to the temporary file"""
+        self.journal_state(md, "started")
+        id3.write(md)
+        self.journal_state(md, "tagged")
+
+    def make_id3_handler(self, timer: StageTimer):
+        """Return an ID3Handler with the current settings"""
+        from mp3tagger.id3handler import ID3Handler  # pylint: disable=import-outside-toplevel
+
+        return ID3Handler(
+            timer,
+            self.titles,
+            self.header_only_tags,
+            self.artwork,
+            self.engine,
+            self.tag_padding,
+            # The index records the hash of each input file kept in the source directory
+            hash_input=self.index is not None and not self.remove_source_file,
         )
+
+    def check_file(self, full_file_name, out, stat, timer: StageTimer):
+        """Return IGNORED or SKIPPED if the file shouldn't be processed, otherwise None"""
+        short_name = short_file_name(full_file_name)
+        if TEMP_FILE_RE.search(full_file_name):
+            # Ignore temporary files
+            print(f"Ignoring temporary file {short_name}", file=out)
+            self.metrics.record(full_file_name, "ignored", timer)
+            return IGNORED
+        if self.index is not None:
+            stat = stat or os.stat(full_file_name)
+            if self.index.is_processed(full_file_name, stat):
+                if self.verbose:
+                    print(f"Skipping unchanged file {short_name}", file=out)
+                self.metrics.record(full_file_name, "skipped", timer)
+                return SKIPPED
+        return None
+
+    def start_file(self, full_file_name, job_id, out, stat, timer: StageTimer):
+        """Announce the file and return its MyData"""
+        print(f"Processing file {short_file_name(full_file_name)}", end="", file=out)
         try:
-            id3 = ID3Handler()
-            id3.process_podcast(md)
+            return MyData(
+                input_file=full_file_name,
+                dest_dir=self.dest_dir,
+                backup_dir=self.backup_dir,
+                reject_dir=self.reject_dir,
+                job_id=job_id,
+                stat=stat,
+                names=self.names,
+            )
+        except MyException:
+            self.metrics.record(full_file_name, "invalid", timer)
+            raise
+
+    def is_duplicate(self, md: MyData, out, timer: StageTimer):
+        """Return True, after dealing with the original, if the file has the same audio as
+        one already processed"""
+        if self.dedup is None:
+            return False
+        with timer.stage("dedup", md.stat.st_size):
+            earlier = self.dedup.claim(md.input_file, md.album_name)
+        if earlier is None:
+            return False
+        print(f" - duplicate of {short_file_name(earlier)}", file=out)
+        if self.remove_source_file:
+            with timer.stage("backup"):
+                save_original_file(md, self.ops)
+            self.new_backups.add(md.backup_file)
+        self.metrics.record(md.input_file, "duplicate", timer)
+        return True
+
+    def defer_file(self, md: MyData, out, timer: StageTimer):
+        """Hand a file which needs recovering to the recovery scheduler"""
+        from mp3tagger.id3handler import is_valid_mp3  # pylint: disable=import-outside-toplevel
+
+        if self.dedup is not None:
+            # Later copies aren't held up by the recovery - the file is checked again after
+            self.dedup.release(md.input_file)
+        # Recovery writes a temporary file of its own
+        self.journal_state(md, "started")
+        self.recovery.submit(md, is_valid_mp3, timer)
+        print(" - queued for recovery", file=out)
+
+    def reject_file(self, md: MyData, out, timer: StageTimer):
+        """Move a file which couldn't be processed to the reject folder"""
+        print("\n    moved to reject ??????????", file=out)
+        if self.dedup is not None:
+            self.dedup.release(md.input_file)
+        self.journal_state(md, "rejected")
+        move_to_reject(md, self.ops)
+        self.metrics.record(md.input_file, "rejected", timer)
+
+    def finish_file(self, md: MyData, timer: StageTimer, content_hash=None):
+        """Move a tagged file into place and deal with the original. content_hash is the
+        hash of the input file for the index, if it was taken as the file was written"""
+        with timer.stage("move"):
+            move_to_final(md, self.ops)
+        self.journal_state(md, "finalized")
+
+        if self.remove_source_file:
+            with timer.stage("backup"):
+                save_original_file(md, self.ops)
+            self.journal_state(md, "backed_up")
+            self.new_backups.add(md.backup_file)
+        elif self.index is not None:
+            self.index.record(md.input_file, md.output_file, md.stat, content_hash)
+        if self.dedup is not None:
+            self.dedup.record(md.input_file, md.output_file)
 
-            move_to_final(md)
+    def record_processed(self, md: MyData, id3, timer: StageTimer):
+        """Record a processed file, returning UNCHANGED if its tags didn't need writing"""
+        self.metrics.record(
+            md.input_file, "processed", timer, tags_written=id3.dirty, save=id3.saved
+        )
+        return PROCESSED if id3.dirty else UNCHANGED
 
-            if self.remove_source_file:
-                save_original_file(md)
+    def finish_recovered_file(self, md: MyData, result, output, timer: StageTimer):
+        """Tag a file once the recovery scheduler has finished with it"""
+        print(f"Finishing file {short_file_name(md.input_file)}", end="")
+        print(output, end="")
+        try:
+            if result != 0:
+                raise MyException(msg=f"{md.input_file} is not a valid MP3", code=2)
+            if self.is_duplicate(md, sys.stdout, timer):
+                remove_temp_file(md)
+                return DUPLICATE
+            id3 = self.make_id3_handler(timer)
+            id3.read(md, recovered=True)
+            id3.retag(md)
+            self.write_file(md, id3)
+            self.finish_file(md, timer, id3.content_hash)
         except Exception as inst:
-            print("\n    moved to reject ??????????")
-            move_to_reject(md)
+            self.reject_file(md, sys.stdout, timer)
             raise inst
         print(" - OK")
-        return 0
+        return self.record_processed(md, id3, timer)
 
-    def process_all_files(self):
-        """Process all files in the source directory"""
+    def _finish_recoveries(self):
+        """Yield (file_name, result, error message) for each file queued for recovery"""
+        if self.recovery is None:
+            return
+        for md, result, output, timer in self.recovery.results():
+            try:
+                yield md.input_file, self.finish_recovered_file(md, result, output, timer), None
+            except MyException as inst:
+                yield md.input_file, None, inst.msg
 
-        all_files = sorted(glob.glob(f"{self.source_dir}/*/*.mp3"))
-        if len(all_files) == 0:
-            print(f"No files found in {self.source_dir}")
-            return 0
+    def _process_buffered(self, file_name, job_id, stat):
+        """Process a file in a worker, returning its output so it can be printed in one piece"""
+        out = io.StringIO()
+        result, msg = None, None
+        try:
+            result = self.process_file(file_name, job_id=job_id, out=out, stat=stat)
+        except MyException as inst:
+            msg = inst.msg
+        return file_name, result, msg, out.getvalue()
+
+    @staticmethod
+    def _collect(future):
+        """Print the output of a finished worker and return its result"""
+        file_name, result, msg, output = future.result()
+        print(output, end="")
+        return file_name, result, msg
+
+    def _process_files(self, files):
+        """Yield (file_name, result, error message) for each (file_name, stat) in files, in
+        the order given. result is None if the file was rejected"""
+        if self.pipeline:
+            yield from self._process_pipelined(files)
+            return
+        if self.jobs == 1:
+            for job_id, (file_name, stat) in enumerate(files):
+                try:
+                    yield file_name, self.process_file(file_name, job_id, stat=stat), None
+                except MyException as inst:
+                    yield file_name, None, inst.msg
+            return
+        # pylint: disable-next=import-outside-toplevel
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            pending = deque()
+            for job_id, (file_name, stat) in enumerate(files):
+                pending.append(pool.submit(self._process_buffered, file_name, job_id, stat))
+                # Results are reported in submission order so output matches a serial run
+                while pending and pending[0].done():
+                    yield self._collect(pending.popleft())
+            while pending:
+                yield self._collect(pending.popleft())
+
+    def _read_stage(self, job: EpisodeJob):
+        """Pipeline stage: check the file and read its tags"""
+        job.result = self.check_file(job.file_name, job.out, job.stat, job.timer)
+        if job.result is not None:
+            job.finished = True
+            return
+        job.md = self.start_file(job.file_name, job.job_id, job.out, job.stat, job.timer)
+        if self.is_duplicate(job.md, job.out, job.timer):
+            job.result = DUPLICATE
+            job.finished = True
+            return
+        job.id3 = self.make_id3_handler(job.timer)
+        try:
+            job.id3.read(job.md, defer_recovery=self.recovery is not None)
+        except RecoveryNeeded:
+            self.defer_file(job.md, job.out, job.timer)
+            job.result = DEFERRED
+            job.finished = True
+
+    @staticmethod
+    def _tag_stage(job: EpisodeJob):
+        """Pipeline stage: work out the new tags"""
+        job.id3.retag(job.md)
+
+    def _write_stage(self, job: EpisodeJob):
+        """Pipeline stage: write the tagged file and move everything into place"""
+        self.write_file(job.md, job.id3)
+        self.finish_file(job.md, job.timer, job.id3.content_hash)
+        print(" - OK", file=job.out)
+        job.result = self.record_processed(job.md, job.id3, job.timer)
+
+    def _process_pipelined(self, files):
+        """Yield (file_name, result, error message) for each (file_name, stat) in files,
+        overlapping the reading, tagging and writing of consecutive files"""
+        pipeline = StagedPipeline(
+            [self._read_stage, self._tag_stage, self._write_stage], self.pipeline_queue_size
+        )
+        jobs = (
+            EpisodeJob(file_name, job_id, stat) for job_id, (file_name, stat) in enumerate(files)
+        )
+        for job in pipeline.run(jobs):
+            if job.error is not None and job.md is not None:
+                # Same as process_file - whichever stage failed, the file is rejected
+                self.reject_file(job.md, job.out, job.timer)
+            print(job.out.getvalue(), end="")
+            if job.error is None:
+                yield job.file_name, job.result, None
+            elif isinstance(job.error, MyException):
+                yield job.file_name, None, job.error.msg
+            else:
+                raise job.error
+
+    def _scan_files(self):
+        """Yield (file_name, stat) for every episode, an album directory at a time"""
+        for _, episodes in scan_source(self.source_dir):
+            for entry in episodes:
+                yield entry.path, entry.stat()
+
+    def process_all_files(self, files=None):
+        """Process all files in the source directory, or the (file_name, stat) in files"""
+
+        found_files = 0
         bad_files = 0
         bad_list = []
         good_files = 0
-        for file_name in all_files:
-            try:
-                self.process_file(file_name)
+        skipped_files = 0
+        duplicate_files = 0
+        unchanged_files = 0
+        album_dir = None
+        if files is None:
+            files = self._scan_files()
+        results = chain(self._process_files(files), self._finish_recoveries())
+        for file_name, result, msg in results:
+            found_files += 1
+            if os.path.dirname(file_name) != album_dir:
+                # Results arrive in order, so the previous album is finished
+                self.sync()
+                album_dir = os.path.dirname(file_name)
+            if result == DEFERRED:
+                continue
+            if result == SKIPPED:
+                skipped_files += 1
+            elif result == DUPLICATE:
+                duplicate_files += 1
+            elif msg is None:
                 good_files += 1
-            except MyException as inst:
-                msg = inst.msg
+                if result == UNCHANGED:
+                    unchanged_files += 1
+            else:
                 print(f"    ({msg})")
                 bad_files += 1
                 bad_list.append(file_name)
+        self.sync()
+        if found_files == 0:
+            print(f"No files found in {self.source_dir}")
+            return 0
         print(f"Processed {good_files} good files", end=" ")
         if bad_files > 0:
             print(f"{bad_files} bad files.")
             print("Bad files:")
             for file_name in bad_list:
                 print(f"    {file_name}")
+        if skipped_files > 0:
+            print(f"\nSkipped {skipped_files} unchanged files", end="")
+        if unchanged_files > 0:
+            print(f"\n{unchanged_files} files already had the right tags", end="")
+        if duplicate_files > 0:
+            print(f"\nSkipped {duplicate_files} duplicate files", end="")
+        if self.ops.fallbacks:
+            print(
+                f"\n{len(self.ops.fallbacks)} moves copied the file because the folders are on"
+                " different devices",
+                end="",
+            )
+            if self.verbose:
+                for src, dst in self.ops.fallbacks:
+                    print(f"\n    {src} -> {dst}", end="")
         print("\nEnd of run ++++++++++")
         return 0
 
+    def sync(self):
+        """Make the moves and journal entries so far durable"""
+        self.ops.sync()
+        if self.journal is not None:
+            self.journal.sync()
+
+    def replay_journal(self):
+        """Finish or roll back the files an interrupted run left part way through"""
+        finished, rolled_back = self.journal.replay(self.ops)
+        if finished or rolled_back:
+            print(
+                f"Finished {finished} and rolled back {rolled_back} files left by an"
+                " interrupted run"
+            )
+
+    def watch_files(self):
+        """Process files as they finish downloading until interrupted"""
+        from mp3tagger.watcher import SourceWatcher  # pylint: disable=import-outside-toplevel
+
+        watcher = SourceWatcher(self.source_dir, self.watch_settle_seconds, self.watch_poll_seconds)
+        print(f"Watching {self.source_dir}")
+        try:
+            while True:
+                files = watcher.ready_files()
+                for _, _, msg in chain(self._process_files(files), self._finish_recoveries()):
+                    if msg is not None:
+                        print(f"    ({msg})")
+                self.sync()
+                if self.journal is not None:
+                    # Every file in the batch has been dealt with
+                    self.journal.clear()
+                self.ops.fallbacks.clear()
+                if files:
+                    # Each batch is reported as a run of its own
+                    self.write_metrics()
+                    self.metrics = RunMetrics()
+                    self.timer = self.metrics.totals
+                sys.stdout.flush()
+                watcher.wait()
+        except KeyboardInterrupt:
+            print("\nEnd of watch ++++++++++")
+        finally:
+            watcher.close()
+        return 0
+
+    def write_metrics(self):
+        """Write the metrics file if one was asked for"""
+        if self.metrics_file is not None:
+            self.metrics.write(self.metrics_file, self.metrics_format)
+
     def run(self):
         """Main entry point"""
 
@@ -166,16 +706,156 @@ class Mp3Tagger:
         self.parse_args()
         self.read_config()
         self.validate_config()
-        self.process_all_files()
+        if self.prune:
+            deleted = prune_backups(self.backup_dir, self.log_retention_days)
+            print(f"Pruned {len(deleted)} backups older than {self.log_retention_days} days")
+            return
+        if self.plan_file is not None:
+            self.make_plan()
+            return
+        if self.retag:
+            self.retag_all_files()
+            return
+        self.process()
+
+    def make_plan(self):
+        """Write the plan for the source directory, reading only file names and ID3 tags"""
+        # pylint: disable=import-outside-toplevel
+        from mp3tagger.planner import Planner, summary, write_plan
+
+        if self.use_index:
+            from mp3tagger.index import ProcessedIndex
+
+            self.index = ProcessedIndex(self.index_file)
+        try:
+            planner = Planner(
+                self.dest_dir,
+                self.backup_dir,
+                self.reject_dir,
+                self.remove_source_file,
+                self.titles,
+                self.names,
+                self.index,
+            )
+            plan = planner.plan(self._scan_files(), TEMP_FILE_RE.search)
+        finally:
+            if self.index is not None:
+                self.index.close()
+        write_plan(plan, self.plan_file)
+        if self.plan_file != "-":
+            print(summary(plan))
+
+    def retag_file(self, file_name, stat):
+        """Bring the tags of a file in dest_dir up to date, over the old tags where they fit,
+        returning how they were saved (None if they were already right)"""
+        timer = StageTimer()
+        md = MyData(
+            file_name, self.dest_dir, self.backup_dir, self.reject_dir, stat=stat, names=self.names
+        )
+        id3 = self.make_id3_handler(timer)
+        id3.read(md, defer_recovery=True)
+        id3.retag(md)
+        if id3.dirty and not id3.save_in_place(file_name):
+            id3.write(md)
+            shutil.copystat(file_name, md.temp_fn)
+            os.replace(md.temp_fn, file_name)
+        self.metrics.record(file_name, "retagged", timer, tags_written=id3.dirty, save=id3.saved)
+        return id3.saved
+
+    def retag_all_files(self):
+        """Re-tag every episode in dest_dir"""
+        self.engine = IOEngine(self.io_buffer_size, self.io_drop_cache)
+        saves = {None: 0, "in_place": 0, "rewrite": 0}
+        for _, episodes in scan_source(self.dest_dir):
+            for entry in episodes:
+                if TEMP_FILE_RE.search(entry.path):
+                    continue
+                try:
+                    saves[self.retag_file(entry.path, entry.stat())] += 1
+                except MyException as e:
+                    # Left as they are - e.g. files which need recovering
+                    print(f"Not retagged: {e.msg}")
+        print(
+            f"Retagged {saves['in_place'] + saves['rewrite']} files:"
+            f" {saves['in_place']} in place, {saves['rewrite']} rewritten,"
+            f" {saves[None]} already right"
+        )
+        self.write_metrics()
+
+    def process(self):
+        """Process the source directory with the current settings"""
+        self.engine = IOEngine(self.io_buffer_size, self.io_drop_cache)
+        self.ops = FileOps(
+            [self.source_dir, self.dest_dir, self.backup_dir, self.reject_dir], self.engine
+        )
+        # pylint: disable=import-outside-toplevel
+        files = None
+        if self.apply_file is not None:
+            from mp3tagger.planner import planned_files, read_plan
+
+            plan = read_plan(self.apply_file, self.dest_dir, self.backup_dir, self.reject_dir)
+            # Backups are made (or not) as planned
+            self.remove_source_file = plan["remove_source_file"]
+            files = planned_files(plan)
+        if self.use_index or self.use_dedup:
+            from mp3tagger.index import ProcessedIndex
+        if self.use_index:
+            self.index = ProcessedIndex(self.index_file)
+        if self.use_dedup:
+            from mp3tagger.dedup import DuplicateFinder
+
+            # Outputs of earlier runs are remembered in the index file
+            self.dedup = DuplicateFinder(self.index or ProcessedIndex(self.index_file))
+        if self.artwork_max_size > 0:
+            if importlib.util.find_spec("PIL") is None:
+                raise MyException(
+                    msg="artwork_max_size needs Pillow - pip install 'dml-mp3tagger[artwork]'",
+                    code=1,
+                )
+            from mp3tagger.artwork import ArtworkCache
+
+            self.artwork = ArtworkCache(self.artwork_cache_dir, self.artwork_max_size)
+        if self.journal_file is not None:
+            from mp3tagger.journal import Journal
+
+            self.journal = Journal(self.journal_file)
+            self.replay_journal()
+        if self.recovery_jobs > 0:
+            from mp3tagger.recover import RecoveryScheduler
+
+            self.recovery = RecoveryScheduler(
+                self.recovery_jobs, self.recovery_timeout, self.engine
+            )
+        try:
+            if self.watch and files is None:
+                self.watch_files()
+            else:
+                self.process_all_files(files)
+                if self.journal is not None:
+                    self.journal.clear()
+                pruner = None
+                if self.prune_after_run:
+                    pruner = BackgroundPruner(
+                        self.backup_dir, self.log_retention_days, keep=self.new_backups
+                    )
+                    pruner.start()
+                self.write_metrics()
+                if pruner is not None:
+                    pruner.join()
+                    print(f"Pruned {len(pruner.deleted)} old backups")
+        finally:
+            if self.index is not None:
+                self.index.close()
+            if self.dedup is not None and self.dedup.index is not self.index:
+                self.dedup.index.close()
+            if self.recovery is not None:
+                self.recovery.close()
+            if self.journal is not None:
+                self.journal.close()
 
 
 def main():
     """Main entry point"""
-    if shutil.which("ffmpeg") is None:
-        print("**************************")
-        print("**** ffmpeg not found ****")
-        print("**************************")
-        sys.exit(1)
     try:
         Mp3Tagger().run()
     except MyException as e:
@@ -0,0 +1,45 @@
+"""Tidy up episode titles"""
+
+import functools
+import re
+
+from mp3tagger._util import MyException
+
+# Removed from titles, in order of preference where they overlap. Patterns can be replaced
+# with title_strip in the ini file
+DEFAULT_TITLE_RULES = (
+    r"^[0-9]+[ \-]*",
+    r"^[ \-]+",
+    r"\d{2}\.\d{2}.\d{2,4}",
+    r"\d{2,4}-\d{2}-\d{2}",
+    r"comedy: *",
+    r"TED: *",
+    r"- *",
+)
+
+SPACES_RE = re.compile(r" {2,}")
+
+# Number of titles remembered by each TitleNormaliser
+CACHE_SIZE = 4096
+
+
+def parse_title_rules(value):
+    """Return the rules in a title_strip config value, one pattern per line"""
+    return [line.strip() for line in value.splitlines() if line.strip()]
+
+
+class TitleNormaliser:
+    """Remove everything matching any of the rules from a title in a single pass, then
+    collapse runs of spaces and strip trailing ones. Results are cached, as the same titles
+    come round again in each run"""
+
+    def __init__(self, rules=DEFAULT_TITLE_RULES):
+        try:
+            self.pattern = re.compile("|".join(f"(?:{rule})" for rule in rules))
+        except re.error as e:
+            raise MyException(msg=f"Invalid title_strip rule: {e}", code=1) from None
+        self.normalise = functools.lru_cache(maxsize=CACHE_SIZE)(self._normalise)
+
+    def _normalise(self, title):
+        """Tidy up the title"""
+        return SPACES_RE.sub(" ", self.pattern.sub("", title)).rstrip(" ")
@@ -0,0 +1,119 @@
+"""Watch the source directory for new downloads"""
+
+import ctypes
+import os
+import select
+import time
+
+from mp3tagger._util import scan_source
+
+# inotify(7) events which mean a download may have finished or appeared
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+EVENT_BUFFER_SIZE = 64 * 1024
+
+
+class Inotify:
+    """Minimal inotify wrapper using libc - raises AttributeError where inotify isn't
+    available (e.g. macOS)"""
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        init = self._libc.inotify_init1
+        self.fd = init(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watched = set()
+
+    def watch(self, path):
+        """Watch a directory for new or completed files"""
+        if path in self.watched:
+            return
+        if self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK) < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+        self.watched.add(path)
+
+    def wait(self, timeout):
+        """Wait up to timeout seconds for events, returning True if there were any"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        # We only need to know something happened, so discard the events
+        try:
+            while os.read(self.fd, EVENT_BUFFER_SIZE):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        """Stop watching"""
+        os.close(self.fd)
+
+
+class SourceWatcher:
+    """Report episodes in source_dir once they have stopped growing for settle_time seconds.
+    Uses inotify to wake up early where it can, otherwise polls every poll_interval seconds"""
+
+    def __init__(self, source_dir, settle_time, poll_interval):
+        self.source_dir = source_dir
+        self.settle_time = settle_time
+        self.poll_interval = poll_interval
+        # path -> ((size, mtime), time first seen with that size and mtime)
+        self.pending = {}
+        # path -> (size, mtime) of files already handed out and still in source_dir
+        self.handled = {}
+        self.next_check = None
+        try:
+            self.inotify = Inotify()
+            self.inotify.watch(source_dir)
+        except (AttributeError, OSError):
+            self.inotify = None
+
+    def ready_files(self):
+        """Return (file_name, stat) for each file which has stopped changing"""
+        now = time.monotonic()
+        pending = {}
+        # Files which have gone (e.g. moved to backup) are forgotten
+        handled = {}
+        ready = []
+        self.next_check = None
+        for album, episodes in scan_source(self.source_dir):
+            if self.inotify is not None:
+                self.inotify.watch(os.path.join(self.source_dir, album))
+            for entry in episodes:
+                stat = entry.stat()
+                key = (stat.st_size, stat.st_mtime_ns)
+                if self.handled.get(entry.path) == key:
+                    handled[entry.path] = key
+                    continue
+                previous = self.pending.get(entry.path)
+                since = previous[1] if previous and previous[0] == key else now
+                due = since + self.settle_time
+                if due <= now:
+                    ready.append((entry.path, stat))
+                    handled[entry.path] = key
+                else:
+                    pending[entry.path] = (key, since)
+                    self.next_check = due if self.next_check is None else min(self.next_check, due)
+        self.pending = pending
+        self.handled = handled
+        return ready
+
+    def wait(self):
+        """Wait until there may be more files ready"""
+        timeout = self.poll_interval
+        if self.next_check is not None:
+            timeout = min(timeout, max(0.0, self.next_check - time.monotonic()))
+        if self.inotify is None:
+            time.sleep(timeout)
+        else:
+            self.inotify.wait(timeout)
+
+    def close(self):
+        """Stop watching"""
+        if self.inotify is not None:
+            self.inotify.close()
@@ -0,0 +1,95 @@
+""" Test shrinking of cover art"""
+
+import io
+import os
+import shutil
+
+import pytest
+from mutagen.id3 import APIC, ID3
+
+from mp3tagger._util import MyData
+from mp3tagger.artwork import ArtworkCache, transcode
+from mp3tagger.id3handler import ID3Handler
+
+BASE_DIR = "/tmp/mp3_tagger/tests"
+BACKUP_DIR = f"{BASE_DIR}/backup"
+MP3_DIR = f"{BASE_DIR}/mp3"
+REJECT_DIR = f"{BASE_DIR}/rejects"
+DOWNLOAD_DIR = f"{BASE_DIR}/download/testAlbum"
+CACHE_DIR = f"{BASE_DIR}/artwork"
+
+RESOURCE_DIR = os.path.dirname(os.path.realpath(__file__)) + "/testresources"
+
+ARTWORK = b"\x89PNG" + b"\xff" * 1024 * 1024
+
+
+@pytest.fixture(autouse=True)
+def run_before_and_after_tests():
+    """Runs before and after each test"""
+    os.makedirs(MP3_DIR, exist_ok=True)
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    yield
+    shutil.rmtree(BASE_DIR)
+
+
+class FakeTranscoder:
+    """Count calls and return a small image in place of anything starting with PNG"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, data, max_size):
+        self.calls += 1
+        return b"small jpeg" if data.startswith(b"\x89PNG") else None
+
+
+def make_episode(name, encoding=3):
+    """Copy the test episode and embed ARTWORK in it"""
+    file_name = f"{DOWNLOAD_DIR}/{name}"
+    shutil.copy2(src=RESOURCE_DIR + "/240229-test1.mp3", dst=file_name)
+    tags = ID3(file_name)
+    tags.add(APIC(encoding=encoding, mime="image/png", type=3, desc="Cover", data=ARTWORK))
+    tags.save(file_name)
+    return file_name
+
+
+def test_each_image_is_transcoded_once():
+    """Test the cache returns the earlier result for the same image"""
+    transcoder = FakeTranscoder()
+    cache = ArtworkCache(CACHE_DIR, 600, transcoder)
+    assert cache.normalised(ARTWORK) == b"small jpeg"
+    assert cache.normalised(memoryview(ARTWORK)) == b"small jpeg"
+    assert cache.normalised(b"already a small jpeg") is None
+    assert cache.normalised(b"already a small jpeg") is None
+    assert transcoder.calls == 2
+    assert (cache.hits, cache.misses) == (2, 2)
+    # A new run finds the images converted by the last one
+    assert ArtworkCache(CACHE_DIR, 600, transcoder).normalised(ARTWORK) == b"small jpeg"
+    assert transcoder.calls == 2
+
+
+@pytest.mark.parametrize("header_only", [True, False])
+@pytest.mark.parametrize("encoding", [1, 3])
+def test_episodes_get_shrunk_artwork(header_only, encoding):
+    """Test the artwork in every episode of an album is replaced"""
+    transcoder = FakeTranscoder()
+    cache = ArtworkCache(CACHE_DIR, 600, transcoder)
+    for job_id, name in enumerate(("240229-one.mp3", "240301-two.mp3")):
+        md = MyData(make_episode(name, encoding), MP3_DIR, BACKUP_DIR, REJECT_DIR, job_id=job_id)
+        ID3Handler(header_only=header_only, artwork=cache).process_podcast(md)
+        picture = ID3(md.temp_fn)["APIC:Cover"]
+        assert (picture.data, picture.mime, picture.type) == (b"small jpeg", "image/jpeg", 3)
+        assert ID3(md.temp_fn)["TIT2"].text == [f"{name[:-4]}"]
+    assert transcoder.calls == 1
+
+
+def test_transcode():
+    """Test large images are scaled down and small JPEGs are left alone"""
+    image_module = pytest.importorskip("PIL.Image")
+    png = io.BytesIO()
+    image_module.new("RGB", (3000, 3000), "red").save(png, "PNG")
+    jpeg = transcode(png.getvalue(), 600)
+    with image_module.open(io.BytesIO(jpeg)) as image:
+        assert image.format == "JPEG" and image.size == (600, 600)
+    assert transcode(jpeg, 600) is None
+    assert transcode(b"not an image", 600) is None
@@ -0,0 +1,49 @@
+""" Test the benchmark harness"""
+
+import argparse
+import glob
+import shutil
+
+import pytest
+
+from mp3tagger.bench import make_source_tree, run_benchmark
+
+BASE_DIR = "/tmp/mp3_tagger/tests"
+
+
+@pytest.fixture(autouse=True)
+def run_before_and_after_tests():
+    """Runs before and after each test"""
+    yield
+    shutil.rmtree(BASE_DIR, ignore_errors=True)
+
+
+def test_make_source_tree():
+    """Test the synthetic tree has albums x episodes in both file name formats"""
+    total = make_source_tree(f"{BASE_DIR}/download", 2, 3, 10000, 20000)
+    files = sorted(glob.glob(f"{BASE_DIR}/download/*/*.mp3"))
+    assert len(files) == 6
+    assert files[0].endswith("Album_0000/240101-Episode_0000.mp3")
+    assert files[1].endswith("Album_0000/240103-Episode_0002.mp3")
+    assert files[2].endswith("Album_0000/pod_2024-01-02-Episode_0001.mp3")
+    assert total > 6 * 10000
+
+
+@pytest.mark.parametrize("pipeline", [False, True])
+def test_run_benchmark(pipeline):
+    """Test every synthetic episode ends up tagged, including the corrupt ones"""
+    args = argparse.Namespace(
+        albums=2,
+        episodes=4,
+        min_size=0.01,
+        max_size=0.02,
+        seed=0,
+        jobs=2,
+        pipeline=pipeline,
+        remove_source_file=True,
+    )
+    files, _, seconds, timer = run_benchmark(BASE_DIR, args)
+    assert files == 8 and seconds > 0
+    assert len(glob.glob(f"{BASE_DIR}/mp3/*/*.mp3")) == 8
+    assert len(glob.glob(f"{BASE_DIR}/backup/*/*.mp3")) == 8
+    assert {"parse", "tag", "write", "move", "backup", "recover"} <= set(timer.seconds)
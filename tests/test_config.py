@@ -3,7 +3,10 @@
 import os
 import shutil
 
+import pytest
+
 from mp3tagger import config
+from mp3tagger._util import MyException
 
 # import mock
 
@@ -16,6 +19,8 @@ OVERRIDE_CONFIG = OVERRIDE_DIR + "/mp3tagger.ini"
 EXPECTED_CONFIG_DICT = {
     "backup_dir": "/tmp/mp3_tagger/tests/backup",
     "dest_dir": "/tmp/mp3_tagger/tests/mp3",
+    "index_file": "/tmp/mp3_tagger/tests/processed.sqlite",
+    "journal_file": "/tmp/mp3_tagger/tests/journal.jsonl",
     "log_retention_days": "7",
     "reject_dir": "/tmp/mp3_tagger/tests/rejects",
     "source_dir": "/tmp/mp3_tagger/tests/download",
@@ -49,3 +54,11 @@ def test_config_not_overwritten(monkeypatch):
     with open(OVERRIDE_CONFIG, "r", encoding="ascii") as override_file:
         with open(TEST_CONFIG, "r", encoding="ascii") as test_file:
             assert list(test_file) == list(override_file)
+
+
+def test_config_bool():
+    """Test boolean values are converted and bad ones reported"""
+    assert config.config_bool("Yes") is True and config.config_bool(False) is False
+    with pytest.raises(MyException) as e:
+        config.config_bool("maybe")
+    assert e.value.msg == "Invalid boolean value: maybe"
@@ -0,0 +1,71 @@
+""" Test detection of episodes downloaded more than once"""
+
+import os
+import shutil
+
+import pytest
+from mutagen.id3 import ID3, TIT2
+
+from mp3tagger.dedup import DuplicateFinder, audio_hash
+from mp3tagger.index import ProcessedIndex
+
+BASE_DIR = "/tmp/mp3_tagger/tests"
+DOWNLOAD_DIR = f"{BASE_DIR}/download/testAlbum"
+DB_FILE = f"{BASE_DIR}/index/processed.sqlite"
+
+RESOURCE_DIR = os.path.dirname(os.path.realpath(__file__)) + "/testresources"
+
+
+@pytest.fixture(autouse=True)
+def run_before_and_after_tests():
+    """Runs before and after each test"""
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    shutil.copy2(src=RESOURCE_DIR + "/240229-test1.mp3", dst=DOWNLOAD_DIR + "/240229-test1.mp3")
+    shutil.copy2(src=RESOURCE_DIR + "/240229-test1.mp3", dst=DOWNLOAD_DIR + "/240229-copy.mp3")
+    yield
+    shutil.rmtree(BASE_DIR)
+
+
+def test_audio_hash_ignores_tags():
+    """Test copies with different tags have the same audio hash"""
+    tags = ID3(DOWNLOAD_DIR + "/240229-copy.mp3")
+    tags.add(TIT2(encoding=3, text="A much longer title than the original one had"))
+    tags.save(DOWNLOAD_DIR + "/240229-copy.mp3", v1=2, v2_version=3)
+    assert audio_hash(DOWNLOAD_DIR + "/240229-test1.mp3") == audio_hash(
+        DOWNLOAD_DIR + "/240229-copy.mp3"
+    )
+
+    with open(DOWNLOAD_DIR + "/240229-copy.mp3", "ab") as f:
+        f.write(b"more audio")
+    assert audio_hash(DOWNLOAD_DIR + "/240229-test1.mp3") != audio_hash(
+        DOWNLOAD_DIR + "/240229-copy.mp3"
+    )
+
+
+def test_duplicates_in_a_run():
+    """Test the second copy in an album is reported, but not a copy in another album"""
+    finder = DuplicateFinder()
+    assert finder.claim(DOWNLOAD_DIR + "/240229-test1.mp3", "testAlbum") is None
+    assert finder.claim(DOWNLOAD_DIR + "/240229-copy.mp3", "testAlbum") == (
+        DOWNLOAD_DIR + "/240229-test1.mp3"
+    )
+    assert finder.claim(DOWNLOAD_DIR + "/240229-copy.mp3", "otherAlbum") is None
+
+    # A rejected file doesn't count
+    finder.release(DOWNLOAD_DIR + "/240229-test1.mp3")
+    assert finder.claim(DOWNLOAD_DIR + "/240229-copy.mp3", "testAlbum") is None
+
+
+def test_duplicates_of_an_earlier_run():
+    """Test outputs recorded in the index are found by a later run"""
+    index = ProcessedIndex(DB_FILE)
+    finder = DuplicateFinder(index)
+    assert finder.claim(DOWNLOAD_DIR + "/240229-test1.mp3", "testAlbum") is None
+    finder.record(DOWNLOAD_DIR + "/240229-test1.mp3", "/mp3/testAlbum/240229-test1.mp3")
+
+    finder = DuplicateFinder(index)
+    assert (
+        finder.claim(DOWNLOAD_DIR + "/240229-copy.mp3", "testAlbum")
+        == "/mp3/testAlbum/240229-test1.mp3"
+    )
+    index.close()
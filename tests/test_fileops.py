@@ -0,0 +1,57 @@
+""" Test file operations"""
+
+import os
+import shutil
+
+import pytest
+
+from mp3tagger.fileops import FileOps
+
+BASE_DIR = "/tmp/mp3_tagger/tests"
+SOURCE_DIR = f"{BASE_DIR}/download"
+BACKUP_DIR = f"{BASE_DIR}/backup"
+
+
+@pytest.fixture(autouse=True)
+def run_before_and_after_tests():
+    """Runs before and after each test"""
+    os.makedirs(f"{SOURCE_DIR}/testAlbum", exist_ok=True)
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    for name in ("a.mp3", "b.mp3"):
+        with open(f"{SOURCE_DIR}/testAlbum/{name}", "w", encoding="ascii") as f:
+            f.write(name)
+    yield
+    shutil.rmtree(BASE_DIR)
+
+
+def test_move_on_same_device_renames():
+    """Test moves on one device are renames and the directory is only created once"""
+    ops = FileOps([SOURCE_DIR, BACKUP_DIR])
+    ops.move(f"{SOURCE_DIR}/testAlbum/a.mp3", f"{BACKUP_DIR}/testAlbum/a.mp3")
+    ops.move(f"{SOURCE_DIR}/testAlbum/b.mp3", f"{BACKUP_DIR}/testAlbum/b.mp3")
+    assert sorted(os.listdir(f"{BACKUP_DIR}/testAlbum")) == ["a.mp3", "b.mp3"]
+    assert ops.made_dirs == {f"{BACKUP_DIR}/testAlbum"}
+    assert ops.touched_dirs == {f"{SOURCE_DIR}/testAlbum", f"{BACKUP_DIR}/testAlbum"}
+    assert not ops.fallbacks
+    ops.sync()
+    assert not ops.touched_dirs
+
+
+def test_move_between_devices_is_reported():
+    """Test moves between devices fall back to a copy and are recorded"""
+    ops = FileOps([SOURCE_DIR, BACKUP_DIR])
+    # Pretend the backup folder is on another device
+    ops.root_devices = [(root, index) for index, (root, _) in enumerate(ops.root_devices)]
+    ops.move(f"{SOURCE_DIR}/testAlbum/a.mp3", f"{BACKUP_DIR}/testAlbum/a.mp3")
+    assert ops.fallbacks == [(f"{SOURCE_DIR}/testAlbum/a.mp3", f"{BACKUP_DIR}/testAlbum/a.mp3")]
+    assert not os.path.exists(f"{SOURCE_DIR}/testAlbum/a.mp3")
+
+
+def test_directory_removed_after_creation_is_recreated():
+    """Test a cached directory is made again if something removed it"""
+    ops = FileOps([SOURCE_DIR, BACKUP_DIR])
+    ops.move(f"{SOURCE_DIR}/testAlbum/a.mp3", f"{BACKUP_DIR}/testAlbum/a.mp3")
+    shutil.rmtree(f"{BACKUP_DIR}/testAlbum")
+    ops.move(f"{SOURCE_DIR}/testAlbum/b.mp3", f"{BACKUP_DIR}/testAlbum/b.mp3")
+    assert os.listdir(f"{BACKUP_DIR}/testAlbum") == ["b.mp3"]
+    ops.sync()
@@ -0,0 +1,91 @@
+""" Test reading tags without loading the frames we don't change"""
+
+import os
+import shutil
+import tracemalloc
+
+import pytest
+from mutagen.id3 import APIC, CHAP, ID3, TIT2, TPE1
+
+from mp3tagger._util import MyData
+from mp3tagger.headertags import HeaderOnlyTags, read_header_only
+from mp3tagger.id3handler import ID3Handler, probe_mp3
+
+BASE_DIR = "/tmp/mp3_tagger/tests"
+BACKUP_DIR = f"{BASE_DIR}/backup"
+MP3_DIR = f"{BASE_DIR}/mp3"
+REJECT_DIR = f"{BASE_DIR}/rejects"
+DOWNLOAD_DIR = f"{BASE_DIR}/download/testAlbum"
+INPUT_FILE = f"{DOWNLOAD_DIR}/240229-test1.mp3"
+
+RESOURCE_DIR = os.path.dirname(os.path.realpath(__file__)) + "/testresources"
+
+ARTWORK_SIZE = 4 * 1024 * 1024
+
+
+@pytest.fixture(autouse=True)
+def run_before_and_after_tests():
+    """Runs before and after each test"""
+    os.makedirs(MP3_DIR, exist_ok=True)
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    shutil.copy2(src=RESOURCE_DIR + "/240229-test1.mp3", dst=INPUT_FILE)
+    yield
+    shutil.rmtree(BASE_DIR)
+
+
+def add_artwork(file_name, v2_version=4):
+    """Give the file a title, artist, chapter and large cover art"""
+    tags = ID3(file_name)
+    tags.add(TIT2(encoding=0, text="123 - A title"))
+    tags.add(TPE1(encoding=1, text=["First artist", "Second artist"]))
+    tags.add(APIC(encoding=3, mime="image/jpeg", type=3, desc="Cover", data=b"\xff" * ARTWORK_SIZE))
+    tags.add(CHAP(element_id="ch1", start_time=0, end_time=1000, sub_frames=[TIT2(text="One")]))
+    tags.save(file_name, v2_version=v2_version)
+
+
+def test_text_frames_are_read_and_others_are_not():
+    """Test only the text frames we use are parsed"""
+    add_artwork(INPUT_FILE)
+    with open(INPUT_FILE, "rb") as f:
+        tags = read_header_only(f)
+    assert sorted(tags.keys()) == ["TIT2", "TPE1"]
+    assert tags["TIT2"].text == ["123 - A title"]
+    assert tags["TPE1"].text == ["First artist", "Second artist"]
+    assert len(tags.other_frames) == 2
+    assert tags.size == ID3(INPUT_FILE).size
+
+
+def test_other_versions_are_left_to_mutagen():
+    """Test ID3v2.3 and untagged files aren't read"""
+    add_artwork(INPUT_FILE, v2_version=3)
+    with open(INPUT_FILE, "rb") as f:
+        assert read_header_only(f) is None
+    with open(RESOURCE_DIR + "/240113-bad_mp3.mp3", "rb") as f:
+        assert read_header_only(f) is None
+
+
+def test_output_matches_mutagen():
+    """Test the tags written match those mutagen writes, with the artwork unchanged"""
+    add_artwork(INPUT_FILE)
+    outputs = []
+    for header_only in (True, False):
+        md = MyData(INPUT_FILE, MP3_DIR, BACKUP_DIR, REJECT_DIR, job_id=int(header_only))
+        id3 = ID3Handler(header_only=header_only)
+        id3.process_podcast(md)
+        assert isinstance(id3.audio, HeaderOnlyTags) == header_only
+        outputs.append(md.temp_fn)
+    tags = [ID3(output) for output in outputs]
+    assert tags[0].pprint() == tags[1].pprint()
+    assert tags[0]["APIC:Cover"].data == b"\xff" * ARTWORK_SIZE
+    with open(outputs[0], "rb") as f, open(outputs[1], "rb") as g:
+        assert f.read()[tags[0].size :] == g.read()[tags[1].size :]
+
+
+def test_memory_does_not_depend_on_artwork():
+    """Test the artwork isn't read into memory"""
+    add_artwork(INPUT_FILE)
+    tracemalloc.start()
+    probe_mp3(INPUT_FILE, header_only=True)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert peak < ARTWORK_SIZE / 16
@@ -5,9 +5,12 @@ import shutil
 import subprocess
 
 import pytest
+from mutagen.id3 import ID3, TCON, TDRL, TIT2
 
 from mp3tagger._util import MyData, MyException
-from mp3tagger.id3handler import ID3Handler, derive_title
+from mp3tagger.id3handler import TITLE, ID3Handler, derive_title, probe_mp3, tag_changes
+from mp3tagger.index import file_hash
+from mp3tagger.titles import TitleNormaliser
 
 # pylint: disable=R0801
 # from shutil import copy
@@ -147,3 +150,129 @@ def test_derive_title():
         actual_results.append(derive_title(value))
 
     assert actual_results == expected_results
+
+
+def test_id3handler_streams_audio_unchanged():
+    """test the audio after the tags is copied byte for byte, with ID3v1 kept up to date"""
+    input_file = DOWNLOAD_DIR + "/240229-test1.mp3"
+    shutil.copy2(src=RESOURCE_DIR + "/240229-test1.mp3", dst=input_file)
+    with open(input_file, "ab") as f:
+        f.write(b"TAG" + b"old title".ljust(125, b"\x00"))
+    md = MyData(
+        input_file=input_file,
+        dest_dir=MP3_DIR,
+        backup_dir=BACKUP_DIR,
+        reject_dir=REJECT_DIR,
+    )
+    id3 = ID3Handler()
+
+    assert id3.process_podcast(md) == 0
+    with open(input_file, "rb") as f:
+        original = f.read()
+    with open(md.temp_fn, "rb") as f:
+        output = f.read()
+    assert output[-128:-98].rstrip(b"\x00") == b"TAG240229-old title"
+    assert output[-128 - 100000 : -128] == original[-128 - 100000 : -128]
+
+
+def test_probe_mp3():
+    """test probe_mp3 returns validity and tags from one read"""
+    valid, tags = probe_mp3(RESOURCE_DIR + "/240229-test1.mp3")
+    assert valid and tags.version == (2, 4, 0)
+    assert probe_mp3(RESOURCE_DIR + "/240113-bad_mp3.mp3") == (True, None)
+    assert probe_mp3(RESOURCE_DIR + "/240131-not_a_mp3.mp3") == (False, None)
+
+
+def test_retagged_file_needs_no_changes():
+    """test a file which already has the right tags isn't rewritten"""
+    input_file = DOWNLOAD_DIR + "/240229-test1.mp3"
+    shutil.copy2(src=RESOURCE_DIR + "/240229-test1.mp3", dst=input_file)
+    md = MyData(
+        input_file=input_file, dest_dir=MP3_DIR, backup_dir=BACKUP_DIR, reject_dir=REJECT_DIR
+    )
+    id3 = ID3Handler()
+    id3.process_podcast(md)
+    assert id3.dirty and len(id3.changes) == 5
+
+    shutil.move(md.temp_fn, input_file)
+    md = MyData(
+        input_file=input_file, dest_dir=MP3_DIR, backup_dir=BACKUP_DIR, reject_dir=REJECT_DIR
+    )
+    id3 = ID3Handler()
+    id3.process_podcast(md)
+    assert not id3.dirty and id3.changes == []
+    with open(input_file, "rb") as f, open(md.temp_fn, "rb") as g:
+        assert f.read() == g.read()
+
+
+def test_tag_changes():
+    """test tags are compared by value and existing values kept where asked"""
+    audio = ID3()
+    audio.add(TIT2(encoding=3, text="a title"))
+    audio.add(TDRL(encoding=3, text="2024-02-29T00:00:00"))
+    title = ("TIT2", TIT2)
+    genre = ("TCON", TCON)
+    release = ("TDRL", TDRL)
+    assert (
+        tag_changes(audio, [(title, "a title", False), (release, "2024-02-29 00:00:00", False)])
+        == []
+    )
+    assert tag_changes(audio, [(title, "other", False), (genre, "Podcast", True)]) == [
+        (title, "other"),
+        (genre, "Podcast"),
+    ]
+    assert tag_changes(audio, [(title, "other", True)]) == []
+
+
+@pytest.mark.parametrize("header_only", [True, False])
+def test_retag_in_place(header_only):
+    """test new tags which fit in the old ones' padding are written over them in place"""
+    input_file = DOWNLOAD_DIR + "/240229-test1.mp3"
+    shutil.copy2(src=RESOURCE_DIR + "/240229-test1.mp3", dst=input_file)
+    md = MyData(
+        input_file=input_file, dest_dir=MP3_DIR, backup_dir=BACKUP_DIR, reject_dir=REJECT_DIR
+    )
+    ID3Handler(header_only=header_only).process_podcast(md)
+    shutil.move(md.temp_fn, input_file)
+    with open(input_file, "rb") as f:
+        original = f.read()
+
+    md = MyData(
+        input_file=input_file, dest_dir=MP3_DIR, backup_dir=BACKUP_DIR, reject_dir=REJECT_DIR
+    )
+    id3 = ID3Handler(titles=TitleNormaliser([r"^[0-9]+[ \-]*", "1$"]), header_only=header_only)
+    id3.read(md)
+    id3.retag(md)
+    assert id3.dirty and id3.save_in_place(input_file) and id3.saved == "in_place"
+    with open(input_file, "rb") as f:
+        output = f.read()
+    assert len(output) == len(original)
+    assert output[id3.body_start :] == original[id3.body_start :]
+    assert ID3(input_file)["TIT2"].text == ["240229-test"]
+
+    id3.set_tag(TITLE, "x" * 10000)
+    assert not id3.save_in_place(input_file)
+    with open(input_file, "rb") as f:
+        assert f.read() == output
+
+
+@pytest.mark.parametrize("retagged", [False, True])
+def test_input_hashed_while_written(retagged):
+    """test the input file's hash is taken as it is written out, with or without new tags"""
+    input_file = DOWNLOAD_DIR + "/240229-test1.mp3"
+    shutil.copy2(src=RESOURCE_DIR + "/240229-test1.mp3", dst=input_file)
+    with open(input_file, "ab") as f:
+        f.write(b"TAG" + b"old title".ljust(125, b"\x00"))
+    md = MyData(
+        input_file=input_file, dest_dir=MP3_DIR, backup_dir=BACKUP_DIR, reject_dir=REJECT_DIR
+    )
+    if retagged:
+        ID3Handler().process_podcast(md)
+        shutil.move(md.temp_fn, input_file)
+        md = MyData(
+            input_file=input_file, dest_dir=MP3_DIR, backup_dir=BACKUP_DIR, reject_dir=REJECT_DIR
+        )
+    id3 = ID3Handler(hash_input=True)
+    id3.process_podcast(md)
+    assert id3.dirty is not retagged
+    assert id3.content_hash == file_hash(input_file)
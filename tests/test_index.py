@@ -0,0 +1,58 @@
+""" Test the processed file index"""
+
+import os
+import shutil
+
+import pytest
+
+from mp3tagger.index import ProcessedIndex
+
+BASE_DIR = "/tmp/mp3_tagger/tests"
+DB_FILE = f"{BASE_DIR}/index/processed.sqlite"
+INPUT_FILE = f"{BASE_DIR}/download/testAlbum/240229-test1.mp3"
+OUTPUT_FILE = f"{BASE_DIR}/mp3/testAlbum/240229-test1.mp3"
+
+RESOURCE_DIR = os.path.dirname(os.path.realpath(__file__)) + "/testresources"
+
+
+@pytest.fixture(autouse=True)
+def run_before_and_after_tests():
+    """Runs before and after each test"""
+    os.makedirs(os.path.dirname(INPUT_FILE), exist_ok=True)
+    os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
+    shutil.copy2(src=RESOURCE_DIR + "/240229-test1.mp3", dst=INPUT_FILE)
+    shutil.copy2(src=RESOURCE_DIR + "/240229-test1.mp3", dst=OUTPUT_FILE)
+    yield
+    shutil.rmtree(BASE_DIR)
+
+
+def test_unchanged_file_is_processed():
+    """Test a recorded file which hasn't changed is reported as processed"""
+    index = ProcessedIndex(DB_FILE)
+    assert not index.is_processed(INPUT_FILE)
+    index.record(INPUT_FILE, OUTPUT_FILE)
+    assert index.is_processed(INPUT_FILE)
+    index.close()
+
+
+def test_touched_file_with_same_content_is_processed():
+    """Test only the content matters when the mtime changes"""
+    index = ProcessedIndex(DB_FILE)
+    index.record(INPUT_FILE, OUTPUT_FILE)
+    os.utime(INPUT_FILE, ns=(0, 0))
+    assert index.is_processed(INPUT_FILE)
+    index.close()
+
+
+def test_modified_or_missing_output_is_not_processed():
+    """Test a changed input or a missing output means the file is processed again"""
+    index = ProcessedIndex(DB_FILE)
+    index.record(INPUT_FILE, OUTPUT_FILE)
+    with open(INPUT_FILE, "r+b") as f:
+        f.write(b"\xff")
+    os.utime(INPUT_FILE, ns=(0, 0))
+    assert not index.is_processed(INPUT_FILE)
+    index.record(INPUT_FILE, OUTPUT_FILE)
+    os.remove(OUTPUT_FILE)
+    assert not index.is_processed(INPUT_FILE)
+    index.close()
@@ -0,0 +1,95 @@
+""" Test the I/O engine"""
+
+import os
+import shutil
+
+import pytest
+
+from mp3tagger import ioengine
+from mp3tagger.ioengine import MIN_BUFFER_SIZE, IOEngine
+
+BASE_DIR = "/tmp/mp3_tagger/tests"
+SOURCE_FILE = f"{BASE_DIR}/source.mp3"
+OUTPUT_FILE = f"{BASE_DIR}/output.mp3"
+
+DATA = bytes(range(256)) * (MIN_BUFFER_SIZE // 64)
+
+
+@pytest.fixture(autouse=True)
+def run_before_and_after_tests():
+    """Runs before and after each test"""
+    os.makedirs(BASE_DIR, exist_ok=True)
+    with open(SOURCE_FILE, "wb") as f:
+        f.write(DATA)
+    yield
+    shutil.rmtree(BASE_DIR)
+
+
+def copy(engine, offset, count):
+    """Copy part of the source file with the engine and return the output"""
+    with open(SOURCE_FILE, "rb") as src, open(OUTPUT_FILE, "wb", buffering=0) as dst:
+        engine.copy_range(src.fileno(), dst.fileno(), offset, count)
+    with open(OUTPUT_FILE, "rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("kernel", [True, False])
+def test_copy_in_chunks(monkeypatch, kernel):
+    """Test ranges are copied a buffer at a time, by the kernel or through the buffer"""
+    calls = []
+    if kernel:
+        real_copy = ioengine.KERNEL_COPIES[0]
+
+        def kernel_copy(src_fd, dst_fd, offset, count):
+            calls.append(count)
+            return real_copy(src_fd, dst_fd, offset, count)
+
+        monkeypatch.setattr(ioengine, "KERNEL_COPIES", [kernel_copy])
+    else:
+        monkeypatch.setattr(ioengine, "KERNEL_COPIES", [])
+    engine = IOEngine(MIN_BUFFER_SIZE)
+    assert copy(engine, 10, len(DATA) - 20) == DATA[10:-10]
+    if kernel:
+        assert calls == [MIN_BUFFER_SIZE, MIN_BUFFER_SIZE, MIN_BUFFER_SIZE, MIN_BUFFER_SIZE - 20]
+    else:
+        buffer = engine.buffer()
+        assert len(buffer) == MIN_BUFFER_SIZE
+        assert copy(engine, 0, 100) == DATA[:100]
+        assert engine.buffer() is buffer
+
+
+def test_unsupported_kernel_copy_falls_back(monkeypatch):
+    """Test a kernel copy which fails is only tried once"""
+    calls = []
+
+    def unsupported(*_):
+        calls.append(1)
+        raise OSError
+
+    monkeypatch.setattr(ioengine, "KERNEL_COPIES", [unsupported])
+    assert copy(IOEngine(MIN_BUFFER_SIZE), 0, len(DATA)) == DATA
+    assert calls == [1]
+
+
+def test_drop_cache(monkeypatch):
+    """Test copied input is dropped from the page cache as it goes, and output once written"""
+    dropped = []
+    monkeypatch.setattr(ioengine, "drop_pages", lambda fd, *args: dropped.append(args))
+    engine = IOEngine(MIN_BUFFER_SIZE, drop_cache=True)
+    engine.copy_file(SOURCE_FILE, OUTPUT_FILE)
+    assert dropped == [
+        (offset, MIN_BUFFER_SIZE) for offset in range(0, len(DATA), MIN_BUFFER_SIZE)
+    ] + [()]
+    dropped.clear()
+    copy(IOEngine(MIN_BUFFER_SIZE), 0, len(DATA))
+    assert not dropped
+
+
+def test_move_copies_data_and_times():
+    """Test a move to another device keeps the data and times and removes the source"""
+    os.utime(SOURCE_FILE, (1_000_000_000, 1_000_000_000))
+    IOEngine().move(SOURCE_FILE, OUTPUT_FILE)
+    assert not os.path.exists(SOURCE_FILE)
+    assert os.stat(OUTPUT_FILE).st_mtime == 1_000_000_000
+    with open(OUTPUT_FILE, "rb") as f:
+        assert f.read() == DATA
@@ -0,0 +1,103 @@
+""" Test the write-ahead journal"""
+
+import os
+import shutil
+
+import pytest
+
+from mp3tagger._util import MyData, MyException
+from mp3tagger.fileops import FileOps
+from mp3tagger.journal import Journal
+
+BASE_DIR = "/tmp/mp3_tagger/tests"
+JOURNAL_FILE = f"{BASE_DIR}/journal.jsonl"
+DOWNLOAD_DIR = f"{BASE_DIR}/download/testAlbum"
+
+
+@pytest.fixture(autouse=True)
+def run_before_and_after_tests():
+    """Runs before and after each test"""
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    yield
+    shutil.rmtree(BASE_DIR)
+
+
+def make_file(name):
+    """Create a download and return its MyData"""
+    file_name = f"{DOWNLOAD_DIR}/{name}"
+    with open(file_name, "wb") as f:
+        f.write(b"audio")
+    return MyData(
+        input_file=file_name,
+        dest_dir=f"{BASE_DIR}/mp3",
+        backup_dir=f"{BASE_DIR}/backup",
+        reject_dir=f"{BASE_DIR}/rejects",
+        job_id=0,
+    )
+
+
+def test_entries_are_merged():
+    """Test the latest state of each file is kept with its paths, ignoring a cut off line"""
+    md = make_file("240229-test1.mp3")
+    journal = Journal(JOURNAL_FILE)
+    journal.record(md, "started", remove_source_file=True)
+    journal.record(md, "tagged")
+    journal.file.write('{"file": "cut off')
+    journal.file.flush()
+    assert journal.entries() == {
+        md.input_file: {
+            "file": md.input_file,
+            "state": "tagged",
+            "temp": md.temp_fn,
+            "recover": md.recover_fn,
+            "output": md.output_file,
+            "backup": md.backup_file,
+            "reject": md.reject_file,
+        }
+    }
+    journal.close()
+
+
+def test_replay():
+    """Test interrupted files are finished or rolled back and the journal emptied"""
+    backed_up = make_file("240101-backed_up.mp3")
+    os.makedirs(backed_up.album_dir)
+    open(backed_up.output_file, "wb").close()
+    rejected = make_file("240230-rejected.mp3")
+    rolled_back = make_file("240102-rolled_back.mp3")
+    open(rolled_back.temp_fn, "wb").close()
+    journal = Journal(JOURNAL_FILE)
+    for md, states in (
+        (backed_up, ["started", "tagged", "finalized"]),
+        (rejected, ["rejected"]),
+        (rolled_back, ["started"]),
+    ):
+        for state in states:
+            journal.record(md, state, remove_source_file=True)
+    assert journal.replay(FileOps()) == (2, 1)
+    assert os.listdir(DOWNLOAD_DIR) == [os.path.basename(rolled_back.input_file)]
+    assert os.path.exists(backed_up.backup_file)
+    assert os.path.exists(rejected.reject_file)
+    assert not os.path.exists(rolled_back.temp_fn)
+    assert journal.entries() == {}
+    journal.close()
+
+
+def test_finalized_file_without_output_is_left_alone():
+    """Test the input is kept if the output it was finalized to has gone"""
+    md = make_file("240229-test1.mp3")
+    journal = Journal(JOURNAL_FILE)
+    journal.record(md, "started", remove_source_file=True)
+    journal.record(md, "finalized")
+    journal.replay(FileOps())
+    assert os.path.exists(md.input_file)
+    journal.close()
+
+
+def test_one_run_at_a_time():
+    """Test a second run can't use the journal"""
+    journal = Journal(JOURNAL_FILE)
+    with pytest.raises(MyException):
+        Journal(JOURNAL_FILE)
+    journal.close()
+    Journal(JOURNAL_FILE).close()
@@ -0,0 +1,89 @@
+""" Test metrics output"""
+
+import json
+import os
+import shutil
+
+import pytest
+
+from mp3tagger._util import StageTimer
+from mp3tagger.metrics import RunMetrics, percentile
+
+BASE_DIR = "/tmp/mp3_tagger/tests"
+
+
+@pytest.fixture(autouse=True)
+def run_before_and_after_tests():
+    """Runs before and after each test"""
+    os.makedirs(BASE_DIR, exist_ok=True)
+    yield
+    shutil.rmtree(BASE_DIR)
+
+
+def make_metrics():
+    """Record 20 processed files taking 1..20 seconds of writing, and one rejected file"""
+    metrics = RunMetrics()
+    for seconds in range(1, 21):
+        timer = StageTimer()
+        timer.add("write", float(seconds), 100)
+        metrics.record(f"file{seconds}.mp3", "processed", timer)
+    timer = StageTimer()
+    timer.add("parse", 0.5)
+    metrics.record("bad.mp3", "rejected", timer)
+    return metrics
+
+
+def test_percentile():
+    """Test nearest-rank percentiles"""
+    assert percentile([], 0.5) == 0.0
+    assert percentile([1.0], 0.95) == 1.0
+    assert percentile([float(n) for n in range(1, 21)], 0.5) == 10.0
+    assert percentile([float(n) for n in range(1, 21)], 0.95) == 19.0
+
+
+def test_summary():
+    """Test run totals"""
+    summary = make_metrics().summary()
+    assert summary["files"] == {"processed": 20, "rejected": 1}
+    assert summary["latency"] == {"p50": 10.0, "p95": 19.0}
+    assert summary["stages"] == {
+        "write": {"seconds": 210.0, "bytes": 2000},
+        "parse": {"seconds": 0.5, "bytes": 0},
+    }
+
+
+def test_saves():
+    """Test files saved in place and rewritten are counted"""
+    metrics = RunMetrics()
+    for save in ("in_place", "rewrite", "rewrite", None):
+        metrics.record("file.mp3", "processed", StageTimer(), tags_written=bool(save), save=save)
+    assert metrics.summary()["saves"] == {"in_place": 1, "rewrite": 2}
+    assert 'mp3tagger_saves{kind="rewrite"} 2' in metrics.prometheus_lines()
+
+
+def test_write_jsonl():
+    """Test a line is written per file followed by the run totals"""
+    make_metrics().write(f"{BASE_DIR}/metrics.jsonl", "jsonl")
+    with open(f"{BASE_DIR}/metrics.jsonl", encoding="utf-8") as f:
+        lines = [json.loads(line) for line in f]
+    assert len(lines) == 22
+    assert lines[0] == {
+        "type": "file",
+        "file": "file1.mp3",
+        "status": "processed",
+        "seconds": 1.0,
+        "stages": {"write": {"seconds": 1.0, "bytes": 100}},
+    }
+    assert lines[-1]["type"] == "run"
+
+
+def test_write_prometheus():
+    """Test the textfile collector output"""
+    make_metrics().write(f"{BASE_DIR}/mp3tagger.prom", "prometheus")
+    with open(f"{BASE_DIR}/mp3tagger.prom", encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    assert 'mp3tagger_files{status="rejected"} 1' in lines
+    assert 'mp3tagger_file_seconds{quantile="0.95"} 19.0' in lines
+    assert 'mp3tagger_stage_seconds{stage="write"} 210.0' in lines
+    assert 'mp3tagger_stage_bytes{stage="write"} 2000' in lines
+    assert not os.path.exists(f"{BASE_DIR}/mp3tagger.prom.tmp")
@@ -3,7 +3,9 @@
 import os
 import re
 
-from mp3tagger._util import MyData
+import pytest
+
+from mp3tagger._util import MyData, MyException, parse_file_names
 
 # noinspection SpellCheckingInspection
 DEST_DIR = "/tmp/dest_dir"
@@ -21,7 +23,7 @@ def result_string(album, file_name):
         )
     else:
         pattern = re.search(r"([0-9]{2})([0-9]{2})([0-9]{2})-(.*)\.mp3", file_name)
-    (year, month, day, basename) = pattern.groups()
+    year, month, day, basename = pattern.groups()
     short_fn = year + month + day + "-" + basename + ".mp3"
     pod_fn = f"pod_20{year}-{month}-{day}-{basename}.mp3"
     date = year + month + day
@@ -64,3 +66,35 @@ def test_mydata_style2():
     my_data = MyData(full_filename, DEST_DIR, BACKUP_DIR, REJECT_DIR)
     actual_results = my_data.all
     assert expected_results == actual_results
+
+
+def test_mydata_temp_fn_per_job():
+    """Test each job gets its own temporary files"""
+    full_filename = INPUT_DIR + "/MY_ALBUM/240130-test_file_1.mp3"
+    my_data = MyData(full_filename, DEST_DIR, BACKUP_DIR, REJECT_DIR, job_id=3)
+    assert my_data.temp_fn == f"{DEST_DIR}/temp-3.mp3"
+    assert my_data.recover_fn == f"{DEST_DIR}/temp-3-recover.mp3"
+
+
+def test_parse_file_names():
+    """Test a batch of names is parsed in order, with the error for each invalid one"""
+    names = [
+        INPUT_DIR + "/MY_ALBUM/240130-test_file_1.mp3",
+        INPUT_DIR + "/MY_ALBUM/test_file_2.mp3",
+        INPUT_DIR + "/MY_ALBUM/pod_2024-01-31-test_file_3.mp3",
+    ]
+    first, invalid, last = parse_file_names(names, DEST_DIR, BACKUP_DIR, REJECT_DIR)
+    assert first.all == result_string("MY_ALBUM", "240130-test_file_1.mp3")
+    assert isinstance(invalid, MyException)
+    assert invalid.msg == f"{names[1]} - invalid file-name format"
+    assert last.output_file == f"{DEST_DIR}/MY_ALBUM/240131-test_file_3.mp3"
+
+
+def test_mydata_paths_are_cached():
+    """Test derived paths are built once, and MyData has no instance dictionary"""
+    my_data = MyData(
+        INPUT_DIR + "/MY_ALBUM/240130-test_file_1.mp3", DEST_DIR, BACKUP_DIR, REJECT_DIR
+    )
+    assert my_data.backup_file is my_data.backup_file
+    with pytest.raises(AttributeError):
+        my_data.extra = 1
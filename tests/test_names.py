@@ -0,0 +1,85 @@
+""" Test the file-name format registry"""
+
+import re
+
+import pytest
+
+from mp3tagger.names import DEFAULT_NAME_FORMATS, FileNameParser, literal_prefix, parse_name_formats
+
+# The patterns MyData used before formats could be configured
+LEGACY_NAME_RE = [
+    r"^(.*/([^/]*))/pod_[0-9]{2}([0-9]{2})-([0-9]*)-([0-9]*)-(.*)\.mp3",
+    r"^(.*/([^/]*))/([0-9]{2})([0-9]{2})([0-9]{2})-(.*)\.mp3",
+]
+
+NAMES = [
+    "pod_2024-01-30-test_file_1.mp3",
+    "240130-test_file_1.mp3",
+    "pod_2024-1-3-short_date.mp3",
+    "240130-pod_2024-01-30-both.mp3",
+    "pod_2024-01-30-240130-both.mp3",
+    "240130-.mp3",
+    "2401301-seven_digits.mp3",
+    "240130_underscore.mp3",
+    "pod_24-01-30-short_year.mp3",
+    "episode.mp3",
+    "240130-name.mp3.mp3",
+]
+
+
+def legacy_split(path):
+    """Return (release date, name) as the legacy patterns found them"""
+    for pattern in LEGACY_NAME_RE:
+        found = re.search(pattern, path)
+        if found:
+            _, _, year, month, day, name = found.groups()
+            return f"{year[-2:]}{month}{day}", name
+    return None
+
+
+@pytest.mark.parametrize("name", NAMES)
+def test_default_formats_match_legacy_patterns(name):
+    """Test the default formats split names as the hard coded patterns did"""
+    assert FileNameParser().match(name) == legacy_split("/download/album/" + name)
+
+
+def test_configured_format_with_date_format():
+    """Test a format reading its date with a date format"""
+    names = FileNameParser(
+        DEFAULT_NAME_FORMATS
+        + tuple(parse_name_formats("\n    (?P<name>.*)_(?P<date>[0-9]{8})\\.mp3 %Y%m%d\n"))
+    )
+    assert names.match("Episode_20240130.mp3") == ("240130", "Episode")
+    assert names.match("Episode_20240230.mp3") is None
+    assert names.match("240130-test.mp3") == ("240130", "test")
+
+
+def test_formats_are_grouped_by_prefix():
+    """Test formats starting with the same text share a pattern, tried longest first"""
+    names = FileNameParser(
+        DEFAULT_NAME_FORMATS
+        + (
+            (r"pod_(?P<date>[0-9]{6})_(?P<name>.*)\.mp3", "%y%m%d"),
+            (r"bbc-(?P<date>[0-9]{6})-(?P<name>.*)\.mp3", "%d%m%y"),
+        )
+    )
+    assert sorted(names.patterns) == ["", "bbc-", "pod_"]
+    assert names.prefix_lengths == [4, 0]
+    assert names.match("pod_240130_new.mp3") == ("240130", "new")
+    assert names.match("bbc-300124-news.mp3") == ("240130", "news")
+
+
+@pytest.mark.parametrize(
+    "pattern, prefix",
+    [("pod_[0-9]", "pod_"), ("abc?d", "ab"), ("a|b", ""), (r"x\.mp3", "x"), ("(?P<name>.*)", "")],
+)
+def test_literal_prefix(pattern, prefix):
+    """Test the text every match must start with is found"""
+    assert literal_prefix(pattern) == prefix
+
+
+@pytest.mark.parametrize("pattern", ["(?P<name>.*", r"(?P<name>.*)\.mp3"])
+def test_invalid_formats(pattern):
+    """Test broken patterns and patterns without a date are refused"""
+    with pytest.raises(ValueError):
+        FileNameParser([(pattern, None)])
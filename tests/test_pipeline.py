@@ -0,0 +1,79 @@
+""" Test the staged pipeline"""
+
+import threading
+
+import pytest
+
+from mp3tagger.pipeline import Job, StagedPipeline
+
+
+class NumberJob(Job):
+    """A job carrying a number through the stages"""
+
+    def __init__(self, number):
+        super().__init__()
+        self.number = number
+        self.stages = []
+
+
+def test_jobs_pass_through_every_stage_in_order():
+    """Test each job goes through the stages in turn and comes out in the order given"""
+
+    def double(job):
+        job.stages.append("double")
+        job.number *= 2
+
+    def add_one(job):
+        job.stages.append("add_one")
+        job.number += 1
+
+    jobs = list(StagedPipeline([double, add_one]).run(NumberJob(n) for n in range(20)))
+    assert [job.number for job in jobs] == [n * 2 + 1 for n in range(20)]
+    assert all(job.stages == ["double", "add_one"] for job in jobs)
+
+
+def test_stages_overlap():
+    """Test a later stage works on one job while an earlier stage works on the next"""
+    second_started = threading.Event()
+
+    def first(job):
+        if job.number == 1:
+            # Only returns if the second stage is running job 0 at the same time
+            assert second_started.wait(5)
+
+    def second(job):
+        if job.number == 0:
+            second_started.set()
+
+    jobs = list(StagedPipeline([first, second]).run(NumberJob(n) for n in range(2)))
+    assert [job.error for job in jobs] == [None, None]
+
+
+def test_failed_and_finished_jobs_skip_later_stages():
+    """Test later stages aren't run for a job which failed or finished early"""
+
+    def check(job):
+        if job.number == 1:
+            raise ValueError("bad number")
+        job.finished = job.number == 2
+
+    def record(job):
+        job.stages.append("record")
+
+    jobs = list(StagedPipeline([check, record]).run(NumberJob(n) for n in range(4)))
+    assert [job.stages for job in jobs] == [["record"], [], [], ["record"]]
+    assert isinstance(jobs[1].error, ValueError)
+
+
+def test_error_reading_jobs_is_raised_after_queued_jobs():
+    """Test an error producing the jobs is raised once the jobs before it are done"""
+
+    def numbers():
+        yield NumberJob(0)
+        raise OSError("scan failed")
+
+    done = []
+    with pytest.raises(OSError):
+        for job in StagedPipeline([lambda job: None]).run(numbers()):
+            done.append(job.number)
+    assert done == [0]
@@ -0,0 +1,144 @@
+""" Test the dry-run planner"""
+
+import json
+import os
+import shutil
+
+import pytest
+
+from mp3tagger._util import MyException
+from mp3tagger.planner import find_collisions, planned_files, read_plan, summary
+from mp3tagger.tagger import Mp3Tagger
+
+BASE_DIR = "/tmp/mp3_tagger/tests"
+BACKUP_DIR = f"{BASE_DIR}/backup"
+MP3_DIR = f"{BASE_DIR}/mp3"
+REJECT_DIR = f"{BASE_DIR}/rejects"
+DOWNLOAD_DIR = f"{BASE_DIR}/download/testAlbum"
+PLAN_FILE = f"{BASE_DIR}/plan.json"
+
+RESOURCE_DIR = os.path.dirname(os.path.realpath(__file__)) + "/testresources"
+
+
+@pytest.fixture(autouse=True)
+def run_before_and_after_tests():
+    """Runs before and after each test"""
+    for directory in (BACKUP_DIR, MP3_DIR, REJECT_DIR, DOWNLOAD_DIR):
+        os.makedirs(directory, exist_ok=True)
+    yield
+    shutil.rmtree(BASE_DIR)
+
+
+def make_plan(monkeypatch, *args):
+    """Run --plan and return the plan"""
+    monkeypatch.setattr(
+        "sys.argv",
+        ["tagger.py", *args, "--plan", PLAN_FILE, "-c", RESOURCE_DIR + "/mp3tagger.ini"],
+    )
+    Mp3Tagger().run()
+    with open(PLAN_FILE, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_plan_leaves_files_alone(capfd, monkeypatch):
+    """Test a plan lists targets, tag changes and rejects without moving anything"""
+    shutil.copy2(src=RESOURCE_DIR + "/240229-test1.mp3", dst=DOWNLOAD_DIR + "/240229-test1.mp3")
+    shutil.copy2(
+        src=RESOURCE_DIR + "/240131-not_a_mp3.mp3", dst=DOWNLOAD_DIR + "/240230-anything.mp3"
+    )
+    shutil.copy2(src=RESOURCE_DIR + "/240229-test1.mp3", dst=DOWNLOAD_DIR + "/no-date.mp3")
+    plan = make_plan(monkeypatch, "-r")
+    out, _ = capfd.readouterr()
+    assert out == "Planned 3 files: 1 invalid, 1 process, 1 reject, 0 collisions\n"
+    assert sorted(os.listdir(DOWNLOAD_DIR)) == [
+        "240229-test1.mp3",
+        "240230-anything.mp3",
+        "no-date.mp3",
+    ]
+    good, rejected, invalid = plan["files"]
+    assert good["action"] == "process"
+    assert good["target"] == f"{MP3_DIR}/testAlbum/240229-test1.mp3"
+    assert good["backup"] == f"{BACKUP_DIR}/testAlbum/pod_2024-02-29-test1.mp3"
+    assert {"frame": "TDRL", "value": "2024-02-29 00:00:00"} in good["changes"]
+    assert rejected["action"] == "reject"
+    assert rejected["reason"] == "Invalid release date: 240230"
+    assert rejected["target"] == f"{REJECT_DIR}/testAlbum/pod_2024-02-30-anything.mp3"
+    assert invalid["action"] == "invalid"
+    assert invalid["reason"].endswith("invalid file-name format")
+
+
+def test_apply_plan(capfd, monkeypatch):
+    """Test applying a plan gives the same result as a normal run"""
+    shutil.copy2(src=RESOURCE_DIR + "/240229-test1.mp3", dst=DOWNLOAD_DIR + "/240229-test1.mp3")
+    make_plan(monkeypatch, "-r")
+    capfd.readouterr()
+    monkeypatch.setattr(
+        "sys.argv", ["tagger.py", "--apply", PLAN_FILE, "-c", RESOURCE_DIR + "/mp3tagger.ini"]
+    )
+    Mp3Tagger().run()
+    out, _ = capfd.readouterr()
+    assert out == (
+        "Processing file testAlbum/240229-test1.mp3 - OK\n"
+        "Processed 1 good files \n"
+        "End of run ++++++++++\n"
+    )
+    assert os.listdir(DOWNLOAD_DIR) == []
+    assert os.path.exists(f"{BACKUP_DIR}/testAlbum/pod_2024-02-29-test1.mp3")
+
+
+def test_collisions_are_not_applied(capfd, monkeypatch):
+    """Test two downloads with the same target are reported and left alone"""
+    shutil.copy2(src=RESOURCE_DIR + "/240229-test1.mp3", dst=DOWNLOAD_DIR + "/240229-test1.mp3")
+    shutil.copy2(
+        src=RESOURCE_DIR + "/240229-test1.mp3", dst=DOWNLOAD_DIR + "/pod_2024-02-29-test1.mp3"
+    )
+    plan = make_plan(monkeypatch)
+    assert plan["collisions"] == [
+        {
+            "target": f"{MP3_DIR}/testAlbum/240229-test1.mp3",
+            "inputs": [
+                f"{DOWNLOAD_DIR}/240229-test1.mp3",
+                f"{DOWNLOAD_DIR}/pod_2024-02-29-test1.mp3",
+            ],
+            "exists": False,
+        }
+    ]
+    capfd.readouterr()
+    assert not list(planned_files(plan))
+    out, _ = capfd.readouterr()
+    assert out.count("collides with another file") == 2
+
+
+def test_changed_files_are_not_applied(capfd):
+    """Test a file which changed after the plan was made is left alone"""
+    file_name = DOWNLOAD_DIR + "/240229-test1.mp3"
+    shutil.copy2(src=RESOURCE_DIR + "/240229-test1.mp3", dst=file_name)
+    stat = os.stat(file_name)
+    entry = {"input": file_name, "action": "process", "size": stat.st_size}
+    assert list(planned_files({"files": [dict(entry, mtime_ns=stat.st_mtime_ns)]})) == [
+        (file_name, stat)
+    ]
+    assert not list(planned_files({"files": [dict(entry, mtime_ns=stat.st_mtime_ns - 1)]}))
+    out, _ = capfd.readouterr()
+    assert out == f"Not applying {file_name} - it has changed since the plan was made\n"
+
+
+def test_existing_target_is_a_collision():
+    """Test a target which is already there is reported"""
+    os.makedirs(f"{MP3_DIR}/testAlbum")
+    target = f"{MP3_DIR}/testAlbum/240229-test1.mp3"
+    open(target, "wb").close()
+    entries = [{"input": "a", "action": "process", "target": target}]
+    assert find_collisions(entries) == [{"target": target, "inputs": ["a"], "exists": True}]
+    assert entries[0]["collision"]
+    assert summary({"files": entries, "collisions": [target]}) == (
+        "Planned 1 files: 1 process, 1 collisions"
+    )
+
+
+def test_plan_for_other_folders_is_refused():
+    """Test a plan made with a different configuration isn't applied"""
+    with open(PLAN_FILE, "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "dest_dir": "x", "backup_dir": "y", "reject_dir": "z"}, f)
+    with pytest.raises(MyException):
+        read_plan(PLAN_FILE, MP3_DIR, BACKUP_DIR, REJECT_DIR)
@@ -0,0 +1,107 @@
+""" Test recovery of unreadable mp3 files"""
+
+import os
+import shutil
+import time
+
+import pytest
+
+from mp3tagger._util import MyData
+from mp3tagger.id3handler import probe_mp3
+from mp3tagger.recover import (
+    RecoveryScheduler,
+    ffmpeg_remux,
+    id3v2_size,
+    mpeg_frame,
+    recover_mp3,
+)
+
+BASE_DIR = "/tmp/mp3_tagger/tests"
+BACKUP_DIR = f"{BASE_DIR}/backup"
+MP3_DIR = f"{BASE_DIR}/mp3"
+REJECT_DIR = f"{BASE_DIR}/rejects"
+DOWNLOAD_DIR = f"{BASE_DIR}/download/testAlbum"
+
+RESOURCE_DIR = os.path.dirname(os.path.realpath(__file__)) + "/testresources"
+
+
+@pytest.fixture(autouse=True)
+def run_before_and_after_tests():
+    """Runs before and after each test"""
+    os.makedirs(MP3_DIR, exist_ok=True)
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    yield
+    shutil.rmtree(BASE_DIR)
+
+
+def is_valid(file_name):
+    """Return True if mutagen can read the file"""
+    return probe_mp3(file_name)[0]
+
+
+def test_mpeg_frame():
+    """Test frame headers are decoded"""
+    assert mpeg_frame(b"\xff\xfb\x90\x64", 0) == ((3, 3, 44100), 417)
+    assert mpeg_frame(b"\xff\xfb\xf0\x64", 0) is None
+    assert mpeg_frame(b"Not an mp3", 0) is None
+
+
+def test_junk_before_first_frame_is_stripped():
+    """Test junk between the ID3 tag and the audio is removed without ffmpeg"""
+    with open(RESOURCE_DIR + "/240229-test1.mp3", "rb") as f:
+        data = f.read()
+    tag_size = id3v2_size(data)
+    input_file = DOWNLOAD_DIR + "/240229-test1.mp3"
+    with open(input_file, "wb") as f:
+        f.write(data[:tag_size] + b"\xff<html>" * 200000 + data[tag_size:])
+    md = MyData(input_file, MP3_DIR, BACKUP_DIR, REJECT_DIR)
+    assert not is_valid(input_file)
+
+    assert recover_mp3(md, is_valid) == 0
+    with open(md.temp_fn, "rb") as f:
+        assert f.read() == data
+    assert not os.path.exists(md.recover_fn)
+
+
+def test_unrecoverable_file_leaves_nothing_behind():
+    """Test nothing is left when no method can recover a file"""
+    input_file = DOWNLOAD_DIR + "/pod_2023-12-29-unrecoverable.mp3"
+    shutil.copy2(src=RESOURCE_DIR + "/pod_2023-12-29-unrecoverable.mp3", dst=input_file)
+    md = MyData(input_file, MP3_DIR, BACKUP_DIR, REJECT_DIR)
+
+    assert recover_mp3(md, is_valid) == 1
+    assert os.listdir(MP3_DIR) == []
+
+
+def test_ffmpeg_is_stopped_after_timeout(monkeypatch):
+    """Test a hung ffmpeg doesn't stall recovery"""
+    bin_dir = f"{BASE_DIR}/bin"
+    os.makedirs(bin_dir)
+    with open(f"{bin_dir}/ffmpeg", "w", encoding="ascii") as f:
+        f.write("#!/bin/sh\nexec sleep 10\n")
+    os.chmod(f"{bin_dir}/ffmpeg", 0o755)
+    monkeypatch.setenv("PATH", bin_dir + os.pathsep + os.environ["PATH"])
+    md = MyData(DOWNLOAD_DIR + "/240229-test1.mp3", MP3_DIR, BACKUP_DIR, REJECT_DIR)
+
+    start = time.monotonic()
+    assert ffmpeg_remux(md, timeout=0.2) == 1
+    assert time.monotonic() - start < 5
+
+
+def test_scheduler_returns_results_in_order():
+    """Test queued recoveries are reported in the order they were queued"""
+    scheduler = RecoveryScheduler(jobs=2, timeout=10)
+    queued = []
+    for job_id in range(3):
+        input_file = f"{DOWNLOAD_DIR}/pod_2023-12-{job_id + 10}-unrecoverable.mp3"
+        shutil.copy2(src=RESOURCE_DIR + "/pod_2023-12-29-unrecoverable.mp3", dst=input_file)
+        md = MyData(input_file, MP3_DIR, BACKUP_DIR, REJECT_DIR, job_id=job_id)
+        scheduler.submit(md, is_valid)
+        queued.append(md)
+
+    results = list(scheduler.results())
+    scheduler.close()
+    assert [md for md, _, _, _ in results] == queued
+    assert [result for _, result, _, _ in results] == [1, 1, 1]
+    assert all("recover" in timer.seconds for _, _, _, timer in results)
+    assert list(scheduler.results()) == []
@@ -0,0 +1,64 @@
+""" Test pruning of old backups"""
+
+import glob
+import os
+import shutil
+from datetime import date
+
+import pytest
+
+from mp3tagger.retention import BackgroundPruner, prune_backups
+
+BASE_DIR = "/tmp/mp3_tagger/tests"
+BACKUP_DIR = f"{BASE_DIR}/backup"
+
+BACKUPS = [
+    "old_album/pod_2024-01-01-old.mp3",
+    "testAlbum/pod_2024-01-01-old.mp3",
+    "testAlbum/pod_2024-01-16-kept.mp3",
+    "testAlbum/pod_2024-02-01-new.mp3",
+    "testAlbum/notes.txt",
+]
+
+
+@pytest.fixture(autouse=True)
+def run_before_and_after_tests():
+    """Runs before and after each test"""
+    for backup in BACKUPS:
+        os.makedirs(os.path.dirname(f"{BACKUP_DIR}/{backup}"), exist_ok=True)
+        open(f"{BACKUP_DIR}/{backup}", "w", encoding="ascii").close()
+    yield
+    shutil.rmtree(BASE_DIR)
+
+
+def remaining():
+    """Return what's left in the backup directory"""
+    return sorted(
+        os.path.relpath(path, BACKUP_DIR) for path in glob.glob(f"{BACKUP_DIR}/**", recursive=True)
+    )
+
+
+def test_prune_backups():
+    """Test only backups released before the retention period are deleted"""
+    deleted = prune_backups(BACKUP_DIR, 14, today=date(2024, 1, 30))
+    assert sorted(deleted) == [
+        f"{BACKUP_DIR}/old_album/pod_2024-01-01-old.mp3",
+        f"{BACKUP_DIR}/testAlbum/pod_2024-01-01-old.mp3",
+    ]
+    assert remaining() == [
+        ".",
+        "testAlbum",
+        "testAlbum/notes.txt",
+        "testAlbum/pod_2024-01-16-kept.mp3",
+        "testAlbum/pod_2024-02-01-new.mp3",
+    ]
+
+
+def test_background_pruner_keeps_new_backups():
+    """Test backups made in this run are kept however old the episode is"""
+    keep = {f"{BACKUP_DIR}/testAlbum/pod_2024-01-01-old.mp3"}
+    pruner = BackgroundPruner(BACKUP_DIR, 14, today=date(2024, 1, 30), keep=keep)
+    pruner.start()
+    pruner.join()
+    assert pruner.deleted == [f"{BACKUP_DIR}/old_album/pod_2024-01-01-old.mp3"]
+    assert "testAlbum/pod_2024-01-01-old.mp3" in remaining()
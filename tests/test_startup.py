@@ -0,0 +1,49 @@
+""" Test the CLI starts quickly"""
+
+import subprocess
+import sys
+
+# Modules only needed once a file is tagged, recovered or indexed
+LAZY_MODULES = (
+    "mutagen",
+    "sqlite3",
+    "ctypes",
+    "concurrent.futures",
+    "importlib.metadata",
+    "mp3tagger.id3handler",
+    "mp3tagger.planner",
+)
+
+# Cumulative time to import mp3tagger.tagger, in microseconds (about half with the lazy
+# imports, twice that without)
+IMPORT_BUDGET = 100_000
+
+
+def import_time(module):
+    """Return the cumulative time in microseconds taken to import module in a new
+    interpreter, as reported by -X importtime"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    for line in result.stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1])
+    raise AssertionError(f"No import time reported for {module}")
+
+
+def test_heavy_modules_are_not_imported_at_startup():
+    """Test importing the CLI doesn't pull in modules which are only needed for tagging"""
+    code = f"import sys, mp3tagger.tagger; print([m for m in {LAZY_MODULES!r} if m in sys.modules])"
+    result = subprocess.run(
+        [sys.executable, "-c", code], check=True, capture_output=True, text=True
+    )
+    assert result.stdout.strip() == "[]"
+
+
+def test_import_time_budget():
+    """Test importing the CLI stays within budget - best of 3 to allow for a busy machine"""
+    assert min(import_time("mp3tagger.tagger") for _ in range(3)) < IMPORT_BUDGET
@@ -1,12 +1,16 @@
 """ Test the overall functionality """
 
 import glob
+import json
 import os
 import shutil
+import time
 
 import pytest
 
+from mp3tagger._util import MyException, scan_source
 from mp3tagger.tagger import Mp3Tagger
+from mp3tagger.watcher import SourceWatcher
 
 BASE_DIR = "/tmp/mp3_tagger/tests"
 BACKUP_DIR = f"{BASE_DIR}/backup"
@@ -190,3 +194,300 @@ def test_unrecoverable_file(monkeypatch):
     cc.run()
     actual_files = get_files()
     assert actual_files == expected_files
+
+
+@pytest.mark.parametrize("mode", [["-j", "3"], ["-P"]])
+def test_parallel_jobs_match_serial_output(capfd, monkeypatch, mode):
+    """Test output of 3 files processed in parallel or pipelined is the same as a serial run"""
+    shutil.copy2(src=RESOURCE_DIR + "/240229-test1.mp3", dst=DOWNLOAD_DIR + "/240310-test1.mp3")
+    shutil.copy2(src=RESOURCE_DIR + "/240229-test1.mp3", dst=DOWNLOAD_DIR + "/240110-test1.mp3")
+    shutil.copy2(
+        src=RESOURCE_DIR + "/240131-not_a_mp3.mp3", dst=DOWNLOAD_DIR + "/240230-anything.mp3"
+    )
+    monkeypatch.setattr(
+        "sys.argv", ["tagger.py", "-r", *mode, "-c", RESOURCE_DIR + "/mp3tagger.ini"]
+    )
+    expected_files = sorted(
+        [
+            f"{BACKUP_DIR}/testAlbum/pod_2024-01-10-test1.mp3",
+            f"{BACKUP_DIR}/testAlbum/pod_2024-03-10-test1.mp3",
+            f"{MP3_DIR}/testAlbum/240110-test1.mp3",
+            f"{MP3_DIR}/testAlbum/240310-test1.mp3",
+            f"{REJECT_DIR}/testAlbum/pod_2024-02-30-anything.mp3",
+        ]
+    )
+    expected_stdout = (
+        "Processing file testAlbum/240110-test1.mp3 - OK\n"
+        "Processing file testAlbum/240230-anything.mp3\n"
+        "    moved to reject ??????????\n"
+        "    (Invalid release date: 240230)\n"
+        "Processing file testAlbum/240310-test1.mp3 - OK\n"
+        "Processed 2 good files 1 bad files.\n"
+        "Bad files:\n"
+        f"    {DOWNLOAD_DIR}/240230-anything.mp3\n"
+        "\n"
+        "End of run ++++++++++\n"
+    )
+    cc = Mp3Tagger()
+    cc.run()
+    out, err = capfd.readouterr()
+    assert out == expected_stdout and err == ""
+    assert get_files() == expected_files
+
+
+def test_rerun_with_index_skips_unchanged_files(capfd, monkeypatch):
+    """Test a second run with --index skips the files processed by the first"""
+    shutil.copy2(src=RESOURCE_DIR + "/240229-test1.mp3", dst=DOWNLOAD_DIR + "/240229-test1.mp3")
+    monkeypatch.setattr("sys.argv", ["tagger.py", "-i", "-c", RESOURCE_DIR + "/mp3tagger.ini"])
+    with monkeypatch.context() as m:
+        # The input is hashed as it is copied, not read again
+        m.setattr("mp3tagger.index.file_hash", None)
+        Mp3Tagger().run()
+    capfd.readouterr()
+    os.utime(DOWNLOAD_DIR + "/240229-test1.mp3", ns=(0, 0))
+    Mp3Tagger().run()
+    out, _ = capfd.readouterr()
+    assert out == "Processed 0 good files \nSkipped 1 unchanged files\nEnd of run ++++++++++\n"
+
+
+def test_scan_source_matches_glob_order():
+    """Test the album by album scan yields the same files in the same order as glob"""
+    for album in ("testAlbum", "test-Album", "test", ".hidden"):
+        os.makedirs(f"{BASE_DIR}/download/{album}", exist_ok=True)
+        for name in ("240102-b.mp3", "240101-a.mp3", ".240101-hidden.mp3", "notes.txt"):
+            open(f"{BASE_DIR}/download/{album}/{name}", "w", encoding="ascii").close()
+    scanned = [
+        entry.path for _, episodes in scan_source(f"{BASE_DIR}/download") for entry in episodes
+    ]
+    assert scanned == sorted(glob.glob(f"{BASE_DIR}/download/*/*.mp3"))
+
+
+def test_watch_processes_downloaded_file(capfd, monkeypatch):
+    """Test --watch processes files which have finished downloading"""
+
+    def stop_watching(_):
+        raise KeyboardInterrupt
+
+    shutil.copy2(src=RESOURCE_DIR + "/240229-test1.mp3", dst=DOWNLOAD_DIR + "/240229-test1.mp3")
+    monkeypatch.setattr(
+        "sys.argv", ["tagger.py", "-w", "-r", "-c", RESOURCE_DIR + "/mp3tagger.ini"]
+    )
+    monkeypatch.setattr(Mp3Tagger, "watch_settle_seconds", 0.0)
+    monkeypatch.setattr(SourceWatcher, "wait", stop_watching)
+    Mp3Tagger().run()
+    out, _ = capfd.readouterr()
+    assert out == (
+        f"Watching {BASE_DIR}/download\n"
+        "Processing file testAlbum/240229-test1.mp3 - OK\n"
+        "\nEnd of watch ++++++++++\n"
+    )
+    assert get_files() == [
+        f"{BACKUP_DIR}/testAlbum/pod_2024-02-29-test1.mp3",
+        f"{MP3_DIR}/testAlbum/240229-test1.mp3",
+    ]
+
+
+def test_watch_metrics_kept_for_each_batch(monkeypatch):
+    """Test each --watch batch adds its records to the metrics file"""
+    batches = [DOWNLOAD_DIR + "/240301-test2.mp3"]
+
+    def next_batch(_):
+        if not batches:
+            raise KeyboardInterrupt
+        shutil.copy2(src=RESOURCE_DIR + "/240229-test1.mp3", dst=batches.pop())
+
+    shutil.copy2(src=RESOURCE_DIR + "/240229-test1.mp3", dst=DOWNLOAD_DIR + "/240229-test1.mp3")
+    metrics_file = f"{BASE_DIR}/metrics.jsonl"
+    monkeypatch.setattr(
+        "sys.argv",
+        ["tagger.py", "-w", "-r", "-m", metrics_file, "-c", RESOURCE_DIR + "/mp3tagger.ini"],
+    )
+    monkeypatch.setattr(Mp3Tagger, "watch_settle_seconds", 0.0)
+    monkeypatch.setattr(SourceWatcher, "wait", next_batch)
+    Mp3Tagger().run()
+    with open(metrics_file, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    assert [(r["type"], r.get("file")) for r in records] == [
+        ("file", DOWNLOAD_DIR + "/240229-test1.mp3"),
+        ("run", None),
+        ("file", DOWNLOAD_DIR + "/240301-test2.mp3"),
+        ("run", None),
+    ]
+
+
+def test_metrics_file(monkeypatch):
+    """Test a metrics record is written for each file and the run"""
+    shutil.copy2(src=RESOURCE_DIR + "/240229-test1.mp3", dst=DOWNLOAD_DIR + "/240229-test1.mp3")
+    shutil.copy2(
+        src=RESOURCE_DIR + "/240131-not_a_mp3.mp3", dst=DOWNLOAD_DIR + "/240230-anything.mp3"
+    )
+    metrics_file = f"{BASE_DIR}/metrics.jsonl"
+    monkeypatch.setattr(
+        "sys.argv", ["tagger.py", "-m", metrics_file, "-c", RESOURCE_DIR + "/mp3tagger.ini"]
+    )
+    Mp3Tagger().run()
+    with open(metrics_file, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    assert [(r["type"], r.get("status")) for r in records] == [
+        ("file", "processed"),
+        ("file", "rejected"),
+        ("run", None),
+    ]
+    assert {"parse", "tag", "write", "move"} <= set(records[0]["stages"])
+    assert records[2]["files"] == {"processed": 1, "rejected": 1}
+
+
+def test_prune(capfd, monkeypatch):
+    """Test --prune only deletes old backups"""
+    os.makedirs(f"{BACKUP_DIR}/testAlbum")
+    shutil.copy2(
+        src=RESOURCE_DIR + "/240229-test1.mp3",
+        dst=f"{BACKUP_DIR}/testAlbum/pod_2024-02-29-test1.mp3",
+    )
+    shutil.copy2(src=RESOURCE_DIR + "/240229-test1.mp3", dst=DOWNLOAD_DIR + "/240229-test1.mp3")
+    monkeypatch.setattr("sys.argv", ["tagger.py", "-p", "-c", RESOURCE_DIR + "/mp3tagger.ini"])
+    Mp3Tagger().run()
+    out, _ = capfd.readouterr()
+    assert out == "Pruned 1 backups older than 7 days\n"
+    assert get_files() == [f"{DOWNLOAD_DIR}/240229-test1.mp3"]
+
+
+def test_dedup_skips_second_download(capfd, monkeypatch):
+    """Test an episode downloaded twice under different names is only processed once"""
+    shutil.copy2(src=RESOURCE_DIR + "/240229-test1.mp3", dst=DOWNLOAD_DIR + "/240229-test1.mp3")
+    shutil.copy2(
+        src=RESOURCE_DIR + "/240229-test1.mp3", dst=DOWNLOAD_DIR + "/pod_2024-02-29-test1.mp3"
+    )
+    monkeypatch.setattr(
+        "sys.argv", ["tagger.py", "-r", "-D", "-c", RESOURCE_DIR + "/mp3tagger.ini"]
+    )
+    expected_stdout = (
+        "Processing file testAlbum/240229-test1.mp3 - OK\n"
+        "Processing file testAlbum/pod_2024-02-29-test1.mp3 - duplicate of"
+        " testAlbum/240229-test1.mp3\n"
+        "Processed 1 good files \n"
+        "Skipped 1 duplicate files\n"
+        "End of run ++++++++++\n"
+    )
+    Mp3Tagger().run()
+    out, _ = capfd.readouterr()
+    assert out == expected_stdout
+    assert get_files() == [
+        f"{BACKUP_DIR}/testAlbum/pod_2024-02-29-test1.mp3",
+        f"{MP3_DIR}/testAlbum/240229-test1.mp3",
+    ]
+
+
+def test_dedup_waits_for_rejected_first_copy(monkeypatch):
+    """Test a second copy processed alongside the first is tagged if the first is rejected"""
+
+    def write_file(tagger, md, id3):
+        if md.basename == "first":
+            # Still being written while the second copy is checked
+            time.sleep(0.2)
+            raise MyException(msg="write failed", code=2)
+        real_write_file(tagger, md, id3)
+
+    real_write_file = Mp3Tagger.write_file
+    shutil.copy2(src=RESOURCE_DIR + "/240229-test1.mp3", dst=DOWNLOAD_DIR + "/240229-first.mp3")
+    shutil.copy2(src=RESOURCE_DIR + "/240229-test1.mp3", dst=DOWNLOAD_DIR + "/240229-second.mp3")
+    monkeypatch.setattr(
+        "sys.argv", ["tagger.py", "-r", "-D", "-j", "2", "-c", RESOURCE_DIR + "/mp3tagger.ini"]
+    )
+    monkeypatch.setattr(Mp3Tagger, "write_file", write_file)
+    Mp3Tagger().run()
+    assert get_files() == [
+        f"{BACKUP_DIR}/testAlbum/pod_2024-02-29-second.mp3",
+        f"{MP3_DIR}/testAlbum/240229-second.mp3",
+        f"{REJECT_DIR}/testAlbum/pod_2024-02-29-first.mp3",
+    ]
+
+
+def test_file_with_right_tags_is_reported(capfd, monkeypatch):
+    """Test a file whose tags are already right is counted in the summary"""
+    shutil.copy2(src=RESOURCE_DIR + "/240229-test1.mp3", dst=DOWNLOAD_DIR + "/240229-test1.mp3")
+    monkeypatch.setattr("sys.argv", ["tagger.py", "-r", "-c", RESOURCE_DIR + "/mp3tagger.ini"])
+    Mp3Tagger().run()
+    # Download the tagged file again
+    shutil.move(f"{MP3_DIR}/testAlbum/240229-test1.mp3", DOWNLOAD_DIR + "/240229-test1.mp3")
+    capfd.readouterr()
+    Mp3Tagger().run()
+    out, _ = capfd.readouterr()
+    assert out == (
+        "Processing file testAlbum/240229-test1.mp3 - OK\n"
+        "Processed 1 good files \n"
+        "1 files already had the right tags\n"
+        "End of run ++++++++++\n"
+    )
+
+
+def test_interrupted_run_is_finished(capfd, monkeypatch):
+    """Test a file left part way through by a run which was killed isn't processed again"""
+
+    def kill(*_):
+        raise KeyboardInterrupt
+
+    shutil.copy2(src=RESOURCE_DIR + "/240229-test1.mp3", dst=DOWNLOAD_DIR + "/240229-test1.mp3")
+    monkeypatch.setattr("sys.argv", ["tagger.py", "-r", "-c", RESOURCE_DIR + "/mp3tagger.ini"])
+    with monkeypatch.context() as m:
+        m.setattr("mp3tagger.tagger.save_original_file", kill)
+        with pytest.raises(KeyboardInterrupt):
+            Mp3Tagger().run()
+    capfd.readouterr()
+    Mp3Tagger().run()
+    out, _ = capfd.readouterr()
+    assert out == (
+        "Finished 1 and rolled back 0 files left by an interrupted run\n"
+        f"No files found in {BASE_DIR}/download\n"
+    )
+    assert get_files() == [
+        f"{BACKUP_DIR}/testAlbum/pod_2024-02-29-test1.mp3",
+        f"{MP3_DIR}/testAlbum/240229-test1.mp3",
+    ]
+
+
+def test_configured_file_name_format(monkeypatch):
+    """Test a file named in a format from the ini file is processed"""
+    shutil.copy2(src=RESOURCE_DIR + "/240229-test1.mp3", dst=DOWNLOAD_DIR + "/test1_20240229.mp3")
+    ini_file = f"{BASE_DIR}/mp3tagger.ini"
+    with open(RESOURCE_DIR + "/mp3tagger.ini", encoding="utf-8") as f:
+        config = f.read()
+    with open(ini_file, "w", encoding="utf-8") as f:
+        f.write(
+            config + "file_name_formats =\n    (?P<name>.*)_(?P<date>[0-9]{8})\\.mp3 %%Y%%m%%d\n"
+        )
+    monkeypatch.setattr("sys.argv", ["tagger.py", "-r", "-c", ini_file])
+    Mp3Tagger().run()
+    assert get_files() == [
+        f"{BACKUP_DIR}/testAlbum/pod_2024-02-29-test1.mp3",
+        f"{MP3_DIR}/testAlbum/240229-test1.mp3",
+    ]
+
+
+def test_retag_dest_files(capfd, monkeypatch):
+    """Test files already in dest_dir are retagged in place after the title rules change"""
+    shutil.copy2(src=RESOURCE_DIR + "/240229-test1.mp3", dst=DOWNLOAD_DIR + "/240229-test1.mp3")
+    monkeypatch.setattr("sys.argv", ["tagger.py", "-r", "-c", RESOURCE_DIR + "/mp3tagger.ini"])
+    Mp3Tagger().run()
+    output_file = f"{MP3_DIR}/testAlbum/240229-test1.mp3"
+    size = os.path.getsize(output_file)
+    ini_file = f"{BASE_DIR}/mp3tagger.ini"
+    with open(RESOURCE_DIR + "/mp3tagger.ini", encoding="utf-8") as f:
+        config = f.read()
+    with open(ini_file, "w", encoding="utf-8") as f:
+        f.write(config + "title_strip =\n    ^[0-9]+[ \\-]*\n    1$\n")
+    metrics_file = f"{BASE_DIR}/metrics.jsonl"
+    capfd.readouterr()
+    for expected, in_place in (
+        ("1 files: 1 in place, 0 rewritten, 0", 1),
+        ("0 files: 0 in place, 0 rewritten, 1", 0),
+    ):
+        monkeypatch.setattr(
+            "sys.argv", ["tagger.py", "--retag", "-m", metrics_file, "-c", ini_file]
+        )
+        Mp3Tagger().run()
+        out, _ = capfd.readouterr()
+        assert out == f"Retagged {expected} already right\n"
+        with open(metrics_file, encoding="utf-8") as f:
+            assert json.loads(f.readlines()[-1])["saves"] == {"in_place": in_place, "rewrite": 0}
+    assert os.path.getsize(output_file) == size
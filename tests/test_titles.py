@@ -0,0 +1,71 @@
+""" Test the title normaliser"""
+
+import re
+
+import pytest
+
+from mp3tagger._util import MyException
+from mp3tagger.titles import TitleNormaliser, parse_title_rules
+
+# The patterns applied one after another before titles were normalised in one pass
+LEGACY_TITLE_RE = [
+    r"^[0-9]*[ \-]*",
+    r"\d{2}\.\d{2}.\d{2,4}",
+    r"\d{2,4}-\d{2}-\d{2}",
+    r"comedy: *",
+    r"TED: *",
+    r"- *",
+    r" +$",
+]
+
+TITLES = [
+    "220109-title 1",
+    "embedded date 01.02.20 in title 2",
+    "embedded date 2021-02-01 in title 3",
+    "comedy:     title 4",
+    "TED:        title 5",
+    "  Another -        title 6       ",
+    "20220109 title 7",
+    "123 - Episode name",
+    "Episode name -",
+    "2024-01-02 Start of the year",
+    "TED: comedy: both",
+    "No changes needed",
+    "",
+]
+
+
+def legacy_title(title):
+    """Tidy up the title the way it was done before"""
+    for reg_exp in LEGACY_TITLE_RE:
+        title = re.sub(reg_exp, "", title)
+    return re.sub(r" +", " ", title)
+
+
+def test_single_pass_matches_legacy():
+    """Test the default rules give the same titles as applying the patterns in turn"""
+    titles = TitleNormaliser()
+    assert [titles.normalise(title) for title in TITLES] == [legacy_title(t) for t in TITLES]
+
+
+def test_rules_from_config():
+    """Test rules read from a config value"""
+    rules = parse_title_rules("\n^[0-9]+[ \\-]*\nBBC: *\n")
+    titles = TitleNormaliser(rules)
+    assert titles.normalise("240101 - BBC: The News  ") == "The News"
+    assert titles.normalise("TED: Talk") == "TED: Talk"
+
+
+def test_titles_are_cached():
+    """Test repeated titles come from the cache"""
+    titles = TitleNormaliser()
+    titles.normalise("123 - Episode")
+    titles.normalise("123 - Episode")
+    assert titles.normalise.cache_info().hits == 1
+
+
+def test_invalid_rule():
+    """Test a broken pattern is reported"""
+    with pytest.raises(MyException) as inst:
+        TitleNormaliser(["(unclosed"])
+    assert inst.value.msg.startswith("Invalid title_strip rule")
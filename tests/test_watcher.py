@@ -0,0 +1,70 @@
+""" Test watching the source directory"""
+
+import os
+import shutil
+
+import pytest
+
+from mp3tagger.watcher import Inotify, SourceWatcher
+
+BASE_DIR = "/tmp/mp3_tagger/tests"
+SOURCE_DIR = f"{BASE_DIR}/download"
+DOWNLOAD_DIR = f"{SOURCE_DIR}/testAlbum"
+
+
+@pytest.fixture(autouse=True)
+def run_before_and_after_tests():
+    """Runs before and after each test"""
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    yield
+    shutil.rmtree(BASE_DIR)
+
+
+def write_file(file_name, data=b"data"):
+    """Append data to a file"""
+    with open(file_name, "ab") as f:
+        f.write(data)
+
+
+def test_settled_file_is_ready_once():
+    """Test a file which has stopped changing is reported once"""
+    watcher = SourceWatcher(SOURCE_DIR, settle_time=0, poll_interval=1)
+    write_file(f"{DOWNLOAD_DIR}/240229-test1.mp3")
+    ready = watcher.ready_files()
+    assert [file_name for file_name, _ in ready] == [f"{DOWNLOAD_DIR}/240229-test1.mp3"]
+    assert watcher.ready_files() == []
+    watcher.close()
+
+
+def test_removed_file_is_forgotten():
+    """Test files which have left the source directory aren't remembered"""
+    watcher = SourceWatcher(SOURCE_DIR, settle_time=0, poll_interval=1)
+    write_file(f"{DOWNLOAD_DIR}/240229-test1.mp3")
+    watcher.ready_files()
+    assert list(watcher.handled) == [f"{DOWNLOAD_DIR}/240229-test1.mp3"]
+    os.remove(f"{DOWNLOAD_DIR}/240229-test1.mp3")
+    assert watcher.ready_files() == []
+    assert not watcher.handled
+    watcher.close()
+
+
+def test_growing_file_is_not_ready():
+    """Test a file isn't reported until it has been unchanged for the settle time"""
+    watcher = SourceWatcher(SOURCE_DIR, settle_time=60, poll_interval=1)
+    write_file(f"{DOWNLOAD_DIR}/240229-test1.mp3")
+    assert watcher.ready_files() == []
+    assert watcher.next_check is not None
+    watcher.close()
+
+
+def test_inotify_wakes_on_new_file():
+    """Test inotify reports a file being written where it's available"""
+    try:
+        inotify = Inotify()
+    except AttributeError:
+        pytest.skip("inotify not available")
+    inotify.watch(DOWNLOAD_DIR)
+    assert not inotify.wait(0)
+    write_file(f"{DOWNLOAD_DIR}/240229-test1.mp3")
+    assert inotify.wait(1)
+    inotify.close()